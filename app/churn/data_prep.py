@@ -8,10 +8,12 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(root_dir)
 
-from app.config import Config
+from app.config import Config, ChurnConfig
 from app.utils.database import DatabaseManager
 from app.utils.file import FileManager
 from app.utils.general_utils import GeneralUtils
+from app.utils.artifact_store import ArtifactStore
+from app.churn.feature_store import ChurnFeatureStore
 
 class Data_Prep_Runner:
     def __init__(self, SCHEMA_NAME, firm_id, CHURN_THRESHOLD):
@@ -25,7 +27,13 @@ class Data_Prep_Runner:
         self.start_time = datetime.fromtimestamp(time.time())
         self.firm_id = firm_id
 
-    def run(self):
+    def run(self) -> bool:
+        """
+        Prepares the churn training and prediction datasets. Errors are logged, not raised.
+
+        Returns:
+            bool: Whether the job succeeded.
+        """
 
         try:
             logging.error(f"Starting job: {self.job_name}")
@@ -40,16 +48,19 @@ class Data_Prep_Runner:
 
                 self.db_manager.delete_all_records(table_name=table)
             
+            use_feature_store = ChurnConfig().dataset_source == 'feature_store'
+
             for q_path in queries:
         
                 if q_path.lower().endswith("v0.sql"):
 
+                    # fills ANALYTIC_CUSTOMER_BASE in the database, no local copy of it is needed
                     self.db_manager.execute_queries(queries=[q_path], start_dt='', end_dt='', schema_name=self.SCHEMA_NAME)
-                    query = f'SELECT * FROM {self.SCHEMA_NAME}_ELT.ANALYTIC_CUSTOMER_BASE'
-                    customer_base_df = self.db_manager.fetch_data_as_df(query)
 
-                    # # save customer base df as parquet file.
-                    customer_base_df.to_parquet(f"data/churn/TR_{self.SCHEMA_NAME}_churn_custBase.parquet", index=False)
+                elif use_feature_store:
+
+                    # the datasets of V1.sql and V3.sql are materialized from the feature store below
+                    continue
 
                 else:
                         
@@ -62,18 +73,48 @@ class Data_Prep_Runner:
                         
                         if q_path.lower().endswith("v1.sql"): # train dataset
 
-                            churn_train_df = self.db_manager.fetch_data_as_df(query)
+                            churn_train_df = self.db_manager.fetch_data_as_df(query, template=q_path)
 
-                            churn_train_df.to_parquet(f"data/churn/TR_{self.SCHEMA_NAME}_churn_dataset.parquet", index=False)
+                            ArtifactStore.put(f"data/churn/TR_{self.SCHEMA_NAME}_churn_dataset.parquet", churn_train_df,
+                                              checkpoint=ChurnConfig().parquet_checkpoints)
 
                         else: 
 
-                            churn_prediction_df = self.db_manager.fetch_data_as_df(query)
+                            churn_prediction_df = self.db_manager.fetch_data_as_df(query, template=q_path)
 
-                            churn_prediction_df.to_parquet(f"data/churn/PR_{self.SCHEMA_NAME}_churn_dataset.parquet", index=False)
+                            # sorted by customer in row groups of one scoring batch, so it can be scored in a stream
+                            churn_prediction_df = churn_prediction_df.sort_values('UNIQUE_CUSTOMER_ID', kind='stable')
+                            ArtifactStore.put(f"data/churn/PR_{self.SCHEMA_NAME}_churn_dataset.parquet", churn_prediction_df,
+                                              checkpoint=ChurnConfig().parquet_checkpoints,
+                                              row_group_size=ChurnConfig().scoring_batch_rows)
 
+            if use_feature_store:
+
+                self.run_feature_store()
+
+            return True
 
         except Exception as e:
 
             logging.error(f"Error during job: {e}")
-
+            return False
+
+    def run_feature_store(self):
+        """
+        Updates the churn feature store with the transactions since its last update and materializes the
+        training and prediction datasets from it.
+        """
+        store = ChurnFeatureStore(self.SCHEMA_NAME)
+        store.update(self.db_manager)
+
+        churn_train_df = store.training_dataset(int(float(self.CHURN_THRESHOLD)))
+        ArtifactStore.put(f"data/churn/TR_{self.SCHEMA_NAME}_churn_dataset.parquet", churn_train_df,
+                          checkpoint=ChurnConfig().parquet_checkpoints)
+
+        churn_prediction_df = store.prediction_dataset().sort_values('UNIQUE_CUSTOMER_ID', kind='stable')
+        ArtifactStore.put(f"data/churn/PR_{self.SCHEMA_NAME}_churn_dataset.parquet", churn_prediction_df,
+                          checkpoint=ChurnConfig().parquet_checkpoints,
+                          row_group_size=ChurnConfig().scoring_batch_rows)
+
+        logging.info(f"Churn datasets of {self.SCHEMA_NAME} materialized from the feature store: "
+                     f"{len(churn_train_df):,} training and {len(churn_prediction_df):,} prediction rows.")
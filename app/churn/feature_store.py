@@ -0,0 +1,473 @@
+import json
+import logging
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+from app.config import ChurnConfig
+from app.utils.transaction_extract import TransactionExtract
+
+KEYS = ['UNIQUE_CUSTOMER_ID', 'DWH_PROGRAM_ID']
+
+# merge rule of every aggregate column (AMOUNT_M2 is merged with the group means, see merge)
+AGGREGATES = {
+    'FIRM_ID': 'last',
+    'PROGRAM_NAME': 'last',
+    'FIRST_DATE': 'min',
+    'LAST_DATE': 'max',
+    'N_ALL': 'sum',
+    'N': 'sum',
+    'AMOUNT_SUM': 'sum',
+    'AMOUNT_MIN': 'min',
+    'AMOUNT_MAX': 'max',
+    'GAP_SUM': 'sum',
+    'GAP_COUNT': 'sum',
+    'DISCOUNT_SUM': 'sum',
+    'DISCOUNT_COUNT': 'sum',
+    'USED_POINT_SUM': 'sum',
+    'USED_POINT_COUNT': 'sum',
+    'EARNED_POINT_SUM': 'sum'
+}
+
+class BasketSketch:
+    """
+    Mergeable log-bucket sketch of basket sizes with relative accuracy alpha.
+
+    A value v maps to the bucket ceil(log_gamma(|v|)) with gamma = (1 + alpha) / (1 - alpha), and the
+    bucket is represented by 2 * gamma^k / (gamma + 1), which is within alpha of every value in it.
+    Bucket keys keep the order of the values: 0 holds zero, negative values get negated keys.
+    Sketches merge by adding the counts of equal keys.
+    """
+
+    OFFSET = 1 << 20
+
+    def __init__(self, alpha: float = 0.01) -> None:
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = np.log(self.gamma)
+
+    def keys(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        magnitude = np.abs(values)
+        keys = np.zeros(len(values), dtype=np.int64)
+        nonzero = magnitude >= 1e-9
+        keys[nonzero] = np.ceil(np.log(magnitude[nonzero]) / self.log_gamma).astype(np.int64) + self.OFFSET
+        return np.where(values < 0, -keys, keys)
+
+    def values(self, keys: np.ndarray) -> np.ndarray:
+        keys = np.asarray(keys, dtype=np.int64)
+        magnitude = 2 * self.gamma ** (np.abs(keys) - self.OFFSET).astype(np.float64) / (self.gamma + 1)
+        return np.where(keys == 0, 0.0, np.sign(keys) * magnitude)
+
+    def medians(self, sketch: pd.DataFrame) -> pd.Series:
+        """
+        PERCENTILE_CONT(0.5) of every group of a sketch frame with the columns KEYS, BUCKET and COUNT.
+        """
+        if sketch.empty:
+            return pd.Series(dtype=np.float64, index=pd.MultiIndex.from_arrays([[], []], names=KEYS))
+
+        sketch = sketch.sort_values(KEYS + ['BUCKET'], kind='stable')
+        codes = sketch.groupby(KEYS, sort=False).ngroup().to_numpy()
+        starts = np.flatnonzero(np.diff(codes, prepend=-1))
+
+        counts = sketch['COUNT'].to_numpy(dtype=np.int64)
+        cumulative = np.cumsum(counts)
+        before = cumulative[starts] - counts[starts]
+        n = np.add.reduceat(counts, starts)
+
+        # linear interpolation between the values at the ranks floor and ceil of 0.5 * (n - 1)
+        position = 0.5 * (n - 1)
+        lower = np.searchsorted(cumulative, before + np.floor(position), side='right')
+        upper = np.searchsorted(cumulative, before + np.ceil(position), side='right')
+        values = self.values(sketch['BUCKET'].to_numpy())
+        medians = values[lower] + (position - np.floor(position)) * (values[upper] - values[lower])
+
+        index = pd.MultiIndex.from_frame(sketch[KEYS].iloc[starts])
+        return pd.Series(medians, index=index)
+
+
+class ChurnFeatureStore:
+    """
+    Local store of mergeable per (UNIQUE_CUSTOMER_ID, DWH_PROGRAM_ID) transaction aggregates of a firm,
+    from which the churn training (V1.sql) and prediction (V3.sql) datasets are materialized.
+
+    The store holds one partition per transaction day under data/churn/feature_store/{schema_name}/days/
+    and a snapshot folding all days before snapshot_date. Every partition has the aggregates (counts, sums,
+    centered sums of squares, min/max, first/last dates, gaps to the previous transaction) and a basket
+    size sketch for the median. update loads only the days from the watermark on (and the last
+    feature_store_reload_days days again, for late transactions) from the shared transaction extract
+    (app/utils/transaction_extract.py). After a full refresh of the extract, which picks up deleted and
+    state-changed transactions of any date, the days of the retention window (or, with
+    feature_store_full_refresh_reload = 'all', the whole store) are reloaded.
+
+    Cutoffs are applied at day granularity: the training cutoff is midnight of SYSDATE - CHURN_THRESHOLD,
+    and the prediction dataset holds the transactions up to yesterday.
+    """
+
+    def __init__(self, schema_name: str, store_dir: str = None) -> None:
+        self.schema_name = schema_name
+        self.parameters = ChurnConfig()
+        self.store_dir = store_dir or os.path.join("data", "churn", "feature_store", schema_name)
+        self.manifest_path = os.path.join(self.store_dir, "manifest.json")
+        self.snapshot_dir = os.path.join(self.store_dir, "snapshot")
+        self.days_dir = os.path.join(self.store_dir, "days")
+        self.sketch = BasketSketch(self.parameters.feature_store_sketch_accuracy)
+        self.extract = TransactionExtract(schema_name)
+
+    def load_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {"snapshot_date": None, "watermark": None, "sketch_accuracy": self.sketch.alpha}
+
+        with open(self.manifest_path, "r", encoding="UTF-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: dict) -> None:
+        manifest["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="UTF-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def days(self) -> list:
+        """
+        Days of the stored partitions, oldest first.
+        """
+        if not os.path.isdir(self.days_dir):
+            return []
+        return sorted(pd.Timestamp(day) for day in os.listdir(self.days_dir) if not day.endswith(".tmp"))
+
+    def _partition_dir(self, day: pd.Timestamp) -> str:
+        return os.path.join(self.days_dir, day.strftime("%Y-%m-%d"))
+
+    @staticmethod
+    def _write_partition(path: str, aggregates: pd.DataFrame, sketch: pd.DataFrame) -> None:
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        aggregates.to_parquet(os.path.join(tmp_path, "aggregates.parquet"), index=False)
+        sketch.to_parquet(os.path.join(tmp_path, "sketch.parquet"), index=False)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_partition(path: str, with_sketch: bool = True) -> tuple:
+        aggregates = pd.read_parquet(os.path.join(path, "aggregates.parquet"))
+        sketch = pd.read_parquet(os.path.join(path, "sketch.parquet")) if with_sketch else None
+        return aggregates, sketch
+
+    def aggregate(self, transactions: pd.DataFrame, last_seen: pd.Series) -> tuple:
+        """
+        Aggregates transactions per (UNIQUE_CUSTOMER_ID, DWH_PROGRAM_ID, DAY).
+
+        The gap of a transaction is measured to the previous transaction of the customer in any program
+        (the LAG of V1.sql/V3.sql), which for the first transaction of a customer in this extract is the
+        last transaction date in last_seen.
+
+        Args:
+            transactions (pd.DataFrame): Rows of TransactionExtract.churn_transactions.
+            last_seen (pd.Series): Last valid transaction date per UNIQUE_CUSTOMER_ID before the extract.
+
+        Returns:
+            tuple: (aggregates, sketch, updated last_seen)
+        """
+        transactions = transactions[transactions['TRANSACTION_DATE'].notna()].copy()
+        transactions['TRANSACTION_DATE'] = pd.to_datetime(transactions['TRANSACTION_DATE'])
+        transactions['DAY'] = transactions['TRANSACTION_DATE'].dt.normalize()
+        group_cols = KEYS + ['DAY']
+
+        # transactions after the churn cutoff are counted with missing amounts as well
+        n_all = transactions.groupby(group_cols).size().rename('N_ALL')
+
+        valid = transactions[transactions['AMOUNT_AFTER_DISCOUNT'].notna()]
+        valid = valid.sort_values(['UNIQUE_CUSTOMER_ID', 'TRANSACTION_DATE'], kind='stable')
+        previous = valid.groupby('UNIQUE_CUSTOMER_ID')['TRANSACTION_DATE'].shift()
+        if last_seen is not None:
+            first_rows = previous.isna()
+            previous[first_rows] = valid.loc[first_rows, 'UNIQUE_CUSTOMER_ID'].map(last_seen)
+
+        amount = valid['AMOUNT_AFTER_DISCOUNT'].astype(np.float64)
+        discount = valid['AMOUNT_DISCOUNT'].astype(np.float64)
+        used_point = valid['AMOUNT_USED_POINT'].astype(np.float64)
+        earned_point = valid['AMOUNT_EARNED_POINT'].astype(np.float64)
+
+        valid = valid[group_cols + ['FIRM_ID', 'PROGRAM_NAME', 'TRANSACTION_DATE']].assign(
+            AMOUNT=amount,
+            GAP=(valid['TRANSACTION_DATE'] - previous).dt.total_seconds() / 86400,
+            DISCOUNT=discount.where(discount > 0, 0),
+            IS_DISCOUNTED=(discount > 0).astype(np.int64),
+            USED_POINT=used_point.where(used_point > 0, 0),
+            IS_POINT_USED=(used_point > 0).astype(np.int64),
+            EARNED_POINT=earned_point.where(earned_point > 0, 0)
+        )
+        grouped = valid.groupby(group_cols)
+        aggregates = grouped.agg(
+            FIRM_ID=('FIRM_ID', 'last'),
+            PROGRAM_NAME=('PROGRAM_NAME', 'last'),
+            FIRST_DATE=('TRANSACTION_DATE', 'min'),
+            LAST_DATE=('TRANSACTION_DATE', 'max'),
+            N=('AMOUNT', 'size'),
+            AMOUNT_SUM=('AMOUNT', 'sum'),
+            AMOUNT_MIN=('AMOUNT', 'min'),
+            AMOUNT_MAX=('AMOUNT', 'max'),
+            GAP_SUM=('GAP', 'sum'),
+            GAP_COUNT=('GAP', 'count'),
+            DISCOUNT_SUM=('DISCOUNT', 'sum'),
+            DISCOUNT_COUNT=('IS_DISCOUNTED', 'sum'),
+            USED_POINT_SUM=('USED_POINT', 'sum'),
+            USED_POINT_COUNT=('IS_POINT_USED', 'sum'),
+            EARNED_POINT_SUM=('EARNED_POINT', 'sum')
+        )
+        mean = grouped['AMOUNT'].transform('mean')
+        aggregates['AMOUNT_M2'] = ((valid['AMOUNT'] - mean) ** 2).groupby([valid[col] for col in group_cols]).sum()
+
+        aggregates = aggregates.join(n_all, how='outer')
+        count_cols = ['N', 'GAP_COUNT', 'DISCOUNT_COUNT', 'USED_POINT_COUNT']
+        aggregates[count_cols] = aggregates[count_cols].fillna(0).astype(np.int64)
+        aggregates = aggregates.reset_index()
+
+        sketch = (valid.assign(BUCKET=self.sketch.keys(valid['AMOUNT'].to_numpy()))
+                  .groupby(group_cols + ['BUCKET']).size().rename('COUNT').reset_index())
+
+        if not valid.empty:
+            latest = valid.groupby('UNIQUE_CUSTOMER_ID')['TRANSACTION_DATE'].max()
+            last_seen = latest if last_seen is None or last_seen.empty else \
+                pd.concat([last_seen, latest]).groupby(level=0).max()
+
+        return aggregates, sketch, last_seen
+
+    @staticmethod
+    def merge(aggregates: list, sketches: list = None) -> tuple:
+        """
+        Merges aggregate partitions (and sketches) into one row per (UNIQUE_CUSTOMER_ID, DWH_PROGRAM_ID).
+        """
+        frames = [frame for frame in aggregates if frame is not None and not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=KEYS + list(AGGREGATES) + ['AMOUNT_M2']), \
+                pd.DataFrame(columns=KEYS + ['BUCKET', 'COUNT'])
+
+        data = pd.concat(frames, ignore_index=True)
+        grouped = data.groupby(KEYS)
+        merged = grouped.agg(AGGREGATES)
+
+        # centered sums of squares of the parts combine around the mean of the whole group
+        part_mean = data['AMOUNT_SUM'] / data['N'].where(data['N'] > 0)
+        group_mean = grouped['AMOUNT_SUM'].transform('sum') / grouped['N'].transform('sum')
+        deviation = (data['AMOUNT_M2'].fillna(0) + data['N'] * (part_mean - group_mean) ** 2).fillna(0)
+        merged['AMOUNT_M2'] = deviation.groupby([data[col] for col in KEYS]).sum()
+        merged = merged.reset_index()
+
+        sketch = None
+        if sketches is not None:
+            sketch_frames = [frame for frame in sketches if frame is not None and not frame.empty]
+            sketch = (pd.concat(sketch_frames, ignore_index=True).groupby(KEYS + ['BUCKET'])['COUNT'].sum().reset_index()
+                      if sketch_frames else pd.DataFrame(columns=KEYS + ['BUCKET', 'COUNT']))
+
+        return merged, sketch
+
+    def load_state(self, since: pd.Timestamp = None, until: pd.Timestamp = None, with_sketch: bool = True) -> tuple:
+        """
+        Merges the snapshot (unless since is given) and the day partitions in [since, until).
+        """
+        aggregates, sketches = [], []
+        if since is None and os.path.isdir(self.snapshot_dir):
+            snapshot, snapshot_sketch = self._read_partition(self.snapshot_dir, with_sketch)
+            aggregates.append(snapshot)
+            sketches.append(snapshot_sketch)
+
+        for day in self.days():
+            if (since is not None and day < since) or (until is not None and day >= until):
+                continue
+            day_aggregates, day_sketch = self._read_partition(self._partition_dir(day), with_sketch)
+            aggregates.append(day_aggregates)
+            sketches.append(day_sketch)
+
+        return self.merge(aggregates, sketches if with_sketch else None)
+
+    def update(self, db_manager, today: datetime = None) -> dict:
+        """
+        Loads the transactions from the watermark (minus feature_store_reload_days) up to yesterday into
+        day partitions, month by month, and folds the days older than feature_store_retention_days into
+        the snapshot. An empty store is backfilled from the first transaction of the firm, and the store is
+        reloaded as set by feature_store_full_refresh_reload when the extract was fully refreshed since the
+        last update.
+
+        Returns:
+            dict: The updated manifest.
+        """
+        today = pd.Timestamp(today or datetime.now()).normalize()
+        manifest = self.load_manifest()
+        if manifest["sketch_accuracy"] != self.sketch.alpha:
+            raise ValueError(f"The feature store of {self.schema_name} was built with sketch accuracy "
+                             f"{manifest['sketch_accuracy']}, remove {self.store_dir} to rebuild it.")
+
+        # the transactions are read from the shared extract, refreshed here unless another module did it today
+        full_refresh_on = self.extract.refresh(db_manager, today)["full_refresh_on"]
+        reload = self.parameters.feature_store_full_refresh_reload
+        if reload not in ('retention', 'all', 'none'):
+            raise ValueError(f"Invalid feature_store_full_refresh_reload: {reload}. Allowed values are 'retention', 'all', 'none'.")
+        full_refresh = (manifest["watermark"] is not None and reload != 'none'
+                        and manifest.get("extract_full_refresh_on") != full_refresh_on)
+        if full_refresh:
+            logging.info(f"Transaction extract of {self.schema_name} was fully refreshed on {full_refresh_on}, "
+                         f"reloading the churn feature store ({reload}).")
+            if reload == 'all':
+                manifest = {"snapshot_date": None, "watermark": None, "sketch_accuracy": self.sketch.alpha}
+
+        snapshot_date = pd.Timestamp(manifest["snapshot_date"]) if manifest["snapshot_date"] else None
+        if manifest["watermark"] is None or (full_refresh and snapshot_date is None):
+            shutil.rmtree(self.store_dir, ignore_errors=True)
+            first_date = self.extract.first_transaction_date()
+            first_date = first_date.normalize() if first_date is not None else None
+            start = max(first_date, pd.Timestamp(self.parameters.feature_store_start_dt)) if first_date is not None else today
+        elif full_refresh:
+            # the snapshot is kept, every day partition after it is reloaded
+            start = snapshot_date
+        else:
+            start = min(pd.Timestamp(manifest["watermark"]), today - pd.Timedelta(days=self.parameters.feature_store_reload_days))
+            start = max(start, snapshot_date) if snapshot_date is not None else start
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        boundary = today - pd.Timedelta(days=self.parameters.feature_store_retention_days)
+        if snapshot_date is not None:
+            boundary = max(boundary, snapshot_date)
+
+        # the gaps of the reloaded days are measured from the state before them
+        state, _ = self.load_state(until=start, with_sketch=False)
+        last_seen = state.groupby('UNIQUE_CUSTOMER_ID')['LAST_DATE'].max() if not state.empty else None
+        for day in self.days():
+            if day >= start:
+                shutil.rmtree(self._partition_dir(day))
+
+        folded, folded_sketches = [], []
+        loaded_rows = 0
+        window_starts = [start] + [month for month in pd.date_range(start, today, freq='MS') if month > start]
+        for window_start, window_end in zip(window_starts, window_starts[1:] + [today]):
+            if window_start >= window_end:
+                continue
+            transactions = self.extract.churn_transactions(window_start, window_end)
+            loaded_rows += len(transactions)
+            aggregates, sketch, last_seen = self.aggregate(transactions, last_seen)
+
+            # days that are already past the retention go straight into the snapshot
+            old = aggregates['DAY'] < boundary
+            if old.any():
+                merged, merged_sketch = self.merge(folded + [aggregates[old].drop(columns='DAY')],
+                                                   folded_sketches + [sketch[sketch['DAY'] < boundary].drop(columns='DAY')])
+                folded, folded_sketches = [merged], [merged_sketch]
+
+            sketch_by_day = dict(tuple(sketch[sketch['DAY'] >= boundary].groupby('DAY')))
+            for day, day_aggregates in aggregates[~old].groupby('DAY'):
+                self._write_partition(self._partition_dir(day), day_aggregates.drop(columns='DAY'),
+                                      sketch_by_day[day].drop(columns='DAY') if day in sketch_by_day
+                                      else sketch.iloc[:0].drop(columns='DAY'))
+
+        # fold the partitions that left the retention window into the snapshot
+        expired = [day for day in self.days() if day < boundary]
+        if folded or expired:
+            snapshot = [self._read_partition(self.snapshot_dir)] if os.path.isdir(self.snapshot_dir) else []
+            expired_partitions = [self._read_partition(self._partition_dir(day)) for day in expired]
+            parts = snapshot + expired_partitions + list(zip(folded, folded_sketches))
+            self._write_partition(self.snapshot_dir, *self.merge([part[0] for part in parts], [part[1] for part in parts]))
+            for day in expired:
+                shutil.rmtree(self._partition_dir(day))
+            manifest["snapshot_date"] = boundary.strftime("%Y-%m-%d")
+
+        manifest["watermark"] = today.strftime("%Y-%m-%d")
+        manifest["extract_full_refresh_on"] = full_refresh_on
+        self._save_manifest(manifest)
+        logging.info(f"Churn feature store of {self.schema_name} updated with {loaded_rows:,} transactions "
+                     f"from {start:%Y-%m-%d} to {today:%Y-%m-%d}.")
+
+        return manifest
+
+    def materialize(self, state: pd.DataFrame, sketch: pd.DataFrame, reference_date: pd.Timestamp) -> pd.DataFrame:
+        """
+        Computes the dataset columns of V1.sql/V3.sql from merged aggregates, keeping the customers with more
+        than 3 transactions and a total spend above 100.
+        """
+        state = state[(state['N'] > 3) & (state['AMOUNT_SUM'] > 100)].reset_index(drop=True)
+        n = state['N'].astype(np.float64)
+        one_day = pd.Timedelta(days=1)
+        medians = self.sketch.medians(sketch).reindex(pd.MultiIndex.from_frame(state[KEYS])).to_numpy()
+
+        return pd.DataFrame({
+            'UNIQUE_CUSTOMER_ID': state['UNIQUE_CUSTOMER_ID'],
+            'DWH_PROGRAM_ID': state['DWH_PROGRAM_ID'],
+            'PROGRAM_NAME': state['PROGRAM_NAME'],
+            'FIRM_ID': state['FIRM_ID'],
+            'FIRST_TRANSACTION_DATE': state['FIRST_DATE'],
+            'LAST_TRANSACTION_DATE': state['LAST_DATE'],
+            'TOTAL_TRANSACTIONS': state['N'],
+            'TOTAL_SPENT': state['AMOUNT_SUM'],
+            'AVG_SPENT': state['AMOUNT_SUM'] / n,
+            'MAX_SPENT': state['AMOUNT_MAX'],
+            'MIN_SPENT': state['AMOUNT_MIN'],
+            'DAYS_SINCE_LAST_TRANSACTION': (reference_date - state['LAST_DATE']) / one_day,
+            'CUSTOMER_LIFETIME': (state['LAST_DATE'] - state['FIRST_DATE']) / one_day,
+            'DISTINCT_TRANSACTIONS': state['N'],
+            'AVG_DAYS_BETWEEN_TRANSACTIONS': state['GAP_SUM'] / state['GAP_COUNT'].where(state['GAP_COUNT'] > 0),
+            'MEDIAN_BASKET_SIZE': medians,
+            # Oracle STDDEV is the sample standard deviation, and 0 for a single row
+            'BASKET_SIZE_STDDEV': np.sqrt(np.clip(state['AMOUNT_M2'] / (n - 1).where(n > 1), 0, None)).fillna(0),
+            'TOTAL_DISCOUNT_EARNED': state['DISCOUNT_SUM'],
+            'DISCOUNTED_TRANSACTIONS': state['DISCOUNT_COUNT'],
+            'TOTAL_USED_POINT': state['USED_POINT_SUM'],
+            'TOTAL_EARNED_POINT': state['EARNED_POINT_SUM'],
+            'POINT_USED_TRANSACTIONS': state['USED_POINT_COUNT']
+        })
+
+    def _check_loaded(self, first_day: pd.Timestamp) -> None:
+        manifest = self.load_manifest()
+        if manifest["watermark"] is None:
+            raise ValueError(f"The churn feature store of {self.schema_name} is empty, run update first.")
+        if manifest["snapshot_date"] and pd.Timestamp(manifest["snapshot_date"]) > first_day:
+            raise ValueError(f"Day partitions of {self.schema_name} start at {manifest['snapshot_date']}, after "
+                             f"{first_day:%Y-%m-%d}; increase feature_store_retention_days and rebuild the store.")
+
+    def training_dataset(self, churn_threshold: int, now: datetime = None, seed: int = None) -> pd.DataFrame:
+        """
+        Materializes the training dataset of V1.sql: features of the transactions before the cutoff and
+        IS_CHURN = 1 for customers without transactions after it, sampled to feature_store_training_rows rows.
+        """
+        now = pd.Timestamp(now or datetime.now())
+        cutoff = (now - pd.Timedelta(days=churn_threshold)).normalize()
+        self._check_loaded(cutoff)
+
+        state, sketch = self.load_state(until=cutoff)
+        after, _ = self.load_state(since=cutoff, with_sketch=False)
+
+        data = self.materialize(state, sketch, cutoff).rename(
+            columns={'LAST_TRANSACTION_DATE': 'LAST_TRANSACTION_BEFORE_CUTOFF'})
+        after_cutoff = after.set_index(KEYS)['N_ALL'].reindex(pd.MultiIndex.from_frame(data[KEYS]))
+        position = data.columns.get_loc('CUSTOMER_LIFETIME') + 1
+        data.insert(position, 'TRANSACTIONS_AFTER_CUTOFF', after_cutoff.fillna(0).astype(np.int64).to_numpy())
+        data.insert(position + 1, 'IS_CHURN', (data['TRANSACTIONS_AFTER_CUTOFF'] == 0).astype(np.int64))
+
+        data = data[(data['IS_CHURN'] == 0) | (data['DAYS_SINCE_LAST_TRANSACTION'] <= churn_threshold)]
+
+        rng = np.random.default_rng(seed)
+        data = data.iloc[rng.permutation(len(data))[:self.parameters.feature_store_training_rows]].reset_index(drop=True)
+        data['RND'] = rng.random(len(data))
+
+        return data
+
+    def prediction_dataset(self, now: datetime = None) -> pd.DataFrame:
+        """
+        Materializes the prediction dataset of V3.sql from all loaded transactions.
+        """
+        now = pd.Timestamp(now or datetime.now())
+        self._check_loaded(now.normalize())
+
+        data = self.materialize(*self.load_state(), now)
+        data['IS_CHURN'] = 0
+
+        return data
@@ -24,10 +24,18 @@ sys.path.append(root_dir)
 from app.utils.general_utils import GeneralUtils, Analytical_Utils
 from app.utils.database import DatabaseManager
 from app.config import Config, ChurnConfig
+from app.churn.registry import ModelRegistry
+from app.utils.thread_budget import ThreadBudget
+from app.utils.artifact_store import ArtifactStore
+from app.utils.memory_profiler import memory_stage
+from app.utils.metrics import MODEL_TRAINING_DURATION, MODEL_TRAINING_ROWS, ROWS_PROCESSED, tenant
 
 
 class Churn:
 
+    # columns of CHURN_PERFORMANCE_METRICS added for the training budget, see db_queries/churn/CHURN_PERFORMANCE_METRICS-sampling.sql
+    SAMPLING_COLUMNS = ['TRAIN_ROWS', 'SAMPLED_TRAIN_ROWS', 'SAMPLING_RATIO', 'SAMPLING_STRATEGY', 'AUC_UNWEIGHTED']
+
     def __init__(self, firm_id: int, schema_name: str) -> None:
         self.firm_id = firm_id
         self.schema_name = schema_name
@@ -37,31 +45,49 @@ class Churn:
         self.parameters = ChurnConfig()
 
         self.MODEL_ID = GeneralUtils.generate_random_id()
+        # handed over in memory by the data preparation when it ran in this process, Parquet checkpoints otherwise
+        self.train_path = f"data/churn/TR_{self.schema_name}_churn_dataset.parquet"
+        self.predict_path = f"data/churn/PR_{self.schema_name}_churn_dataset.parquet"
+
+        # training sample within the row/seconds budget, weighted back to the population when applied
+        self.sampling = {'TRAIN_ROWS': None, 'SAMPLED_TRAIN_ROWS': None, 'SAMPLING_RATIO': 1.0, 'SAMPLING_STRATEGY': 'none'}
+        self.sample_weight = None
 
+        self.registry = ModelRegistry(self.schema_name, keep_versions=self.parameters.registry_keep_versions)
+        self.thread_budget = ThreadBudget(f"churn_{self.schema_name}", total_cores=self.parameters.cpu_budget)
 
         self.db_manager = DatabaseManager(self.schema_name)
         self.start_time = time.time()        
 
     def train_data_prep(self):
         # read data
-        data = self.utils.reduce_mem(pd.read_parquet(f"data/churn/TR_{self.schema_name}_churn_dataset.parquet"))
-
-        ## detect and supress cols with extreme values (outliers)
-        df_list = []
-        for program in data.DWH_PROGRAM_ID.unique():
-            for i in range(2):
-                df = data[(data.DWH_PROGRAM_ID == program) & (data.IS_CHURN.astype('int') == i)]
-                supress_cols = self.analytic_utils.detect_extreme_outlier_columns(df)
-                id_cols = ['UNIQUE_CUSTOMER_ID', 'DWH_PROGRAM_ID', 'RND']
-                supress_cols = [col for col in supress_cols if col not in id_cols]
-                
-                df = Analytical_Utils.suppress_outliers(df, supress_cols)
-                for col in supress_cols:
-                    df[col] = df[f"{col}_sqrt"]
-                df = df.drop(columns=[f"{col}_sqrt" for col in supress_cols])
-                df_list.append(df)
-
-        supressed_data = pd.concat(df_list)
+        data = ArtifactStore.read_pandas(self.train_path)
+        ArtifactStore.release(self.train_path)
+
+        ## detect and supress cols with extreme values (outliers) per program and target class
+        program_codes, _ = pd.factorize(data['DWH_PROGRAM_ID'])
+        is_churn = data['IS_CHURN'].astype('int').to_numpy()
+        group_ids = np.where((program_codes >= 0) & np.isin(is_churn, (0, 1)), program_codes * 2 + is_churn, -1)
+
+        # stratified sample by program and target class when the tenant exceeds the training budget
+        self.sampling.update(TRAIN_ROWS=len(data), SAMPLED_TRAIN_ROWS=len(data))
+        budget, strategy = self.training_row_budget()
+        if budget is not None and len(data) > budget:
+            positions, weights = self.analytic_utils.stratified_sample(
+                group_ids, budget, self.parameters.sampling_min_rows_per_stratum)
+            data = data.iloc[positions]
+            group_ids = group_ids[positions]
+            self.sample_weight = pd.Series(weights, index=data.index)
+            self.sampling.update(SAMPLED_TRAIN_ROWS=len(data), SAMPLING_RATIO=round(len(data) / self.sampling['TRAIN_ROWS'], 6),
+                                 SAMPLING_STRATEGY=f"stratified_{strategy}")
+            logging.info(f"{self.schema_name}: training on a stratified sample of {len(data):,} of "
+                         f"{self.sampling['TRAIN_ROWS']:,} rows ({strategy} budget), "
+                         f"{int((group_ids < 0).sum()):,} rows without a program or target class kept unweighted.")
+
+        id_cols = ['UNIQUE_CUSTOMER_ID', 'DWH_PROGRAM_ID', 'RND']
+        supressed_data = self.analytic_utils.suppress_outliers_by_group(data, group_ids, exclude_cols=id_cols)
+        del data
+
         val_counts = supressed_data.IS_CHURN.value_counts()
         print(f"\n{self.schema_name}: DISTRIBUTION OF TARGET VARIABLE IN THE TRAIN DATASET\n{val_counts}")
 
@@ -81,9 +107,10 @@ class Churn:
         
         return X_train, X_val, y_train, y_val
 
-    def predict_data_prep(self):
-        # read data
-        data = self.utils.reduce_mem(pd.read_parquet(f"data/churn/PR_{self.schema_name}_churn_dataset.parquet"))
+    def predict_data_prep(self, data: pd.DataFrame = None):
+        # read data (streaming scoring passes one chunk of the dataset)
+        if data is None:
+            data = ArtifactStore.read_pandas(self.predict_path)
         
         features_to_round = self.parameters.cols_to_round
         data[features_to_round] = data[features_to_round].fillna(0).round(0).astype('int')
@@ -101,7 +128,35 @@ class Churn:
 
         return X, customer_info
 
-    def create_performance_metrics_df(self, auc, accuracy, precision, recall, f1, cm):
+    def training_row_budget(self) -> tuple:
+        """
+        Returns the number of training rows allowed by training_row_budget and training_seconds_budget, and
+        which budget applies ('rows' or 'seconds'), or (None, 'none') when neither is set.
+
+        The seconds budget is converted to rows with the training throughput of the latest fully trained
+        model version in the registry, so it only applies from the second training of a firm on.
+        """
+        budgets = {}
+        if self.parameters.training_row_budget:
+            budgets['rows'] = self.parameters.training_row_budget
+
+        if self.parameters.training_seconds_budget:
+            trained = [entry for entry in self.registry.load_index()["versions"]
+                       if entry.get("training") and entry["warm_started_from"] is None]
+            if trained:
+                rows_per_second = trained[-1]["training"]["rows"] / max(trained[-1]["training"]["seconds"], 1e-3)
+                budgets['seconds'] = int(self.parameters.training_seconds_budget * rows_per_second)
+            else:
+                logging.info(f"{self.schema_name}: no training throughput recorded yet, "
+                             f"training_seconds_budget is not applied.")
+
+        if not budgets:
+            return None, 'none'
+
+        strategy = min(budgets, key=budgets.get)
+        return budgets[strategy], strategy
+
+    def create_performance_metrics_df(self, auc, accuracy, precision, recall, f1, cm, auc_unweighted=None):
         # Flatten the confusion matrix into individual values (TN, FP, FN, TP)
         tn, fp, fn, tp = cm.ravel()
         # Log date for the metrics
@@ -119,54 +174,291 @@ class Churn:
             'TN': [tn],
             'FP': [fp],
             'FN': [fn],
-            'TP': [tp]
+            'TP': [tp],
+            # training sample and the unweighted validation AUC, equal to AUC when no sampling was applied
+            'TRAIN_ROWS': [self.sampling['TRAIN_ROWS']],
+            'SAMPLED_TRAIN_ROWS': [self.sampling['SAMPLED_TRAIN_ROWS']],
+            'SAMPLING_RATIO': [self.sampling['SAMPLING_RATIO']],
+            'SAMPLING_STRATEGY': [self.sampling['SAMPLING_STRATEGY']],
+            'AUC_UNWEIGHTED': [auc if auc_unweighted is None else auc_unweighted]
         }
         performance_df = pd.DataFrame(perf_data)
         performance_df["CHRN_PRF_METRICS_ID"] = self.MODEL_ID
 
         return performance_df
 
-    def train_model(self, X_train, X_val, y_train, y_val):
+    def is_model_reusable(self, current: dict, features: pd.DataFrame, fingerprint: str) -> bool:
+        """
+        Decides whether the current registered model can be used without retraining: it must have
+        the same features, be younger than max_model_age_days and the PSI of every feature
+        against its training data must stay below drift_psi_threshold.
+        """
+        if current is None or current['features'] != list(features.columns):
+            return False
+
+        if current['fingerprint'] == fingerprint:
+            logging.info(f"{self.schema_name}: training data is unchanged since model version {current['version']}.")
+            return True
+
+        model_age = (datetime.now() - datetime.fromisoformat(current['created_at'])).days
+        if model_age >= self.parameters.max_model_age_days:
+            logging.info(f"{self.schema_name}: model version {current['version']} is {model_age} days old, retraining.")
+            return False
+
+        drift = self.registry.psi(features, current['reference_bins'])
+        max_feature = max(drift, key=drift.get)
+        logging.info(f"{self.schema_name}: max PSI against model version {current['version']} is "
+                     f"{drift[max_feature]:.4f} ({max_feature}).")
+
+        return drift[max_feature] < self.parameters.drift_psi_threshold
+
+    def warm_start_categories(self, init_model, X_train: pd.DataFrame, X_val: pd.DataFrame):
+        """
+        Pins the categories of the categorical features to those the booster to warm-start from was trained
+        with, values it has not seen appended at the end. The trees split on category codes, and the new
+        booster keeps the categories of its training data, so the old trees would read other programs if the
+        categories were rebuilt from the new data.
+
+        Returns:
+            tuple: (X_train, X_val) with the pinned categories, None when the booster has other categorical
+            features and cannot be warm-started from.
+        """
+        categorical = list(X_train.select_dtypes('category').columns)
+        previous = init_model.pandas_categorical or []
+        if len(previous) != len(categorical):
+            return None
+
+        X_train, X_val = X_train.copy(), X_val.copy()
+        for column, categories in zip(categorical, previous):
+            known = set(categories)
+            categories = list(categories) + [value for value in X_train[column].cat.categories.union(X_val[column].cat.categories)
+                                             if value not in known]
+            if list(X_train[column].cat.categories) != categories:
+                logging.info(f"{self.schema_name}: {column} categories are kept in the order of the warm-started model.")
+            X_train[column] = X_train[column].cat.set_categories(categories)
+            X_val[column] = X_val[column].cat.set_categories(categories)
+
+        return X_train, X_val
+
+    def cached_datasets(self, X_train, X_val, y_train, y_val, fingerprint: str, model_params: dict) -> tuple:
+        """
+        Returns the training and validation lgb.Datasets, loaded from LightGBM's binary format when the
+        same data was binned with the same parameters before, otherwise constructed and saved.
+
+        Only the latest key is kept in data/churn/cache/{schema_name}/. The key is the fingerprint of the training
+        data, so the cache is hit when the same data is trained on again: by the training after the tuning search
+        of the same run, or by a rerun after a failed training. Warm starts use the cached datasets as well.
+        """
+        import hashlib
+        import json
+
+        cache_dir = os.path.join("data", "churn", "cache", self.schema_name)
+        # binning only depends on the base parameters: num_threads follows the CPU budget and tuned
+        # parameters are booster parameters
+        # the fingerprint hashes category values, the binned codes depend on the category order as well
+        categories = [X_train[column].cat.categories.tolist() for column in X_train.select_dtypes('category')]
+        key_source = json.dumps([fingerprint, self.parameters.categorical_features, self.parameters.lgbm_params,
+                                 categories, lgb.__version__], sort_keys=True, default=str)
+        key = hashlib.sha256(key_source.encode("UTF-8")).hexdigest()[:16]
+        train_path = os.path.join(cache_dir, f"{key}_train.bin")
+        val_path = os.path.join(cache_dir, f"{key}_val.bin")
+        meta_path = os.path.join(cache_dir, f"{key}_meta.json")
+        self.dataset_cache_paths = (train_path, val_path)
+
+        if all(os.path.exists(path) for path in (train_path, val_path, meta_path)):
+            with open(meta_path, "r", encoding="UTF-8") as f:
+                meta = json.load(f)
+
+            train_data = lgb.Dataset(train_path, params=model_params, free_raw_data=True)
+            # binary files do not hold the pandas category mapping, the booster takes it from the dataset
+            train_data.pandas_categorical = meta["pandas_categorical"]
+            val_data = lgb.Dataset(val_path, reference=train_data, params=model_params, free_raw_data=True)
+            logging.info(f"{self.schema_name}: loaded binned churn datasets {key} from cache.")
+
+            return train_data, val_data
+
         categorical_features = self.parameters.categorical_features
-        model_params = self.parameters.lgbm_params
-    
-        train_data = lgb.Dataset(
-            X_train, label=y_train,
-            categorical_feature=categorical_features,
-            free_raw_data=False
-        )
-        val_data = lgb.Dataset(
-            X_val, label=y_val,
-            categorical_feature=categorical_features,
-            reference=train_data,
-            free_raw_data=False
+        train_data = lgb.Dataset(X_train, label=y_train, weight=self.sample_weights(X_train),
+                                 categorical_feature=categorical_features, params=model_params,
+                                 free_raw_data=True).construct()
+        val_data = lgb.Dataset(X_val, label=y_val, weight=self.sample_weights(X_val),
+                               categorical_feature=categorical_features, reference=train_data,
+                               params=model_params, free_raw_data=True).construct()
+
+        if os.path.isdir(cache_dir):
+            for file_name in os.listdir(cache_dir):
+                os.remove(os.path.join(cache_dir, file_name))
+        os.makedirs(cache_dir, exist_ok=True)
+
+        train_data.save_binary(train_path)
+        val_data.save_binary(val_path)
+        with open(meta_path, "w", encoding="UTF-8") as f:
+            json.dump({"fingerprint": fingerprint, "pandas_categorical": train_data.pandas_categorical}, f, default=str)
+        logging.info(f"{self.schema_name}: saved binned churn datasets {key} to cache.")
+
+        return train_data, val_data
+
+    def sample_weights(self, X: pd.DataFrame):
+        """
+        Weights of the sampled training rows in X, None when the training data was not sampled.
+        """
+        if self.sample_weight is None:
+            return None
+        return self.sample_weight.reindex(X.index).to_numpy()
+
+    def tuned_params(self, X_train, X_val, y_train, y_val, fingerprint: str, model_params: dict) -> dict:
+        """
+        Returns the tuned LightGBM parameters of the firm from tuned_params.json next to its models.
+
+        When they are missing or older than tuning_max_age_days, a successive halving search is run on
+        the cached binary datasets within tuning_time_budget_seconds. Its best parameters are saved only when
+        the search completed; a search that ran out of time is used for this training and run again next time.
+        """
+        import json
+        import math
+        from app.churn.tuning import HyperparameterTuner
+
+        tuned_path = os.path.join(self.registry.model_dir, "tuned_params.json")
+        if os.path.exists(tuned_path):
+            with open(tuned_path, "r", encoding="UTF-8") as f:
+                tuned = json.load(f)
+            tuned_age = (datetime.now() - datetime.fromisoformat(tuned['tuned_at'])).days
+            if tuned_age < self.parameters.tuning_max_age_days:
+                logging.info(f"{self.schema_name}: using tuned parameters from {tuned['tuned_at']}: {tuned['params']}")
+                return tuned['params']
+
+        self.cached_datasets(X_train, X_val, y_train, y_val, fingerprint, model_params)
+        train_path, val_path = self.dataset_cache_paths
+
+        threads = self.thread_budget.current_threads or 1
+        workers = self.parameters.tuning_workers or max(1, min(threads, self.parameters.tuning_trials))
+        tuner = HyperparameterTuner(
+            base_params=self.parameters.lgbm_params,
+            search_space=self.parameters.tuning_search_space,
+            n_trials=self.parameters.tuning_trials,
+            min_rounds=self.parameters.tuning_min_rounds,
+            max_rounds=1000,
+            eta=self.parameters.tuning_eta,
+            time_budget_seconds=self.parameters.tuning_time_budget_seconds,
+            workers=workers,
+            threads_per_worker=max(1, threads // workers)
         )
+        result = tuner.run(train_path, val_path)
+
+        if not math.isfinite(result['auc']):
+            logging.warning(f"{self.schema_name}: no tuning trial finished in {result['elapsed_seconds']}s, "
+                            f"training with the configured parameters.")
+            return {}
+
+        if result['timed_out']:
+            logging.warning(f"{self.schema_name}: tuning stopped at the {self.parameters.tuning_time_budget_seconds}s "
+                            f"budget after {result['rounds']} rounds, best AUC {result['auc']:.4f} with "
+                            f"{result['params']}; the parameters are not saved.")
+            return result['params']
+
+        tuned = dict(result, tuned_at=datetime.now().isoformat(timespec="seconds"), fingerprint=fingerprint)
+        os.makedirs(self.registry.model_dir, exist_ok=True)
+        with open(tuned_path, "w", encoding="UTF-8") as f:
+            json.dump(tuned, f, indent=2, default=str)
+
+        logging.info(f"{self.schema_name}: tuning finished in {result['elapsed_seconds']}s, "
+                     f"best AUC {result['auc']:.4f} with {result['params']}.")
+
+        return result['params']
+
+    def train_model(self, X_train, X_val, y_train, y_val):
+        categorical_features = self.parameters.categorical_features
+        model_params = dict(self.parameters.lgbm_params, num_threads=self.thread_budget.current_threads)
+
+        features = pd.concat([X_train, X_val])
+        fingerprint_frame = features.assign(IS_CHURN=pd.concat([y_train, y_val]))
+        if self.sample_weight is not None:
+            fingerprint_frame['SAMPLE_WEIGHT'] = self.sample_weights(features)
+        fingerprint = self.utils.frame_fingerprint(fingerprint_frame)
+        del fingerprint_frame
+        current = self.registry.current()
+
+        if self.is_model_reusable(current, features, fingerprint):
+            self.model_path = self.registry.model_path(current)
+            self.MODEL_ID = current['model_id']
+            print(f"Model version {current['version']} is reused for {self.schema_name}, training skipped")
+            return None, None
+
+        # continue boosting from the current model while it stays below warm_start_max_trees
+        init_model = None
+        if (current is not None and self.parameters.warm_start and current['features'] == list(X_train.columns)
+                and current['num_trees'] < self.parameters.warm_start_max_trees):
+            init_model = self.registry.load_model(current)
+            aligned = self.warm_start_categories(init_model, X_train, X_val)
+            if aligned is None:
+                init_model = None
+                logging.info(f"{self.schema_name}: categorical features differ from model version "
+                             f"{current['version']}, training a new model.")
+            else:
+                X_train, X_val = aligned
+                print(f"Warm-starting from model version {current['version']} ({current['num_trees']} trees)")
+
+        if self.parameters.tuning:
+            model_params.update(self.tuned_params(X_train, X_val, y_train, y_val, fingerprint, model_params))
+
+        if self.parameters.dataset_cache:
+            train_data, val_data = self.cached_datasets(X_train, X_val, y_train, y_val, fingerprint, model_params)
+            if init_model is not None:
+                # the binned datasets hold no raw features, the initial scores of the previous booster are
+                # predicted from the frames
+                train_data.construct().data = X_train
+                val_data.construct().data = X_val
+        else:
+            train_data = lgb.Dataset(X_train, label=y_train, weight=self.sample_weights(X_train),
+                                     categorical_feature=categorical_features, params=model_params,
+                                     free_raw_data=True)
+            val_data = lgb.Dataset(X_val, label=y_val, weight=self.sample_weights(X_val),
+                                   categorical_feature=categorical_features, reference=train_data,
+                                   params=model_params, free_raw_data=True)
+
+        # the datasets hold the binned features from here on, only the validation frame is still needed
+        reference_bins = self.registry.reference_bins(features)
+        training_rows = len(features)
+        del X_train, y_train, features
+
         callbacks = [
             lgb.early_stopping(stopping_rounds=50, verbose=True),
-            lgb.log_evaluation(period=50)
+            lgb.log_evaluation(period=50),
+            self.thread_budget.lightgbm_callback()
         ]
 
+        training_start = time.time()
         model = lgb.train(
             model_params,
             train_data,
-            num_boost_round=1000,
+            num_boost_round=self.parameters.warm_start_rounds if init_model is not None else 1000,
             valid_sets=[train_data, val_data],
+            init_model=init_model,
             callbacks=callbacks
         )
 
+        training_seconds = round(time.time() - training_start, 3)
+        MODEL_TRAINING_DURATION.observe(training_seconds, firm=tenant(self.schema_name))
+        MODEL_TRAINING_ROWS.set(training_rows, firm=tenant(self.schema_name))
+
         feature_importance_df = self.create_feature_importance_df(model)
 
         y_pred_prob = model.predict(X_val, num_iteration=model.best_iteration)
         y_pred_class = (y_pred_prob >= 0.5).astype(int)
 
-        auc = roc_auc_score(y_val, y_pred_prob)
-        accuracy = accuracy_score(y_val, y_pred_class)
-        precision = precision_score(y_val, y_pred_class)
-        recall = recall_score(y_val, y_pred_class)
-        f1 = f1_score(y_val, y_pred_class)
-        cm = confusion_matrix(y_val, y_pred_class)
+        # metrics of a sampled training set are weighted back to the population of the firm
+        w_val = self.sample_weights(X_val)
+        auc = roc_auc_score(y_val, y_pred_prob, sample_weight=w_val)
+        auc_unweighted = roc_auc_score(y_val, y_pred_prob)
+        accuracy = accuracy_score(y_val, y_pred_class, sample_weight=w_val)
+        precision = precision_score(y_val, y_pred_class, sample_weight=w_val)
+        recall = recall_score(y_val, y_pred_class, sample_weight=w_val)
+        f1 = f1_score(y_val, y_pred_class, sample_weight=w_val)
+        cm = confusion_matrix(y_val, y_pred_class, sample_weight=w_val).round().astype(int)
 
         print(f"Validation AUC: {auc:.4f}")
+        if w_val is not None:
+            print(f"Validation AUC (unweighted sample): {auc_unweighted:.4f}")
         print(f"Accuracy: {accuracy:.4f}")
         print(f"Precision: {precision:.4f}")
         print(f"Recall: {recall:.4f}")
@@ -175,23 +467,27 @@ class Churn:
         print(cm)
 
         # Create performance metrics dataframe with log date and other metrics
-        performance_df = self.create_performance_metrics_df(auc, accuracy, precision, recall, f1, cm)
-
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        model_dir = os.path.join(current_dir, "models")
-        os.makedirs(model_dir, exist_ok=True)
-        model_path = os.path.join(model_dir, f"{self.schema_name}_lgbm_churn.pkl")
-        self.model_path = model_path
-
-        joblib.dump(model, model_path)
+        performance_df = self.create_performance_metrics_df(auc, accuracy, precision, recall, f1, cm, auc_unweighted)
+
+        entry = self.registry.register(
+            model, self.MODEL_ID, fingerprint,
+            metrics={'auc': auc, 'accuracy': accuracy, 'precision': precision, 'recall': recall, 'f1': f1},
+            features=list(X_val.columns),
+            reference_bins=reference_bins,
+            warm_started_from=current['version'] if init_model is not None else None,
+            training={'rows': training_rows, 'seconds': training_seconds,
+                      'sampling_strategy': self.sampling['SAMPLING_STRATEGY']}
+        )
+        self.model_path = self.registry.model_path(entry)
 
         print(f"Model training has been completed for {self.schema_name}")
 
         return performance_df, feature_importance_df
 
-    def predict(self, data, customer_info):
-        model = joblib.load(self.model_path)
-        pred_probs = model.predict(data, num_iteration=model.best_iteration)
+    def predict(self, data, customer_info, model=None):
+        if model is None:
+            model = joblib.load(self.model_path)
+        pred_probs = model.predict(data, num_iteration=model.best_iteration, num_threads=self.thread_budget.current_threads)
         pred_class = (pred_probs >= 0.6).astype(int).round(2)
         
         customer_info['churn_prob'] = pred_probs
@@ -199,6 +495,71 @@ class Churn:
 
         return customer_info
 
+    def score_streaming(self, db_manager: DatabaseManager) -> pd.DataFrame:
+        """
+        Scores the prediction dataset chunk by chunk: every batch of scoring_batch_rows rows is taken from the
+        artifact store (or the Parquet row groups), scored, classified, formatted and inserted into ANALYTIC_CUSTOMER before the next one is read.
+
+        The dataset is sorted by UNIQUE_CUSTOMER_ID by the data preparation, and the rows of the last customer
+        of a batch are carried over to the next one, so every customer is formatted within a single chunk.
+
+        Returns:
+            pd.DataFrame: Compact result columns needed by summarize_results.
+        """
+        path = self.predict_path
+        total_rows = ArtifactStore.num_rows(path)
+        column_stats = ArtifactStore.stats(path)
+        model = joblib.load(self.model_path)
+
+        summary_cols = ['UNIQUE_CUSTOMER_ID', 'IS_CHURN', 'CHURN_CLASS', 'DWH_PROGRAM_ID',
+                        'AVG_DAYS_BETWEEN_TRANSACTIONS', 'DAYS_SINCE_LAST_TRANSACTION', 'CUSTOMER_LIFETIME',
+                        'DISTINCT_TRANSACTIONS', 'AVG_SPENT', 'MAX_SPENT', 'TOTAL_USED_POINT']
+        summary_parts = []
+        scored_rows = 0
+        start = time.time()
+
+        def score_chunk(chunk: pd.DataFrame) -> None:
+            nonlocal scored_rows
+            X, customer_info = self.predict_data_prep(chunk)
+            result = self.postprocessing(self.predict(X, customer_info, model))
+            result['IS_CHURN'] = np.where(result['IS_CHURN'] == 1, 'CHURN', 'CHURN RİSKİ YOK')
+
+            db_manager.insert_data_to_db(self.prep_output(result), "ANALYTIC_CUSTOMER")
+
+            summary = result[summary_cols].copy()
+            summary[['IS_CHURN', 'CHURN_CLASS']] = summary[['IS_CHURN', 'CHURN_CLASS']].astype('category')
+            summary_parts.append(summary)
+
+            scored_rows += len(chunk)
+            elapsed = time.time() - start
+            logging.info(f"{self.schema_name}: scored {scored_rows:,} of {total_rows:,} rows "
+                         f"({scored_rows / max(elapsed, 1e-9):,.0f} rows/s).")
+
+        pending = None
+        for batch in ArtifactStore.iter_batches(path, self.parameters.scoring_batch_rows):
+            data = batch.to_pandas()
+            if pending is not None:
+                data = pd.concat([pending, data], ignore_index=True)
+
+            customer_ids = data['UNIQUE_CUSTOMER_ID']
+            if not customer_ids.is_monotonic_increasing:
+                raise ValueError(f"{path} is not sorted by UNIQUE_CUSTOMER_ID, rerun the churn data preparation "
+                                 f"or use scoring_mode='memory'.")
+
+            is_last_customer = (customer_ids == customer_ids.iloc[-1]).to_numpy()
+            pending = data[is_last_customer]
+            if not is_last_customer.all():
+                score_chunk(self.utils.reduce_mem(data[~is_last_customer].reset_index(drop=True), column_stats))
+
+        if pending is not None and not pending.empty:
+            score_chunk(self.utils.reduce_mem(pending.reset_index(drop=True), column_stats))
+
+        elapsed = time.time() - start
+        print(f"Streaming scoring of {scored_rows:,} rows took {elapsed:.1f}s "
+              f"({scored_rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+        return pd.concat(summary_parts, ignore_index=True) if summary_parts else pd.DataFrame(columns=summary_cols)
+
     def postprocessing(self, data):
         conditions = [
             (data['churn_prob'] < 0.6),
@@ -226,7 +587,7 @@ class Churn:
             "MAX_SPENT": np.median,
             "TOTAL_USED_POINT": np.median
         }
-        summarized_df = data.groupby(by=['IS_CHURN', 'CHURN_CLASS', 'DWH_PROGRAM_ID']).agg(agg_dict).reset_index()
+        summarized_df = data.groupby(by=['IS_CHURN', 'CHURN_CLASS', 'DWH_PROGRAM_ID'], observed=True).agg(agg_dict).reset_index()
         summarized_df = summarized_df.rename(columns= {'UNIQUE_CUSTOMER_ID':'CUSTOMER_COUNT'})
 
         CREATED_BY = self.config.user
@@ -343,45 +704,67 @@ class Churn:
 
 
     def run(self):
-        # train-data prep
-        X_train, X_val, y_train, y_val = self.train_data_prep()
+        # LightGBM, OpenMP and BLAS threads are limited to this job's share of the cores
+        self.thread_budget.acquire()
+
+        try:
+            # train-data prep, train churn prediction model and generate performance metrics
+            # (the training frames are not kept here, so train_model can release them once they are binned)
+            with memory_stage("train"):
+                performance_metrics, feature_importances = self.train_model(*self.train_data_prep())
+            db_manager = DatabaseManager(f"{self.schema_name}_ELT")
+
+            # metrics and importances are only written for newly trained models
+            if performance_metrics is not None:
+                table_name = f"CHURN_PERFORMANCE_METRICS"
+                missing_cols = [col for col in self.SAMPLING_COLUMNS if col not in db_manager.get_table_columns(table_name)]
+                if missing_cols:
+                    logging.warning(f"{self.schema_name}.{table_name} has no columns {', '.join(missing_cols)}, they are not "
+                                    f"stored; add them with db_queries/churn/CHURN_PERFORMANCE_METRICS-sampling.sql.")
+                db_manager.insert_data_to_db(performance_metrics, table_name)
 
-        # predict-data prep
-        X, customer_info = self.predict_data_prep()
+                logging.error(f"CHURN PERFORMANCE METRICS DATAFRAME for CHURN HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
 
-        # train churn prediction model and generate performance metrics
-        performance_metrics, feature_importances = self.train_model(X_train, X_val, y_train, y_val)
-        table_name = f"CHURN_PERFORMANCE_METRICS"
+                table_name = "CHURN_FEATURE_IMPORTANCES"
+                db_manager.insert_data_to_db(feature_importances, table_name)
 
-        db_manager = DatabaseManager(f"{self.schema_name}_ELT")
-        db_manager.insert_data_to_db(performance_metrics, table_name)
+                logging.error(f"CHURN MODEL FEATURE IMPORTANCES DATAFRAME for CHURN HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
 
-        logging.error(f"CHURN PERFORMANCE METRICS DATAFRAME for CHURN HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
+            if self.parameters.scoring_mode == 'streaming':
+                # score, format and insert the prediction dataset chunk by chunk
+                with memory_stage("score"):
+                    result = self.score_streaming(db_manager)
+                logging.error(f"CHURN CUSTOMER RESULT DATAFRAME for CLV and RFM HAS BEEN INSERTED TO {self.schema_name}.ANALYTIC_CUSTOMER")
 
-        table_name = "CHURN_FEATURE_IMPORTANCES"
-        db_manager.insert_data_to_db(feature_importances, table_name)
+            else:
+                with memory_stage("score"):
+                    # predict-data prep
+                    X, customer_info = self.predict_data_prep()
 
-        logging.error(f"CHURN MODEL FEATURE IMPORTANCES DATAFRAME for CHURN HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
+                    # predict
+                    predictions = self.predict(X, customer_info)
 
-        # predict
-        predictions = self.predict(X, customer_info)
+                    result = self.postprocessing(predictions)
 
-        result = self.postprocessing(predictions)
+                result['IS_CHURN'] = result['IS_CHURN'].apply(lambda x: 'CHURN' if x == 1 else 'CHURN RİSKİ YOK')
 
-        result['IS_CHURN'] = result['IS_CHURN'].apply(lambda x: 'CHURN' if x == 1 else 'CHURN RİSKİ YOK')
+                out_data = self.prep_output(result)
 
-        out_data = self.prep_output(result)
+                table_name = f"ANALYTIC_CUSTOMER"
+                db_manager.insert_data_to_db(out_data, table_name)
+                logging.error(f"CHURN CUSTOMER RESULT DATAFRAME for CLV and RFM HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
 
-        table_name = f"ANALYTIC_CUSTOMER"
-        db_manager.insert_data_to_db(out_data, table_name)
-        logging.error(f"CHURN CUSTOMER RESULT DATAFRAME for CLV and RFM HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
+            print(f"\nCHURN PIPELINE HAS BEEN COMPLETED FOR {self.schema_name}.")
+            ROWS_PROCESSED.inc(len(result), firm=tenant(self.schema_name), stage="churn")
 
-        print(f"\nCHURN PIPELINE HAS BEEN COMPLETED FOR {self.schema_name}.")
+            result_sum = self.summarize_results(result)
 
-        result_sum = self.summarize_results(result)
+            table_name = f"CHURN_FIRM_BASED"
+            db_manager.insert_data_to_db(result_sum, table_name)
+            logging.error(f"CHURN RESULT SUMMARY DATAFRAME for CLV and RFM HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
 
-        table_name = f"CHURN_FIRM_BASED"
-        db_manager.insert_data_to_db(result_sum, table_name)
-        logging.error(f"CHURN RESULT SUMMARY DATAFRAME for CLV and RFM HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
+            logging.error(f"OUT DATAFRAME for CHURN HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
 
-        logging.error(f"OUT DATAFRAME for CHURN HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
+        finally:
+            ArtifactStore.release(self.predict_path)
+            self.thread_budget.release()
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+
+class ModelRegistry:
+    """
+    Versions the churn models of a firm under app/churn/models/{schema_name}/.
+
+    Every version is a pickled booster next to an entry in registry.json holding the model id,
+    the fingerprint of its training data, its validation metrics and the per feature reference
+    bins used to measure drift (PSI) of later training data against it.
+    """
+
+    def __init__(self, schema_name: str, model_dir: str = None, keep_versions: int = 5) -> None:
+        self.schema_name = schema_name
+        self.model_dir = model_dir or os.path.join(current_dir, "models", schema_name)
+        self.index_path = os.path.join(self.model_dir, "registry.json")
+        self.keep_versions = keep_versions
+
+    def load_index(self) -> dict:
+        if not os.path.exists(self.index_path):
+            return {"current": None, "versions": []}
+
+        with open(self.index_path, "r", encoding="UTF-8") as f:
+            return json.load(f)
+
+    def _save_index(self, index: dict) -> None:
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="UTF-8") as f:
+            json.dump(index, f, indent=2, default=str)
+        os.replace(tmp_path, self.index_path)
+
+    def current(self) -> dict:
+        """
+        Returns the registry entry of the model in use, or None when no model was registered yet.
+        """
+        index = self.load_index()
+        for entry in index["versions"]:
+            if entry["version"] == index["current"]:
+                return entry
+        return None
+
+    def model_path(self, entry: dict) -> str:
+        return os.path.join(self.model_dir, entry["file"])
+
+    def load_model(self, entry: dict = None):
+        entry = entry or self.current()
+        return joblib.load(self.model_path(entry))
+
+    def register(self, model, model_id: int, fingerprint: str, metrics: dict, features: list,
+                 reference_bins: dict, warm_started_from: int = None, training: dict = None) -> dict:
+        """
+        Saves a new model version and makes it the current one.
+
+        Args:
+            model: Trained LightGBM booster.
+            model_id (int): MODEL_ID written with the model's outputs.
+            fingerprint (str): Fingerprint of the training data.
+            metrics (dict): Validation metrics.
+            features (list): Feature names in training order.
+            reference_bins (dict): Output of reference_bins on the training features.
+            warm_started_from (int): Version the booster was warm-started from.
+            training (dict): Rows and seconds of the training run, used to turn time budgets into row budgets.
+
+        Returns:
+            dict: The registry entry of the new version.
+        """
+        os.makedirs(self.model_dir, exist_ok=True)
+        index = self.load_index()
+
+        version = max([entry["version"] for entry in index["versions"]], default=0) + 1
+        entry = {
+            "version": version,
+            "model_id": model_id,
+            "file": f"v{version:04d}_lgbm_churn.pkl",
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "fingerprint": fingerprint,
+            "metrics": metrics,
+            "best_iteration": model.best_iteration,
+            "num_trees": model.num_trees(),
+            "warm_started_from": warm_started_from,
+            "training": training,
+            "features": features,
+            "reference_bins": reference_bins
+        }
+        joblib.dump(model, self.model_path(entry))
+
+        index["versions"].append(entry)
+        index["current"] = version
+
+        # keep only the latest versions on disk
+        for old_entry in index["versions"][:-self.keep_versions]:
+            if os.path.exists(self.model_path(old_entry)):
+                os.remove(self.model_path(old_entry))
+        index["versions"] = index["versions"][-self.keep_versions:]
+
+        self._save_index(index)
+        logging.info(f"Registered churn model version {version} ({model_id}) for {self.schema_name}.")
+
+        return entry
+
+    @staticmethod
+    def reference_bins(data: pd.DataFrame, n_bins: int = 10) -> dict:
+        """
+        Builds the reference distribution of every feature: decile edges and bin shares for numeric
+        features, category shares for categorical ones. Missing values have their own bin.
+        """
+        bins = {}
+        for col in data.columns:
+            series = data[col]
+            if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+                shares = series.astype(str).where(series.notna(), "__NA__").value_counts(normalize=True)
+                bins[col] = {"type": "categorical", "categories": shares.index.tolist(), "shares": shares.tolist()}
+            else:
+                values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+                valid = values[~np.isnan(values)]
+                edges = np.unique(np.quantile(valid, np.linspace(0, 1, n_bins + 1)[1:-1])) if len(valid) else np.array([])
+                counts = ModelRegistry._bin_counts(values, edges)
+                bins[col] = {"type": "numeric", "edges": edges.tolist(), "shares": (counts / max(len(values), 1)).tolist()}
+
+        return bins
+
+    @staticmethod
+    def _bin_counts(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+        # bins (-inf, e1], (e1, e2], ..., (ek, inf) and a last bin for missing values
+        is_na = np.isnan(values)
+        bin_ids = np.searchsorted(edges, values[~is_na], side="left")
+        counts = np.bincount(bin_ids, minlength=len(edges) + 1).astype(np.float64)
+        return np.append(counts, is_na.sum())
+
+    @staticmethod
+    def psi(data: pd.DataFrame, reference_bins: dict, epsilon: float = 1e-4) -> dict:
+        """
+        Population stability index of every feature of data against the reference bins.
+
+        Features missing from data or from the reference are skipped.
+        """
+        result = {}
+        for col, ref in reference_bins.items():
+            if col not in data.columns:
+                continue
+
+            series = data[col]
+            expected = np.asarray(ref["shares"], dtype=np.float64)
+            if ref["type"] == "categorical":
+                labels = series.astype(str).where(series.notna(), "__NA__")
+                shares = labels.value_counts(normalize=True)
+                actual = shares.reindex(ref["categories"], fill_value=0).to_numpy()
+                # categories unseen in the reference form one extra bin
+                expected = np.append(expected, 0.0)
+                actual = np.append(actual, max(1 - actual.sum(), 0.0))
+            else:
+                values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+                actual = ModelRegistry._bin_counts(values, np.asarray(ref["edges"])) / max(len(values), 1)
+
+            expected = np.clip(expected, epsilon, None)
+            actual = np.clip(actual, epsilon, None)
+            result[col] = float(np.sum((actual - expected) * np.log(actual / expected)))
+
+        return result
@@ -0,0 +1,430 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import re
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+from app.config import ChurnConfig
+from app.churn.registry import ModelRegistry
+
+SCHEMA_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+class ModelStore:
+    """
+    Keeps the current churn booster of every firm in memory.
+
+    The registry.json of a firm is checked at most every reload_seconds; when it changed and points to a
+    new version, the new booster is loaded outside the lock of the store and swapped in. Batches that already
+    hold the old booster finish with it. If loading fails, the previous model keeps serving.
+    """
+
+    def __init__(self, reload_seconds: float = 2.0) -> None:
+        self.reload_seconds = reload_seconds
+        self._models = {}
+        self._lock = threading.Lock()
+        self._firm_locks = {}
+
+    @staticmethod
+    def _load(registry: ModelRegistry, entry: dict, registry_mtime: int) -> dict:
+        model = registry.load_model(entry)
+        features = entry["features"]
+        categories = dict(zip(ChurnConfig().categorical_features, model.pandas_categorical or []))
+
+        return {
+            "model": model,
+            "entry": entry,
+            "features": features,
+            "categories": {col: cats for col, cats in categories.items() if col in features},
+            "registry_mtime": registry_mtime,
+            "checked_at": time.monotonic(),
+            "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+    def get(self, schema_name: str) -> dict:
+        """
+        Returns the loaded model of the firm, reloading it when the registry changed.
+
+        The registry is read and the booster loaded under a lock of the firm only, so the other firms keep
+        being served meanwhile; requests of the firm get the previous model until the new one is swapped in.
+
+        Raises:
+            KeyError: No model is registered for the firm.
+        """
+        with self._lock:
+            loaded = self._models.get(schema_name)
+            if loaded is not None and time.monotonic() - loaded["checked_at"] < self.reload_seconds:
+                return loaded
+            firm_lock = self._firm_locks.setdefault(schema_name, threading.Lock())
+
+        # only one request per firm checks the registry, the others keep the loaded model if there is one
+        if not firm_lock.acquire(blocking=loaded is None):
+            return loaded
+        try:
+            return self._refresh(schema_name)
+        finally:
+            firm_lock.release()
+
+    def _refresh(self, schema_name: str) -> dict:
+        with self._lock:
+            loaded = self._models.get(schema_name)
+        now = time.monotonic()
+        if loaded is not None and now - loaded["checked_at"] < self.reload_seconds:
+            return loaded
+
+        registry = ModelRegistry(schema_name)
+        try:
+            registry_mtime = os.stat(registry.index_path).st_mtime_ns
+        except FileNotFoundError:
+            registry_mtime = None
+
+        if loaded is not None and registry_mtime in (None, loaded["registry_mtime"]):
+            with self._lock:
+                loaded["checked_at"] = now
+            return loaded
+
+        entry = registry.current() if registry_mtime is not None else None
+        if entry is None:
+            if loaded is not None:
+                return loaded
+            raise KeyError(f"No churn model is registered for {schema_name}.")
+
+        if loaded is not None and loaded["entry"]["version"] == entry["version"]:
+            with self._lock:
+                loaded.update(registry_mtime=registry_mtime, checked_at=now)
+            return loaded
+
+        try:
+            model = self._load(registry, entry, registry_mtime)
+        except Exception as e:
+            if loaded is None:
+                raise
+            logging.error(f"Could not load churn model version {entry['version']} of {schema_name}: {e}")
+            with self._lock:
+                loaded["checked_at"] = now
+            return loaded
+
+        with self._lock:
+            self._models[schema_name] = model
+        logging.info(f"Serving churn model version {entry['version']} ({entry['model_id']}) for {schema_name}.")
+        return model
+
+    def status(self) -> dict:
+        with self._lock:
+            return {schema_name: {"version": loaded["entry"]["version"],
+                                  "model_id": loaded["entry"]["model_id"],
+                                  "loaded_at": loaded["loaded_at"]}
+                    for schema_name, loaded in self._models.items()}
+
+
+def prepare_features(records: list, loaded: dict) -> pd.DataFrame:
+    """
+    Builds the model input from request records the same way Churn.predict_data_prep does: numeric
+    features are rounded with missing values as 0 and categorical features use the training categories.
+    """
+    features = loaded["features"]
+    data = pd.DataFrame.from_records(records, columns=features)
+
+    numeric_cols = [col for col in features if col not in loaded["categories"]]
+    data[numeric_cols] = data[numeric_cols].apply(pd.to_numeric, errors="coerce")
+    round_cols = [col for col in ChurnConfig().cols_to_round if col in numeric_cols]
+    data[round_cols] = data[round_cols].fillna(0).round(0).astype("int")
+
+    for col, categories in loaded["categories"].items():
+        # JSON clients may send program ids as strings or numbers, match them on their text
+        lookup = {str(category): category for category in categories}
+        data[col] = pd.Categorical(data[col].astype(str).map(lookup), categories=categories)
+
+    return data
+
+
+def classify(churn_prob: np.ndarray) -> tuple:
+    """
+    Churn labels and risk classes with the thresholds of Churn.predict and Churn.postprocessing.
+    """
+    is_churn = np.where(churn_prob >= 0.6, "CHURN", "CHURN RİSKİ YOK")
+    churn_class = np.select([churn_prob < 0.6, churn_prob < 0.95], ["low", "medium"], default="high")
+    return is_churn, churn_class
+
+
+class _ScoringRequest:
+
+    def __init__(self, records: list) -> None:
+        self.records = records
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Collects the scoring requests of one firm and scores them together.
+
+    A batch is closed when it holds max_batch_rows rows or max_wait_ms after its first request arrived,
+    so a single request waits at most max_wait_ms before it is scored.
+    """
+
+    def __init__(self, store: ModelStore, schema_name: str, max_batch_rows: int = 1024,
+                 max_wait_ms: float = 5.0, num_threads: int = 2) -> None:
+        self.store = store
+        self.schema_name = schema_name
+        self.max_batch_rows = max_batch_rows
+        self.max_wait_ms = max_wait_ms
+        self.num_threads = num_threads
+
+        self.queue = queue.Queue()
+        self.stats = {"requests": 0, "rows": 0, "batches": 0, "errors": 0, "last_batch_ms": None}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"churn_batcher_{schema_name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, records: list, timeout: float = 30.0) -> dict:
+        """
+        Scores the records and returns the predictions with the model version that produced them.
+
+        Raises:
+            KeyError: No model is registered for the firm.
+            ValueError: Records miss model features.
+        """
+        loaded = self.store.get(self.schema_name)
+        missing = sorted({col for record in records for col in loaded["features"] if col not in record})
+        if missing:
+            raise ValueError(f"Missing features: {missing}")
+
+        request = _ScoringRequest(records)
+        self.queue.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError(f"Scoring did not finish within {timeout}s.")
+        if request.error is not None:
+            raise request.error
+
+        return request.result
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                first = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            rows = len(first.records)
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while rows < self.max_batch_rows:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                rows += len(request.records)
+
+            self._score_batch(batch)
+
+    def _score_batch(self, batch: list) -> None:
+        start = time.perf_counter()
+        try:
+            loaded = self.store.get(self.schema_name)
+            model, entry = loaded["model"], loaded["entry"]
+            data = prepare_features([record for request in batch for record in request.records], loaded)
+            churn_prob = model.predict(data, num_iteration=model.best_iteration, num_threads=self.num_threads)
+            is_churn, churn_class = classify(churn_prob)
+
+            offset = 0
+            for request in batch:
+                predictions = []
+                for i, record in enumerate(request.records, start=offset):
+                    prediction = {"churn_prob": float(churn_prob[i]), "is_churn": str(is_churn[i]),
+                                  "churn_class": str(churn_class[i])}
+                    if "UNIQUE_CUSTOMER_ID" in record:
+                        prediction["UNIQUE_CUSTOMER_ID"] = record["UNIQUE_CUSTOMER_ID"]
+                    predictions.append(prediction)
+                offset += len(request.records)
+
+                request.result = {"schema_name": self.schema_name, "model_version": entry["version"],
+                                  "model_id": entry["model_id"], "predictions": predictions}
+        except Exception as e:
+            logging.error(f"Scoring batch of {self.schema_name} failed: {e}")
+            self.stats["errors"] += len(batch)
+            for request in batch:
+                request.error = e
+        finally:
+            self.stats["requests"] += len(batch)
+            self.stats["rows"] += sum(len(request.records) for request in batch)
+            self.stats["batches"] += 1
+            self.stats["last_batch_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            for request in batch:
+                request.done.set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join(timeout=1)
+
+
+class _ScoringHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # client_address is empty on Unix sockets, so the default access log cannot be used
+        logging.debug(f"{self.command} {self.path}: " + format % args)
+
+    def _send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body, default=str).encode("UTF-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("", "/health"):
+            self._send_json(200, self.server.service.status())
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        parts = self.path.strip("/").split("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        if len(parts) != 2 or parts[0] != "score" or not SCHEMA_PATTERN.match(parts[1]):
+            self._send_json(404, {"error": f"Unknown path {self.path}, use POST /score/<schema_name>"})
+            return
+
+        try:
+            payload = json.loads(body or b"{}")
+            records = payload.get("records") if isinstance(payload, dict) else payload
+            if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+                raise ValueError('Body must be {"records": [{feature: value, ...}, ...]}')
+            if not records or len(records) > service.max_request_rows:
+                raise ValueError(f"A request must hold 1 to {service.max_request_rows} records.")
+
+            # unknown firms fail here, before a batcher is started for them
+            service.store.get(parts[1])
+            result = service.batcher(parts[1]).submit(records)
+        except KeyError as e:
+            self._send_json(404, {"error": str(e.args[0])})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+        else:
+            self._send_json(200, result)
+
+
+class _TCPScoringHandler(_ScoringHandler):
+
+    # headers and body are written separately, Nagle's algorithm would hold the body for the delayed ACK
+    disable_nagle_algorithm = True
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ScoringService:
+    """
+    Local churn scoring service.
+
+    Serves POST /score/<schema_name> with {"records": [...]} (one record per customer and program with the
+    features of ChurnConfig.model_features) and GET /health over HTTP on host:port, or over a Unix socket
+    when socket_path is given. Every firm has its own micro-batcher and its booster stays loaded in memory.
+
+    Usage:
+        python app/churn/serving.py --port 8765
+        curl -X POST localhost:8765/score/FIRM_CDP -d '{"records": [{"DWH_PROGRAM_ID": 12, ...}]}'
+    """
+
+    def __init__(self, host: str = None, port: int = None, socket_path: str = None) -> None:
+        parameters = ChurnConfig()
+        self.host = host or parameters.serving_host
+        self.port = parameters.serving_port if port is None else port
+        self.socket_path = socket_path if socket_path is not None else parameters.serving_socket
+        self.max_batch_rows = parameters.serving_max_batch_rows
+        self.max_wait_ms = parameters.serving_max_wait_ms
+        self.max_request_rows = parameters.serving_max_request_rows
+        self.num_threads = parameters.serving_threads
+
+        self.store = ModelStore(parameters.serving_reload_seconds)
+        self.batchers = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.server = _ThreadingUnixHTTPServer(self.socket_path, _ScoringHandler)
+        else:
+            self.server = ThreadingHTTPServer((self.host, self.port), _TCPScoringHandler)
+            self.port = self.server.server_address[1]
+        self.server.service = self
+
+    @property
+    def address(self) -> str:
+        return f"unix:{self.socket_path}" if self.socket_path else f"http://{self.host}:{self.port}"
+
+    def batcher(self, schema_name: str) -> MicroBatcher:
+        with self._lock:
+            if schema_name not in self.batchers:
+                self.batchers[schema_name] = MicroBatcher(self.store, schema_name, self.max_batch_rows,
+                                                          self.max_wait_ms, self.num_threads)
+            return self.batchers[schema_name]
+
+    def status(self) -> dict:
+        models = self.store.status()
+        return {
+            "status": "ok",
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "firms": {schema_name: dict(models.get(schema_name, {}), **batcher.stats)
+                      for schema_name, batcher in self.batchers.items()}
+        }
+
+    def serve_forever(self) -> None:
+        logging.info(f"Churn scoring service listening on {self.address}.")
+        self.server.serve_forever()
+
+    def shutdown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        for batcher in self.batchers.values():
+            batcher.stop()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local churn scoring service.")
+    parser.add_argument("--host", default=None, help="Defaults to ChurnConfig.serving_host.")
+    parser.add_argument("--port", type=int, default=None, help="Defaults to ChurnConfig.serving_port.")
+    parser.add_argument("--socket", default=None, help="Serve on this Unix socket instead of TCP.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    service = ScoringService(args.host, args.port, args.socket)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import lightgbm as lgb
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+
+def run_trial(train_path: str, val_path: str, params: dict, num_boost_round: int, deadline: float) -> dict:
+    """
+    Trains one trial on the binary datasets and returns its best validation AUC.
+
+    Training stops early when the validation AUC does not improve for a tenth of the rounds,
+    or when the tuning deadline is reached.
+    """
+    start = time.time()
+
+    def _deadline(env):
+        if time.time() > deadline:
+            raise lgb.callback.EarlyStopException(env.iteration, env.evaluation_result_list)
+
+    _deadline.order = 40
+
+    train_data = lgb.Dataset(train_path, params=params)
+    val_data = lgb.Dataset(val_path, reference=train_data, params=params)
+    booster = lgb.train(
+        params,
+        train_data,
+        num_boost_round=num_boost_round,
+        valid_sets=[val_data],
+        valid_names=['valid'],
+        callbacks=[lgb.early_stopping(stopping_rounds=max(10, num_boost_round // 10), verbose=False), _deadline]
+    )
+
+    return {
+        'auc': booster.best_score['valid']['auc'],
+        'best_iteration': booster.best_iteration,
+        'seconds': round(time.time() - start, 2)
+    }
+
+
+class HyperparameterTuner:
+    """
+    Successive halving search over LightGBM booster parameters.
+
+    All trials are trained for min_rounds boosting rounds in a process pool, the best 1/eta of them
+    (by validation AUC) are trained again with eta times more rounds, and so on until max_rounds or a
+    single trial is left. Every trial stops at the wall-clock deadline of the search.
+
+    The search space may only hold booster parameters, since the trials share datasets that were
+    binned once with the base parameters.
+
+    The workers are spawned, not forked, so they import run_trial from this module and the script starting
+    the search must guard its entry point with if __name__ == '__main__'.
+    """
+
+    def __init__(self, base_params: dict, search_space: dict, n_trials: int = 27, min_rounds: int = 50,
+                 max_rounds: int = 1000, eta: int = 3, time_budget_seconds: float = 900, workers: int = 2,
+                 threads_per_worker: int = 1, seed: int = 2024) -> None:
+        """
+        Args:
+            base_params (dict): Parameters shared by all trials. The first trial uses them unchanged.
+            search_space (dict): {param: [low, high, scale]} with scale 'log', 'int' or 'uniform'.
+            n_trials (int): Number of sampled configurations.
+            min_rounds (int): Boosting rounds of the first rung.
+            max_rounds (int): Maximum boosting rounds of the last rung.
+            eta (int): Reduction factor between rungs.
+            time_budget_seconds (float): Wall-clock budget of the whole search.
+            workers (int): Trials trained in parallel.
+            threads_per_worker (int): LightGBM threads of every trial.
+            seed (int): Seed of the parameter sampler.
+        """
+        self.base_params = base_params
+        self.search_space = search_space
+        self.n_trials = n_trials
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.eta = eta
+        self.time_budget_seconds = time_budget_seconds
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.rng = np.random.default_rng(seed)
+
+    def sample_params(self) -> list:
+        candidates = [{}]
+        while len(candidates) < self.n_trials:
+            params = {}
+            for name, (low, high, scale) in self.search_space.items():
+                if scale == 'log':
+                    params[name] = float(math.exp(self.rng.uniform(math.log(low), math.log(high))))
+                elif scale == 'int':
+                    params[name] = int(round(math.exp(self.rng.uniform(math.log(low), math.log(high)))))
+                else:
+                    params[name] = float(self.rng.uniform(low, high))
+            candidates.append(params)
+
+        return candidates
+
+    def run(self, train_path: str, val_path: str) -> dict:
+        """
+        Runs the search on LightGBM binary datasets.
+
+        Returns:
+            dict: Best parameters (only the searched ones), their AUC and best iteration, and a summary of all trials.
+        """
+        start = time.time()
+        deadline = start + self.time_budget_seconds
+        trials = [{'trial': i, 'params': params, 'auc': None, 'rounds': 0}
+                  for i, params in enumerate(self.sample_params())]
+
+        survivors = trials
+        rounds = min(self.min_rounds, self.max_rounds)
+        timed_out = False
+
+        # spawned workers: forking a parent that already initialised OpenMP (LightGBM) can deadlock them
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            while survivors:
+                futures = {}
+                for trial in survivors:
+                    params = dict(self.base_params, **trial['params'], metric='auc', verbose=-1,
+                                  num_threads=self.threads_per_worker)
+                    futures[executor.submit(run_trial, train_path, val_path, params, rounds, deadline)] = trial
+
+                for future in as_completed(futures):
+                    trial = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logging.error(f"Tuning trial {trial['trial']} failed: {e}")
+                        result = {'auc': float('-inf'), 'best_iteration': 0}
+                    trial.update(result, rounds=rounds)
+
+                survivors = sorted(survivors, key=lambda t: t['auc'], reverse=True)
+                logging.info(f"Tuning rung with {rounds} rounds: {len(survivors)} trials, "
+                             f"best AUC {survivors[0]['auc']:.4f} (trial {survivors[0]['trial']}).")
+
+                if time.time() >= deadline:
+                    timed_out = True
+                    break
+                if rounds >= self.max_rounds or len(survivors) == 1:
+                    break
+
+                # prune all but the best 1/eta trials
+                survivors = survivors[:max(1, len(survivors) // self.eta)]
+                rounds = min(rounds * self.eta, self.max_rounds)
+
+        best = survivors[0]
+        return {
+            'params': best['params'],
+            'auc': best['auc'],
+            'best_iteration': best['best_iteration'],
+            'rounds': best['rounds'],
+            'timed_out': timed_out,
+            'elapsed_seconds': round(time.time() - start, 2),
+            'trials': [dict(trial) for trial in trials]
+        }
@@ -31,6 +31,73 @@ class Config(BaseSettings):
     start_dt: str = '20240101'
     end_dt: str = datetime.now().strftime('%Y%m%d')
 
+    # Segmentation parallelism ('' runs on a single core, 'program' or 'hash' partitions the input)
+    segmentation_partition_mode: str = ''
+    segmentation_workers: int = 0
+    segmentation_hash_partitions: int = 0
+
+    # RFM aggregation ('sql' runs 1-RFM.sql in the database, 'numpy' aggregates a transaction extract locally)
+    rfm_engine: str = 'sql'
+
+    # Segmentation output ('full' rewrites ANALYTIC_CUSTOMER, 'diff' merges only the changed customers)
+    segmentation_write_mode: str = 'full'
+    segmentation_staging_table: str = 'ANALYTIC_CUSTOMER_STG'
+
+    # Smart Insight firm metrics ('sql' runs overall-firm.sql over ANALYTIC_CUSTOMER, 'memory' computes them from
+    # the segmentation output of the same process and falls back to the SQL when there is none)
+    insight_metrics_source: str = 'sql'
+
+    # Smart Insight change detection: when the fingerprint of ANALYTIC_CUSTOMER (or of the in-memory segmentation
+    # output) matches the one stored in insight_cache_dir, the previous metrics and text are reused and neither
+    # overall-firm.sql nor the ANALYTIC_FIRM_BASED insert runs
+    insight_cache: bool = False
+    insight_cache_dir: str = 'data/insight_cache'
+
+    # Daily snapshots of the Smart Insight metrics (app/utils/metric_history.py) under metric_history_dir, compared
+    # with the snapshot metric_history_trend_months months earlier to add a trend paragraph to the insight
+    metric_history: bool = False
+    metric_history_dir: str = 'data/metric_history'
+    metric_history_trend_months: int = 1
+
+    # Shared transaction extract (app/utils/transaction_extract.py) read by the NumPy RFM engine and the churn
+    # feature store: TRANSACTION_MAIN is scanned once per firm and day into month partitions under
+    # transaction_extract_dir, reloading the months of the last transaction_extract_reload_days days and the
+    # whole history every transaction_extract_full_refresh_days days
+    transaction_extract_dir: str = 'data/extract'
+    transaction_extract_start_dt: str = '20000101'
+    transaction_extract_reload_days: int = 3
+    transaction_extract_full_refresh_days: int = 7
+
+    # In-process artifacts (app/utils/artifact_store.py) larger than artifact_spill_mb (0 = never) are
+    # spilled to Arrow IPC files in artifact_dir and memory-mapped when read
+    artifact_spill_mb: int = 0
+    artifact_dir: str = 'data/artifacts'
+
+    # Opt-in memory profile of the pipeline stages (app/utils/memory_profiler.py) written per firm under
+    # {log_path}/memory. RSS is sampled every memory_profile_interval_ms, memory_profile_tracemalloc attributes
+    # the peak of every stage to its memory_profile_top allocating code locations (slows the stages down), and
+    # stages growing memory_regression_pct percent and memory_regression_min_mb more than on the previous run are flagged
+    memory_profiling: bool = False
+    memory_profile_tracemalloc: bool = True
+    memory_profile_frames: int = 16
+    memory_profile_top: int = 10
+    memory_profile_interval_ms: int = 50
+    memory_regression_pct: float = 20
+    memory_regression_min_mb: float = 50
+
+    # Elapsed time, rows, fetched bytes and round trips of every SQL statement (app/utils/sql_stats.py) appended
+    # to sql_stats_path ({log_path}/sql_stats.jsonl when empty); statements slower than
+    # sql_explain_threshold_seconds (0 = never) also record their EXPLAIN PLAN
+    sql_stats: bool = True
+    sql_stats_path: str = ''
+    sql_explain_threshold_seconds: float = 0
+
+    # Pipeline metrics (app/utils/metrics.py) in Prometheus text format, written to metrics_path
+    # ({log_path}/metrics.prom when empty) after every firm and served on metrics_host:metrics_port (0 = no endpoint)
+    metrics_path: str = ''
+    metrics_host: str = '127.0.0.1'
+    metrics_port: int = 0
+
 
 class ChurnConfig(BaseSettings):
 
@@ -83,6 +150,84 @@ class ChurnConfig(BaseSettings):
     'bagging_freq': 5
     }
 
+    # Model registry: the current model is reused while the max PSI of the training features stays
+    # below drift_psi_threshold and the model is younger than max_model_age_days
+    drift_psi_threshold: float = 0.1
+    max_model_age_days: int = 30
+    registry_keep_versions: int = 5
+
+    # Retraining continues boosting from the current model until it holds warm_start_max_trees trees
+    warm_start: bool = True
+    warm_start_rounds: int = 300
+    warm_start_max_trees: int = 2000
+
+    # Opt-in hyperparameter search: successive halving over tuning_search_space ([low, high, scale]) in a
+    # process pool, pruning trials on validation AUC within a wall-clock budget per firm. The best parameters
+    # of a search that completed within the budget are saved next to the firm's models and reused until they
+    # are older than tuning_max_age_days.
+    tuning: bool = False
+    tuning_trials: int = 27
+    tuning_min_rounds: int = 50
+    tuning_eta: int = 3
+    tuning_time_budget_seconds: int = 900
+    tuning_workers: int = 0
+    tuning_max_age_days: int = 90
+    tuning_search_space: dict = {
+    'learning_rate': [0.01, 0.2, 'log'],
+    'num_leaves': [15, 255, 'int'],
+    'feature_fraction': [0.5, 1.0, 'uniform'],
+    'bagging_fraction': [0.5, 1.0, 'uniform'],
+    'lambda_l1': [0.001, 10.0, 'log'],
+    'lambda_l2': [0.001, 10.0, 'log'],
+    'min_sum_hessian_in_leaf': [0.001, 10.0, 'log']
+    }
+
+    # Training budget for huge tenants: above training_row_budget rows, or above the rows the last full training
+    # processed in training_seconds_budget seconds (0 = no budget), the training data is sampled per program and
+    # target class, keeping at least sampling_min_rows_per_stratum rows each, and weighted back to the population
+    training_row_budget: int = 0
+    training_seconds_budget: float = 0
+    sampling_min_rows_per_stratum: int = 1000
+
+    # Binned training/validation datasets are cached in LightGBM's binary format under data/churn/cache/, keyed by
+    # the training data fingerprint (hit by the training after tuning and by reruns on the same data, warm or cold)
+    dataset_cache: bool = True
+
+    # Scoring ('memory' scores the whole prediction dataset at once, 'streaming' reads, scores and inserts
+    # it in batches of scoring_batch_rows rows; the data preparation writes row groups of that size)
+    scoring_mode: str = 'memory'
+    scoring_batch_rows: int = 100_000
+
+    # Source of the TR/PR datasets ('sql' runs V1.sql/V3.sql, 'feature_store' updates the local per customer
+    # aggregates with the new transactions and materializes the datasets from them)
+    dataset_source: str = 'sql'
+    feature_store_start_dt: str = '20000101'
+    feature_store_reload_days: int = 3
+    feature_store_retention_days: int = 400
+    feature_store_sketch_accuracy: float = 0.01
+    feature_store_training_rows: int = 500_000
+    # after a full refresh of the transaction extract (which picks up late deletions and state changes) the
+    # store reloads the day partitions of the retention window ('retention'), everything including the
+    # snapshot ('all') or nothing ('none'); the snapshot keeps older deletions unless 'all' is set
+    feature_store_full_refresh_reload: str = 'retention'
+
+    # Parquet checkpoints of the TR/PR datasets, read when data preparation and modelling run in separate processes
+    parquet_checkpoints: bool = True
+
+    # Local scoring service (app/churn/serving.py): requests of a firm are micro-batched until serving_max_batch_rows
+    # rows or serving_max_wait_ms, and the registry is checked for new models every serving_reload_seconds
+    serving_host: str = '127.0.0.1'
+    serving_port: int = 8765
+    serving_socket: str = ''
+    serving_max_batch_rows: int = 1024
+    serving_max_wait_ms: float = 5.0
+    serving_max_request_rows: int = 10_000
+    serving_reload_seconds: float = 2.0
+    serving_threads: int = 2
+
+    # Cores shared by concurrently running churn jobs (0 = all cores of the host)
+    cpu_budget: int = 0
+
 
 
 
@@ -19,6 +19,9 @@ from segmentation.data_prep import Data_Prep_Runner
 from utils.smart_insight_utils import SmartInsight
 from churn.data_prep import Data_Prep_Runner as Churn_Data_Prep
 from churn.modelling import Churn
+from app.utils.artifact_store import ArtifactStore
+from app.utils.memory_profiler import MemoryProfiler, memory_stage
+from app.utils.metrics import stage_metrics, start_metrics_server, write_metrics
 
 import pandas as pd
 
@@ -62,6 +65,7 @@ class CRM:
     def run_tasks(self):
 
         firm_df = self.get_firms()
+        start_metrics_server(self.config)
 
         for index, row in firm_df.iterrows():
             firm_id = row['ID']
@@ -72,101 +76,114 @@ class CRM:
             # Log firm details
             logging.info(f'Firma Bilgileri Okunuyor.\nFIRM ID: {firm_id}\nFIRM_NAME: {firm_name}\nDATA_USER_ELT: {conn_data_user_elt}\nDATA_USER_CDP: {conn_data_user_cdp}\n')
 
-            data_prep = Data_Prep_Runner(SCHEMA_NAME=conn_data_user_cdp, firm_id=firm_id,dt_start='',dt_end='')
-            data_prep.run()
+            # opt-in per-stage memory report of the firm (Config.memory_profiling); artifacts handed between the
+            # stages of the firm are released at the end of its iteration
+            with MemoryProfiler(firm_id, conn_data_user_elt), ArtifactStore.scope():
+                data_prep = Data_Prep_Runner(SCHEMA_NAME=conn_data_user_cdp, firm_id=firm_id,dt_start='',dt_end='')
+                with memory_stage("data_prep"), stage_metrics(conn_data_user_elt, "", "data_prep") as status:
+                    status['failed'] = not data_prep.run()
 
-            connection = self.db_manager.create_engine()
-            con = connection.connect()
-            logging.info("DB baglantisi olusturuldu.")
+                connection = self.db_manager.create_engine()
+                con = connection.connect()
+                logging.info("DB baglantisi olusturuldu.")
 
-            query = f"SELECT * FROM {conn_data_user_elt}.ANALYTIC_METRICS"
-            tasks_df = pd.read_sql(query, con)
-            tasks_df.columns = tasks_df.columns.map(str.upper)
+                query = f"SELECT * FROM {conn_data_user_elt}.ANALYTIC_METRICS"
+                tasks_df = pd.read_sql(query, con)
+                tasks_df.columns = tasks_df.columns.map(str.upper)
 
-            if tasks_df.empty:
-                logging.error(f'{firm_name} için metrik yok.')
-                continue
+                if tasks_df.empty:
+                    logging.error(f'{firm_name} için metrik yok.')
+                    continue
 
-            for i, row_ in tasks_df.iterrows():
-                execution_start = datetime.now()
-                METRIC_ID = row_['METRIC_ID']
-                MTRC_DISPLAY_NAME = row_['DISPLAY_NAME']
-                PERIOD = row_['WORKING_DAY_PERIOD']
+                for i, row_ in tasks_df.iterrows():
+                    execution_start = datetime.now()
+                    METRIC_ID = row_['METRIC_ID']
+                    MTRC_DISPLAY_NAME = row_['DISPLAY_NAME']
+                    PERIOD = row_['WORKING_DAY_PERIOD']
 
 
-                if METRIC_ID == 1:
+                    if METRIC_ID == 1:
                     
-                    logging.error(f'{firm_name} için METRIC_ID: {METRIC_ID}, DISPLAY_NAME: {MTRC_DISPLAY_NAME} çalıştırılıyor. PERIOD = {PERIOD} Days')
+                        logging.error(f'{firm_name} için METRIC_ID: {METRIC_ID}, DISPLAY_NAME: {MTRC_DISPLAY_NAME} çalıştırılıyor. PERIOD = {PERIOD} Days')
 
-                    self.db_manager.log_to_db('RFM_CLV',METRIC_ID, firm_id, 'PENDING', execution_start, None)
-                    job_runner = Segmentation_Runner(SCHEMA_NAME=conn_data_user_elt, FIRM_ID=firm_id)
-                    job_runner.run()
-                    execution_end = datetime.now()
-                    self.db_manager.log_to_db('RFM_CLV', METRIC_ID,firm_id, 'SUCCESS', execution_start, execution_end)
-                    logging.info(f"RFM_CLV task completed successfully for firm {firm_name} (ID: {firm_id})")
+                        self.db_manager.log_to_db('RFM_CLV',METRIC_ID, firm_id, 'PENDING', execution_start, None)
+                        job_runner = Segmentation_Runner(SCHEMA_NAME=conn_data_user_elt, FIRM_ID=firm_id)
+                        with memory_stage("segmentation"), stage_metrics(conn_data_user_elt, METRIC_ID, "segmentation") as status:
+                            status['failed'] = not job_runner.run()
+                        execution_end = datetime.now()
+                        self.db_manager.log_to_db('RFM_CLV', METRIC_ID,firm_id, 'FAIL' if status['failed'] else 'SUCCESS', execution_start, execution_end)
+                        if not status['failed']:
+                            logging.info(f"RFM_CLV task completed successfully for firm {firm_name} (ID: {firm_id})")
 
-                if METRIC_ID == 3: 
+                    if METRIC_ID == 3: 
 
-                    logging.error(f'{firm_name} için METRIC_ID: {METRIC_ID}, DISPLAY_NAME: {MTRC_DISPLAY_NAME} çalıştırılıyor. PERIOD = {PERIOD} Days')
+                        logging.error(f'{firm_name} için METRIC_ID: {METRIC_ID}, DISPLAY_NAME: {MTRC_DISPLAY_NAME} çalıştırılıyor. PERIOD = {PERIOD} Days')
 
-                    self.db_manager.log_to_db('SmartInsight', METRIC_ID, firm_id, "PENDING", execution_start, execution_start)
+                        self.db_manager.log_to_db('SmartInsight', METRIC_ID, firm_id, "PENDING", execution_start, execution_start)
 
-                    execution_start = datetime.now()
+                        execution_start = datetime.now()
 
-                    try: 
+                        try: 
 
-                        smart_insight = SmartInsight(firm_id=firm_id, firm_name=firm_name, schema_name=conn_data_user_elt)
+                            smart_insight = SmartInsight(firm_id=firm_id, firm_name=firm_name, schema_name=conn_data_user_elt)
                         
-                        smart_insight.run()
+                            with memory_stage("smart_insight"), stage_metrics(conn_data_user_elt, METRIC_ID, "smart_insight"):
+                                smart_insight.run()
 
-                        logging.info(f"Smart Insight has been generated for {firm_name}")
-                        execution_end = datetime.now()
+                            logging.info(f"Smart Insight has been generated for {firm_name}")
+                            execution_end = datetime.now()
 
-                        # Update the log
-                        self.db_manager.log_to_db('Smart Insight', METRIC_ID, firm_id, 'SUCCESS', execution_start, execution_end)
+                            # Update the log
+                            self.db_manager.log_to_db('Smart Insight', METRIC_ID, firm_id, 'SUCCESS', execution_start, execution_end)
                     
-                    except Exception as e:
-                        execution_end = datetime.now()
-                        self.db_manager.log_to_db('Smart Insight', METRIC_ID, firm_id, 'FAIL', execution_start, execution_end)
-                        logging.error(f"Error generating Smart Insight for firm {firm_name} (ID: {firm_id}): {e}")
+                        except Exception as e:
+                            execution_end = datetime.now()
+                            self.db_manager.log_to_db('Smart Insight', METRIC_ID, firm_id, 'FAIL', execution_start, execution_end)
+                            logging.error(f"Error generating Smart Insight for firm {firm_name} (ID: {firm_id}): {e}")
 
-                if METRIC_ID == 4: 
+                    if METRIC_ID == 4: 
 
-                    logging.error(f'{firm_name} için METRIC_ID: {METRIC_ID}, DISPLAY_NAME: {MTRC_DISPLAY_NAME} çalıştırılıyor. PERIOD = {PERIOD} Days')
-                    self.db_manager.log_to_db('Churn Data Preparation', METRIC_ID, firm_id, "PENDING", execution_start, execution_start)
+                        logging.error(f'{firm_name} için METRIC_ID: {METRIC_ID}, DISPLAY_NAME: {MTRC_DISPLAY_NAME} çalıştırılıyor. PERIOD = {PERIOD} Days')
+                        self.db_manager.log_to_db('Churn Data Preparation', METRIC_ID, firm_id, "PENDING", execution_start, execution_start)
 
-                    execution_start = datetime.now()
+                        execution_start = datetime.now()
 
-                    try:
+                        try:
 
-                        #data prep for churn
+                            #data prep for churn
 
-                        job_runner = Churn_Data_Prep(conn_data_user_cdp, firm_id, PERIOD)
-                        job_runner.run()
-                        execution_end = datetime.now()
+                            job_runner = Churn_Data_Prep(conn_data_user_cdp, firm_id, PERIOD)
+                            with memory_stage("churn_data_prep"), stage_metrics(conn_data_user_elt, METRIC_ID, "churn_data_prep") as status:
+                                status['failed'] = not job_runner.run()
+                            execution_end = datetime.now()
 
-                        self.db_manager.log_to_db('Churn Data Preparation', METRIC_ID, firm_id, "SUCCESS", execution_start, execution_end)
+                            self.db_manager.log_to_db('Churn Data Preparation', METRIC_ID, firm_id, "FAIL" if status['failed'] else "SUCCESS", execution_start, execution_end)
 
-                        # model training & prediction
+                            # model training & prediction
                         
-                        execution_start = datetime.now()
+                            execution_start = datetime.now()
 
-                        job_runner = Churn(firm_id, conn_data_user_cdp)
+                            job_runner = Churn(firm_id, conn_data_user_cdp)
                         
-                        self.db_manager.log_to_db('Churn Model Training', METRIC_ID, firm_id, "PENDING", execution_start, execution_end)
+                            self.db_manager.log_to_db('Churn Model Training', METRIC_ID, firm_id, "PENDING", execution_start, execution_end)
 
-                        job_runner.run()
+                            with memory_stage("churn"), stage_metrics(conn_data_user_elt, METRIC_ID, "churn"):
+                                job_runner.run()
 
-                        execution_end = datetime.now()
+                            execution_end = datetime.now()
                         
-                        self.db_manager.log_to_db('Churn Model Predictions', METRIC_ID, firm_id, "SUCCESS", execution_start, execution_end)
+                            self.db_manager.log_to_db('Churn Model Predictions', METRIC_ID, firm_id, "SUCCESS", execution_start, execution_end)
                     
-                    except Exception as e:
-                        execution_end = datetime.now()
-                        self.db_manager.log_to_db('Churn module is not performed due to an error: {e}', METRIC_ID, firm_id, 'FAIL', execution_start, execution_end)
-                        logging.error(f"Error generating Smart Insight for firm {firm_name} (ID: {firm_id}): {e}")
+                        except Exception as e:
+                            execution_end = datetime.now()
+                            self.db_manager.log_to_db('Churn module is not performed due to an error: {e}', METRIC_ID, firm_id, 'FAIL', execution_start, execution_end)
+                            logging.error(f"Error generating Smart Insight for firm {firm_name} (ID: {firm_id}): {e}")
+
+            write_metrics(self.config)
+
+        write_metrics(self.config)
 
-if '__main__':
+if __name__ == '__main__':
 
     CRM().run_tasks()
 
@@ -12,6 +12,8 @@ from app.config import Config
 from app.utils.database import DatabaseManager
 from app.utils.file import FileManager
 from app.utils.general_utils import GeneralUtils
+from app.utils.transaction_extract import TransactionExtract
+from app.segmentation.rfm_engine import RFMEngine
 
 class Data_Prep_Runner:
     def __init__(self, SCHEMA_NAME, firm_id, dt_start, dt_end):
@@ -26,7 +28,13 @@ class Data_Prep_Runner:
         self.start_time = datetime.fromtimestamp(time.time())
         self.firm_id = firm_id
 
-    def run(self):
+    def run(self) -> bool:
+        """
+        Fills the segmentation tables and the local ANALYTIC_ALL_DATA copy. Errors are logged, not raised.
+
+        Returns:
+            bool: Whether the job succeeded.
+        """
 
         try:
             logging.error(f"Starting job: {self.job_name}")
@@ -37,6 +45,10 @@ class Data_Prep_Runner:
 
             tables_to_drop = ["RFM_STG","ANALYTICAL_PROFILE","ANALYTIC_ALL_DATA","ANALYTIC_CUSTOMER" ]
 
+            if self.config.segmentation_write_mode == 'diff':
+                # segmentation rows are merged by Segmentation_Runner, only the churn rows are rewritten
+                tables_to_drop.remove("ANALYTIC_CUSTOMER")
+                self.db_manager.delete_records(table_name="ANALYTIC_CUSTOMER", condition="P15 IS NULL")
 
             for table in tables_to_drop:
 
@@ -44,7 +56,11 @@ class Data_Prep_Runner:
 
             # # Execute all
 
-            for q in queries:
+            for q in sorted(queries):
+
+                if self.config.rfm_engine == 'numpy' and os.path.basename(q) == "1-RFM.sql":
+                    self.run_rfm_engine()
+                    continue
 
                 self.db_manager.execute_query(q, self.dt_start, self.dt_end)
                 
@@ -59,17 +75,25 @@ class Data_Prep_Runner:
             end_time = datetime.fromtimestamp(time.time())
 
             self.db_manager.log_to_db(job_type=self.job_name, metric_id=0, firm_id=self.firm_id, status='SUCCESS', execution_start=self.start_time, execution_end=end_time)
+            return True
 
         except Exception as e:
             logging.error(f"Error during job: {e}")
             
             end_time = datetime.fromtimestamp(time.time())
             self.db_manager.log_to_db(job_type=self.job_name, metric_id=0, firm_id=self.firm_id, status='FAIL', execution_start=self.start_time, execution_end=end_time)
+            return False
 
+    def run_rfm_engine(self):
+        """
+        Fills RFM_STG from the shared transaction extract aggregated on the analytics host instead of 1-RFM.sql.
+        """
+        extract = TransactionExtract(self.SCHEMA_NAME)
+        extract.refresh(self.db_manager)
 
+        rfm_data = RFMEngine().compute(extract.rfm_transactions())
+        # missing aggregates (e.g. the return columns of customers without returns) are NULL as in 1-RFM.sql, not NaN
+        rfm_data = rfm_data.astype(object).where(rfm_data.notna(), None)
 
-
-
-
-
-
+        DatabaseManager(f"{self.SCHEMA_NAME}_ELT").insert_data_to_db(rfm_data, "RFM_STG")
+        logging.info(f"RFM_STG has been filled by the RFM engine for {self.SCHEMA_NAME}.")
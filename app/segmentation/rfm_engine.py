@@ -0,0 +1,203 @@
+import logging
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+
+RFM_COLUMNS = ['UNIQUE_CUSTOMER_ID', 'KART_TIP_DETAY', 'SON_ALV_TARIH', 'SON_IADE_TARIH', 'RECENCY', 'RECENCY_GECERLI',
+               'RECENCY_IADE', 'SON_ISLEM_IADE', 'FREQUENCY', 'FREQUENCY_GECERLI', 'FREQUENCY_IADE', 'IADE_ORANI',
+               'MONETARY', 'MONETARY_GECERLI', 'MONETARY_IADE', 'IADE_CIRO_ORANI', 'KAZANILAN_TUTAR', 'HARCANAN_TUTAR',
+               'KAZANILAN_HARCANAN_TUTAR_ORAN', 'KAZANILAN_TRX_CNT', 'HARCANILAN_TRX_CNT']
+
+# columns rounded to 4 decimals by 1-RFM.sql; binary floating point sums can land on the other side of a
+# rounding tie than Oracle NUMBER arithmetic, so these are compared within one unit of the last decimal
+ROUNDED_COLUMNS = {'IADE_ORANI': 4, 'KAZANILAN_HARCANAN_TUTAR_ORAN': 4}
+
+EXTRACT_COLUMNS = ['UNIQUE_CUSTOMER_ID', 'PROGRAM_NAME', 'TRX_STATE_ID', 'TIMED_ID_TRANSACTION', 'TRANSACTION_DATE',
+                   'TRANSACTION_ID', 'AMOUNT_AFTER_DISCOUNT', 'AMOUNT_EARNED_POINT', 'AMOUNT_USED_POINT']
+
+
+class RFMEngine:
+    """
+    Computes the RFM_STG columns of db_queries/segmentasyon/1-RFM.sql from a transaction extract.
+
+    The extract holds one row per transaction that is already joined to CUSTOMER_STG and DIM_PROGRAM
+    and filtered on IS_DELETED = 0 and TRX_STATE_ID IN (1, 3). Rows are grouped by
+    (UNIQUE_CUSTOMER_ID, PROGRAM_NAME) with a single stable sort, and every aggregate is a
+    reduceat over the sorted arrays.
+    """
+
+    def __init__(self, reference_date: datetime = None, min_monetary: float = 15) -> None:
+        """
+        Args:
+            reference_date (datetime): Date used as TRUNC(SYSDATE). Defaults to today.
+            min_monetary (float): HAVING threshold on SUM(AMOUNT_AFTER_DISCOUNT).
+        """
+        self.reference_date = pd.Timestamp(reference_date or datetime.now()).normalize()
+        self.min_monetary = min_monetary
+
+    @staticmethod
+    def read_extract(path: str) -> pd.DataFrame:
+        """
+        Reads the columns used by the engine from a Parquet transaction extract.
+        """
+        return pd.read_parquet(path, columns=EXTRACT_COLUMNS)
+
+    @staticmethod
+    def oracle_round(values: np.ndarray, decimals: int) -> np.ndarray:
+        """
+        Rounds half away from zero like Oracle ROUND.
+        """
+        factor = 10.0 ** decimals
+        return np.sign(values) * np.floor(np.abs(values) * factor + 0.5) / factor
+
+    @staticmethod
+    def _group_max(values: np.ndarray, mask: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """
+        MAX over the rows of each group where mask holds, NaN when no row qualifies.
+        """
+        masked = np.where(mask, values, -np.inf)
+        result = np.maximum.reduceat(masked, starts)
+        return np.where(np.isneginf(result), np.nan, result)
+
+    @staticmethod
+    def _group_sum(values: np.ndarray, mask: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """
+        SUM over the rows of each group where mask holds, NaN when no row qualifies.
+        """
+        result = np.add.reduceat(np.where(mask, values, 0.0), starts)
+        counts = np.add.reduceat(mask.astype(np.int64), starts)
+        return np.where(counts > 0, result, np.nan)
+
+    @staticmethod
+    def _group_count(mask: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(mask.astype(np.int64), starts)
+
+    def compute(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """
+        Aggregates the transaction extract into RFM_STG rows.
+
+        Args:
+            transactions (pd.DataFrame): Transaction extract with the EXTRACT_COLUMNS columns.
+
+        Returns:
+            pd.DataFrame: One row per (UNIQUE_CUSTOMER_ID, KART_TIP_DETAY) with the RFM_STG columns.
+        """
+        if transactions.empty:
+            return pd.DataFrame(columns=RFM_COLUMNS)
+
+        customer_codes, customers = pd.factorize(transactions['UNIQUE_CUSTOMER_ID'], use_na_sentinel=False)
+        program_codes, programs = pd.factorize(transactions['PROGRAM_NAME'], use_na_sentinel=False)
+        group_codes = customer_codes.astype(np.int64) * len(programs) + program_codes
+
+        order = np.argsort(group_codes, kind='stable')
+        sorted_codes = group_codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        group_keys = sorted_codes[starts]
+
+        state = transactions['TRX_STATE_ID'].to_numpy()[order]
+        is_sale = state == 1
+        is_return = state == 3
+
+        timed_id = np.trunc(transactions['TIMED_ID_TRANSACTION'].to_numpy(dtype=np.float64)[order])
+        has_timed_id = ~np.isnan(timed_id)
+
+        transaction_dates = pd.to_datetime(transactions['TRANSACTION_DATE']).to_numpy()[order]
+        has_date = ~np.isnat(transaction_dates)
+        days = transaction_dates.astype('datetime64[D]').astype(np.int64).astype(np.float64)
+        reference_day = np.datetime64(self.reference_date.date(), 'D').astype(np.int64)
+
+        has_id = transactions['TRANSACTION_ID'].notna().to_numpy()[order]
+        amount = transactions['AMOUNT_AFTER_DISCOUNT'].to_numpy(dtype=np.float64)[order]
+        has_amount = ~np.isnan(amount)
+        earned = transactions['AMOUNT_EARNED_POINT'].to_numpy(dtype=np.float64)[order]
+        used = transactions['AMOUNT_USED_POINT'].to_numpy(dtype=np.float64)[order]
+
+        out = pd.DataFrame({
+            'UNIQUE_CUSTOMER_ID': customers.take(group_keys // len(programs)),
+            'KART_TIP_DETAY': programs.take(group_keys % len(programs)),
+        })
+
+        out['SON_ALV_TARIH'] = self._group_max(timed_id, has_timed_id & is_sale, starts)
+        out['SON_IADE_TARIH'] = self._group_max(timed_id, has_timed_id & is_return, starts)
+
+        out['RECENCY'] = reference_day - self._group_max(days, has_date, starts)
+        out['RECENCY_GECERLI'] = reference_day - self._group_max(days, has_date & is_sale, starts)
+        out['RECENCY_IADE'] = reference_day - self._group_max(days, has_date & is_return, starts)
+        out['SON_ISLEM_IADE'] = (out['RECENCY_IADE'] <= out['RECENCY_GECERLI']).astype(np.int64)
+
+        out['FREQUENCY'] = self._group_count(has_id, starts)
+        out['FREQUENCY_GECERLI'] = self._group_count(has_id & is_sale, starts)
+        out['FREQUENCY_IADE'] = self._group_count(has_id & is_return, starts)
+        frequency = out['FREQUENCY'].to_numpy(dtype=np.float64)
+        out['IADE_ORANI'] = self.oracle_round(out['FREQUENCY_IADE'].to_numpy() / np.where(frequency > 0, frequency, np.nan), 4)
+
+        out['MONETARY'] = self._group_sum(amount, has_amount, starts)
+        out['MONETARY_GECERLI'] = self._group_sum(amount, has_amount & is_sale, starts)
+        out['MONETARY_IADE'] = self._group_sum(amount, has_amount & is_return, starts)
+        monetary_sale = out['MONETARY_GECERLI'].to_numpy()
+        out['IADE_CIRO_ORANI'] = (out['MONETARY_IADE'].to_numpy() * -1) / np.where(monetary_sale != 0, monetary_sale, np.nan)
+
+        earned_total = np.add.reduceat(np.nan_to_num(earned, nan=0.0), starts)
+        used_total = np.add.reduceat(np.nan_to_num(used, nan=0.0), starts)
+        out['KAZANILAN_TUTAR'] = earned_total
+        out['HARCANAN_TUTAR'] = used_total
+        ratio = used_total / np.where(earned_total != 0, earned_total, np.nan)
+        out['KAZANILAN_HARCANAN_TUTAR_ORAN'] = self.oracle_round(np.nan_to_num(ratio, nan=0.0), 4)
+        out['KAZANILAN_TRX_CNT'] = self._group_count(earned > 0, starts)
+        out['HARCANILAN_TRX_CNT'] = self._group_count(used > 0, starts)
+
+        # HAVING SUM(AMOUNT_AFTER_DISCOUNT) > 15
+        out = out[out['MONETARY'] > self.min_monetary].reset_index(drop=True)
+
+        logging.info(f"RFM engine aggregated {len(transactions)} transactions into {len(out)} customer-program rows.")
+
+        return out[RFM_COLUMNS]
+
+    @staticmethod
+    def compare(engine_df: pd.DataFrame, sql_df: pd.DataFrame, tolerance: float = 1e-6) -> pd.DataFrame:
+        """
+        Compares the engine output with RFM_STG rows produced by 1-RFM.sql, column by column.
+
+        Args:
+            engine_df (pd.DataFrame): Output of compute.
+            sql_df (pd.DataFrame): RFM_STG rows fetched from the database for the same transactions.
+            tolerance (float): Relative tolerance for numeric columns.
+
+        Returns:
+            pd.DataFrame: Per column the number of compared rows, mismatches and the maximum absolute difference.
+        """
+        keys = ['UNIQUE_CUSTOMER_ID', 'KART_TIP_DETAY']
+        sql_df = sql_df.copy()
+        sql_df.columns = sql_df.columns.str.upper()
+
+        merged = engine_df.merge(sql_df, on=keys, how='outer', suffixes=('_ENGINE', '_SQL'), indicator=True)
+        matched = merged[merged['_merge'] == 'both']
+
+        report = [{'COLUMN': 'ROWS', 'COMPARED': len(merged), 'MISMATCHES': int((merged['_merge'] != 'both').sum()), 'MAX_ABS_DIFF': np.nan}]
+        for col in RFM_COLUMNS:
+            if col in keys:
+                continue
+            engine_values = pd.to_numeric(matched[f"{col}_ENGINE"], errors='coerce').to_numpy(dtype=np.float64)
+            sql_values = pd.to_numeric(matched[f"{col}_SQL"], errors='coerce').to_numpy(dtype=np.float64)
+
+            atol = tolerance + (10.0 ** -ROUNDED_COLUMNS[col] if col in ROUNDED_COLUMNS else 0.0)
+            both_null = np.isnan(engine_values) & np.isnan(sql_values)
+            close = np.isclose(engine_values, sql_values, rtol=tolerance, atol=atol)
+            diff = np.abs(engine_values - sql_values)
+
+            report.append({
+                'COLUMN': col,
+                'COMPARED': len(matched),
+                'MISMATCHES': int((~(both_null | close)).sum()),
+                'MAX_ABS_DIFF': np.nanmax(diff) if (~np.isnan(diff)).any() else 0.0
+            })
+
+        return pd.DataFrame(report)
@@ -2,7 +2,12 @@ import time
 import logging
 import os
 import sys
+import tempfile
+from datetime import date, datetime
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.dirname(os.path.dirname(current_dir))
@@ -12,8 +17,62 @@ from app.config import Config
 from app.utils.database import DatabaseManager
 from app.utils.file import FileManager
 from app.utils.general_utils import GeneralUtils
+from app.utils.artifact_store import ArtifactStore
+from app.utils.insight_metrics import SEGMENT_COLUMNS, segments_key
+from app.utils.memory_profiler import memory_stage
+from app.utils.metrics import ROWS_PROCESSED, tenant
 from app.utils.segmentation_utils import SegmentationUtils
 
+# P columns relative to the run date (P3 = RECENCY, TRUNC(SYSDATE) - last transaction), they change every day
+# and are moved forward in place instead of being compared
+TIME_RELATIVE_P_COLUMNS = ('P3',)
+
+STAT_COLUMNS = ['son_alv_tarih', 'ilk_odeme_tarih', 'monetary', 'frequency', 'ind_alv_orani',
+                'ort_indirim_orani', 'musteri_toplam_ciro', 'alisveris_adedi']
+
+
+def prepare_segmentation_input(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts the date columns of the segmentation input and drops rows without valid dates.
+    """
+    data['son_alv_tarih'] = GeneralUtils.convert_series_to_datetime(data['son_alv_tarih'])
+    data['ilk_odeme_tarih'] = GeneralUtils.convert_series_to_datetime(data['ilk_odeme_tarih'])
+
+    # Remove rows with NaT in date fields
+    return data.dropna(subset=['son_alv_tarih', 'ilk_odeme_tarih'])
+
+
+def segment_partition(arrow_path: str, indices, firm_id: int, rfm_stats: dict = None, clv_stats: dict = None,
+                      column_stats: dict = None) -> pd.DataFrame:
+    """
+    Runs RFM and CLV segmentation for one partition of the memory-mapped segmentation input.
+
+    Args:
+        arrow_path (str): Arrow IPC file holding the whole segmentation input.
+        indices (np.ndarray): Row positions of the partition.
+        firm_id (int): Firm identifier.
+        rfm_stats (dict): Tenant-wide RFM thresholds. Fitted on the partition when not given.
+        clv_stats (dict): Tenant-wide CLV thresholds. Fitted on the partition when not given.
+        column_stats (dict): Column ranges of the whole input, so every partition gets the same dtypes.
+
+    Returns:
+        pd.DataFrame: Segmented partition indexed by the original row positions.
+    """
+    with pa.memory_map(arrow_path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+        data = GeneralUtils.reduce_mem(table.take(indices).to_pandas(), column_stats)
+
+    data.index = indices
+    data.columns = data.columns.map(str.lower)
+    data = prepare_segmentation_input(data)
+
+    segment_utils = SegmentationUtils(firm_id)
+    data = segment_utils.RFM_segmentation(data, rfm_stats)
+    data = segment_utils.CLV_segmentation(data, clv_stats)
+
+    return data
+
+
 class Segmentation_Runner:
 
     def __init__(self, FIRM_ID: int, SCHEMA_NAME:str) -> None:
@@ -28,34 +87,218 @@ class Segmentation_Runner:
 
         self.start_time = time.time()
 
-    def run(self):
+    def run(self) -> bool:
+        """
+        Segments the firm and writes ANALYTIC_CUSTOMER. Errors are logged, not raised.
+
+        Returns:
+            bool: Whether the job succeeded.
+        """
 
         try:
 
             logging.error(f"Starting job: RFM_CLV")
                 
             schema_name = self.SCHEMA_NAME.split("_ELT")[0]
-            data = self.utils.reduce_mem(pd.read_parquet(f"data/{schema_name}_all_data.parquet"))
-            data.columns = data.columns.map(str.lower)
+            parquet_path = f"data/{schema_name}_all_data.parquet"
 
-            # Convert date columns to datetime
-            data['son_alv_tarih'] = data['son_alv_tarih'].apply(self.utils.convert_to_datetime)
-            data['ilk_odeme_tarih'] = data['ilk_odeme_tarih'].apply(self.utils.convert_to_datetime)
+            out_data = pd.DataFrame()
 
-                # Remove rows with NaT in date fields
-            data = data.dropna(subset=['son_alv_tarih', 'ilk_odeme_tarih'])
+            if self.config.segmentation_partition_mode:
+                data = self.run_partitioned(parquet_path)
+            else:
+                data = self.utils.read_parquet(parquet_path)
+                data.columns = data.columns.map(str.lower)
 
-            out_data = pd.DataFrame()
+                data = prepare_segmentation_input(data)
 
-            data = self.segment_utils.RFM_segmentation(data)                
-            data = self.segment_utils.CLV_segmentation(data)
+                with memory_stage("rfm_clv"):
+                    data = self.segment_utils.RFM_segmentation(data)                
+                    data = self.segment_utils.CLV_segmentation(data)
 
-            out_data = self.segment_utils.prep_output(data)
+            with memory_stage("prep_output"):
+                out_data = self.segment_utils.prep_output(data)
                     
             table_name = f"ANALYTIC_CUSTOMER"
-            self.db_manager.insert_data_to_db(out_data, table_name)
+            with memory_stage("write"):
+                if self.config.segmentation_write_mode == 'diff':
+                    self.write_changes(out_data, table_name)
+                else:
+                    self.db_manager.insert_data_to_db(out_data, table_name)
             logging.error(f"OUT DATAFRAME for CLV and RFM HAS BEEN INSERTED TO {self.SCHEMA_NAME}.{table_name}")
+            ROWS_PROCESSED.inc(len(out_data), firm=tenant(self.SCHEMA_NAME), stage="segmentation")
+
+            # typed segmentation output for the Smart Insight metrics of the same job
+            if self.config.insight_metrics_source == 'memory':
+                ArtifactStore.put(segments_key(self.SCHEMA_NAME), data[list(SEGMENT_COLUMNS)], checkpoint=False)
+
+            return True
 
         except Exception as e:
 
             logging.error(f"Error during job: {e}")
+            return False
+
+    def write_changes(self, out_data: pd.DataFrame, table_name: str, run_date: date = None) -> dict:
+        """
+        Writes only the inserted, changed and removed customers compared to the previous run.
+
+        The previous run is kept as a local snapshot of UNIQUE_CUSTOMER_ID, a hash of the P columns and the
+        run date. Inserted and changed rows are merged through the staging table, removed customers are deleted.
+        Without a snapshot the segmentation rows of the firm are rewritten in full.
+
+        The columns relative to the run date (TIME_RELATIVE_P_COLUMNS) are not hashed, otherwise every customer
+        would change every day. Instead RECENCY (P3) of every segmented row is moved forward by the days since the
+        previous run in one UPDATE before the changes are merged, so unchanged customers get the recency of this run.
+
+        Args:
+            out_data (pd.DataFrame): Output of prep_output.
+            table_name (str): Target table.
+            run_date (date): Day the recency of out_data is relative to. Defaults to today.
+
+        Returns:
+            dict: Number of inserted, changed, removed and total customers and the change ratio.
+        """
+        schema_name = self.SCHEMA_NAME.split("_ELT")[0]
+        snapshot_path = f"data/{schema_name}_segment_snapshot.parquet"
+        key_cols = ['UNIQUE_CUSTOMER_ID', 'FIRM_ID']
+        segment_filter = "P15 IS NOT NULL"
+
+        p_columns = sorted([col for col in out_data.columns if col.startswith('P') and col not in TIME_RELATIVE_P_COLUMNS],
+                           key=lambda col: int(col[1:]))
+        run_date = run_date or date.today()
+        snapshot = pd.DataFrame({
+            'UNIQUE_CUSTOMER_ID': out_data['UNIQUE_CUSTOMER_ID'].values,
+            'ROW_HASH': pd.util.hash_pandas_object(out_data[p_columns], index=False).values,
+            'RUN_DATE': run_date
+        })
+
+        if os.path.exists(snapshot_path):
+            previous = pd.read_parquet(snapshot_path)
+            if 'RUN_DATE' in previous and not previous.empty:
+                previous_run = pd.Timestamp(previous['RUN_DATE'].iloc[0]).date()
+            else:
+                previous_run = datetime.fromtimestamp(os.path.getmtime(snapshot_path)).date()
+            previous = previous.drop(columns='RUN_DATE', errors='ignore')
+
+            # the rows written or moved forward by the previous run hold the recency of its run date; changed
+            # and inserted customers are overwritten by the merge below
+            days = (run_date - previous_run).days
+            if days > 0:
+                self.db_manager.execute_statement(
+                    f"UPDATE {self.SCHEMA_NAME}.{table_name} SET P3 = TO_CHAR(TO_NUMBER(P3) + {days}) "
+                    f"WHERE FIRM_ID = {self.FIRM_ID} AND {segment_filter} AND REGEXP_LIKE(P3, '^-?[0-9]+(\\.[0-9]+)?$')")
+            compared = snapshot.merge(previous, on='UNIQUE_CUSTOMER_ID', how='outer', suffixes=('', '_PREV'), indicator=True)
+
+            inserted = compared['_merge'] == 'left_only'
+            changed = (compared['_merge'] == 'both') & (compared['ROW_HASH'] != compared['ROW_HASH_PREV'])
+            removed_ids = compared.loc[compared['_merge'] == 'right_only', 'UNIQUE_CUSTOMER_ID']
+
+            upsert_ids = compared.loc[inserted | changed, 'UNIQUE_CUSTOMER_ID']
+            upsert_data = out_data[out_data['UNIQUE_CUSTOMER_ID'].isin(upsert_ids)]
+
+            if not upsert_data.empty:
+                self.db_manager.merge_data_to_db(upsert_data, table_name, self.config.segmentation_staging_table,
+                                                 key_cols, target_filter=segment_filter)
+            if not removed_ids.empty:
+                removed_keys = pd.DataFrame({'UNIQUE_CUSTOMER_ID': removed_ids.values, 'FIRM_ID': self.FIRM_ID})
+                self.db_manager.delete_rows_by_keys(removed_keys, table_name, target_filter=segment_filter)
+
+            summary = {'inserted': int(inserted.sum()), 'changed': int(changed.sum()), 'removed': len(removed_ids)}
+        else:
+            logging.info(f"No segment snapshot for {self.SCHEMA_NAME}, rewriting all segmentation rows.")
+            self.db_manager.execute_statement(f"DELETE FROM {self.SCHEMA_NAME}.{table_name} WHERE FIRM_ID = {self.FIRM_ID} AND {segment_filter}")
+            self.db_manager.insert_data_to_db(out_data, table_name)
+
+            summary = {'inserted': len(out_data), 'changed': 0, 'removed': 0}
+
+        snapshot.to_parquet(snapshot_path, index=False)
+
+        summary['total'] = len(out_data)
+        summary['change_ratio'] = round((summary['inserted'] + summary['changed'] + summary['removed']) / max(len(out_data), 1), 4)
+        logging.info(f"Segment changes for {self.SCHEMA_NAME}: {summary}")
+
+        return summary
+
+    def partition_indices(self, table: pa.Table) -> list:
+        """
+        Splits the row positions of the segmentation input into partitions.
+
+        In 'program' mode every KART_TIP_DETAY value is a partition and gets its own statistics.
+        In 'hash' mode customers are spread over partitions by a hash of UNIQUE_CUSTOMER_ID.
+
+        Args:
+            table (pa.Table): Segmentation input.
+
+        Returns:
+            list: (partition key, row positions) tuples in a deterministic order.
+        """
+        mode = self.config.segmentation_partition_mode
+        columns = {col.upper(): col for col in table.column_names}
+
+        if mode == 'program':
+            keys = table.column(columns['KART_TIP_DETAY']).to_pandas().astype(str)
+        elif mode == 'hash':
+            n_partitions = self.config.segmentation_hash_partitions or self.config.segmentation_workers or os.cpu_count()
+            customer_ids = table.column(columns['UNIQUE_CUSTOMER_ID']).to_pandas()
+            keys = pd.util.hash_pandas_object(customer_ids, index=False) % n_partitions
+        else:
+            raise ValueError(f"Invalid segmentation partition mode: {mode}. Allowed values are 'program', 'hash'.")
+
+        groups = keys.reset_index(drop=True).groupby(keys.values, sort=True).indices
+        return [(key, groups[key]) for key in sorted(groups)]
+
+    def run_partitioned(self, parquet_path: str) -> pd.DataFrame:
+        """
+        Segments the input partition by partition in a process pool.
+
+        The input is written once to an Arrow IPC file which every worker memory-maps, so only
+        row positions and statistics are sent to the workers. In 'hash' mode the thresholds are
+        fitted on the whole tenant before the partitions are processed.
+
+        Args:
+            parquet_path (str): Segmentation input written by the data preparation job.
+
+        Returns:
+            pd.DataFrame: Segmented data in the original row order.
+        """
+        table = pq.read_table(parquet_path)
+        column_stats = self.utils.parquet_column_stats(parquet_path)
+
+        # a file of its own next to the input, so concurrent runs of the same schema do not share it
+        fd, arrow_path = tempfile.mkstemp(prefix=f"{os.path.basename(parquet_path)}.", suffix=".arrow",
+                                          dir=os.path.dirname(parquet_path) or ".")
+        os.close(fd)
+        try:
+            with pa.OSFile(arrow_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+            partitions = self.partition_indices(table)
+
+            rfm_stats, clv_stats = None, None
+            if self.config.segmentation_partition_mode == 'hash':
+                stat_columns = [col for col in table.column_names if col.lower() in STAT_COLUMNS]
+                stat_data = self.utils.reduce_mem(table.select(stat_columns).to_pandas(), column_stats)
+                stat_data.columns = stat_data.columns.map(str.lower)
+                stat_data = prepare_segmentation_input(stat_data)
+
+                rfm_stats = self.segment_utils.RFM_statistics(stat_data)
+                clv_stats = self.segment_utils.CLV_statistics(self.segment_utils.CLV_values(stat_data))
+                del stat_data
+
+            del table
+
+            workers = self.config.segmentation_workers or os.cpu_count()
+            logging.info(f"Segmenting {len(partitions)} partitions of {self.SCHEMA_NAME} with {workers} workers.")
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(segment_partition, arrow_path, indices, self.FIRM_ID, rfm_stats, clv_stats,
+                                           column_stats)
+                           for _, indices in partitions]
+                results = [future.result() for future in futures]
+
+        finally:
+            os.remove(arrow_path)
+
+        return pd.concat(results).sort_index()
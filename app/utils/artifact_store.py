@@ -0,0 +1,186 @@
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+from app.config import Config
+from app.utils.general_utils import GeneralUtils
+
+
+class ArtifactStore:
+    """
+    Hands Arrow tables from one pipeline stage to the next within the process.
+
+    Artifacts are keyed by the path of their Parquet checkpoint. A stage that runs in the same process as
+    the producer gets the table from memory, or memory-mapped from its Arrow IPC spill file, instead of
+    decoding the Parquet file again; a stage running in another process falls back to the checkpoint.
+
+    Tables larger than Config.artifact_spill_mb (0 = never) are spilled to Config.artifact_dir and only
+    memory-mapped when read.
+
+    Usage:
+        ArtifactStore.put("data/churn/TR_FIRM_churn_dataset.parquet", df)
+        df = ArtifactStore.read_pandas("data/churn/TR_FIRM_churn_dataset.parquet")
+    """
+
+    _artifacts = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def column_stats(table: pa.Table) -> dict:
+        """
+        {column: (min, max)} of the integer and float columns, in the format of GeneralUtils.parquet_column_stats.
+        """
+        stats = {}
+        for field in table.schema:
+            if not (pa.types.is_integer(field.type) or pa.types.is_floating(field.type)):
+                continue
+            min_max = pc.min_max(table[field.name])
+            if min_max["min"].is_valid:
+                stats[field.name] = (min_max["min"].as_py(), min_max["max"].as_py())
+
+        return stats
+
+    @classmethod
+    def put(cls, key: str, data, checkpoint: bool = True, row_group_size: int = None) -> pa.Table:
+        """
+        Stores a DataFrame or Arrow table under key and, if checkpoint is set, writes it to the Parquet file key.
+
+        Args:
+            key (str): Path of the Parquet checkpoint.
+            data (pd.DataFrame | pa.Table): Artifact to store.
+            checkpoint (bool): Whether to write the Parquet checkpoint.
+            row_group_size (int): Rows per row group of the checkpoint.
+
+        Returns:
+            pa.Table: The stored table.
+        """
+        table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False)
+        config = Config()
+
+        if checkpoint:
+            os.makedirs(os.path.dirname(key) or ".", exist_ok=True)
+            pq.write_table(table, key, row_group_size=row_group_size)
+
+        artifact = {"table": table, "spill_path": None, "stats": cls.column_stats(table)}
+        if config.artifact_spill_mb and table.nbytes > config.artifact_spill_mb * 1024 ** 2:
+            os.makedirs(config.artifact_dir, exist_ok=True)
+            spill_path = os.path.join(config.artifact_dir, os.path.basename(key).replace(".parquet", "") + ".arrow")
+            with pa.OSFile(spill_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            artifact.update(table=None, spill_path=spill_path)
+            logging.info(f"Artifact {key} ({table.nbytes / 1024 ** 2:.1f} MB) spilled to {spill_path}.")
+
+        cls.release(key)
+        with cls._lock:
+            cls._artifacts[key] = artifact
+
+        return table
+
+    @classmethod
+    def contains(cls, key: str) -> bool:
+        with cls._lock:
+            return key in cls._artifacts
+
+    @classmethod
+    def read_table(cls, key: str, columns: list = None) -> pa.Table:
+        """
+        Returns the table stored under key, memory-mapped if it was spilled, or read from its Parquet checkpoint.
+        """
+        with cls._lock:
+            artifact = cls._artifacts.get(key)
+
+        if artifact is None:
+            return pq.read_table(key, columns=columns)
+
+        table = artifact["table"]
+        if table is None:
+            table = pa.ipc.open_file(pa.memory_map(artifact["spill_path"], "r")).read_all()
+
+        return table.select(columns) if columns is not None else table
+
+    @classmethod
+    def read_pandas(cls, key: str, columns: list = None) -> pd.DataFrame:
+        """
+        read_table converted to pandas with reduced memory usage, like GeneralUtils.read_parquet.
+        """
+        with cls._lock:
+            artifact = cls._artifacts.get(key)
+
+        if artifact is None:
+            return GeneralUtils.read_parquet(key, columns=columns)
+
+        return GeneralUtils.reduce_mem(cls.read_table(key, columns).to_pandas(), artifact["stats"])
+
+    @classmethod
+    def stats(cls, key: str) -> dict:
+        """
+        Column ranges of the artifact, taken from its Parquet footer when it is not in the store.
+        """
+        with cls._lock:
+            artifact = cls._artifacts.get(key)
+
+        return artifact["stats"] if artifact is not None else GeneralUtils.parquet_column_stats(key)
+
+    @classmethod
+    def iter_batches(cls, key: str, batch_size: int):
+        """
+        Yields record batches of at most batch_size rows, from the store or from the Parquet row groups.
+        """
+        if not cls.contains(key):
+            yield from pq.ParquetFile(key).iter_batches(batch_size=batch_size)
+            return
+
+        for batch in cls.read_table(key).to_batches(max_chunksize=batch_size):
+            yield batch
+
+    @classmethod
+    def num_rows(cls, key: str) -> int:
+        if not cls.contains(key):
+            return pq.ParquetFile(key).metadata.num_rows
+        return cls.read_table(key).num_rows
+
+    @classmethod
+    def release(cls, key: str) -> None:
+        """
+        Drops the artifact from memory and removes its spill file. The Parquet checkpoint is kept.
+        """
+        with cls._lock:
+            artifact = cls._artifacts.pop(key, None)
+
+        if artifact is not None and artifact["spill_path"] and os.path.exists(artifact["spill_path"]):
+            os.remove(artifact["spill_path"])
+
+    @classmethod
+    @contextmanager
+    def scope(cls):
+        """
+        Releases the artifacts stored within the block when it exits, also those no stage read, e.g. the
+        segmentation output of a firm without Smart Insight.
+
+        Usage:
+            with ArtifactStore.scope():
+                ...
+        """
+        with cls._lock:
+            before = set(cls._artifacts)
+        try:
+            yield
+        finally:
+            with cls._lock:
+                stored = [key for key in cls._artifacts if key not in before]
+            for key in stored:
+                cls.release(key)
+            if stored:
+                logging.info(f"Released {len(stored)} artifacts: {stored}")
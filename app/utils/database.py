@@ -4,6 +4,7 @@ import datetime
 import os
 import sys
 import logging
+import time
 
 from datetime import datetime as dt
 
@@ -18,6 +19,9 @@ from app.config import Config
 import warnings
 from sqlalchemy import create_engine, inspect, text
 from app.utils.general_utils import GeneralUtils
+from app.utils.memory_profiler import memory_stage
+from app.utils.sql_stats import SQLStats
+from app.utils.metrics import INSERT_THROUGHPUT, ROWS_INSERTED, tenant
 warnings.filterwarnings("ignore")
 
 class DatabaseManager:
@@ -28,6 +32,7 @@ class DatabaseManager:
         self.connection_string = self.config.connection_string
         self.cs = self.config.cs
         self.SCHEMA_NAME = SCHEMA_NAME
+        self.sql_stats = SQLStats(SCHEMA_NAME)
 
     def create_engine(self):
         """
@@ -140,9 +145,10 @@ class DatabaseManager:
             VALUES ({', '.join([':' + str(i + 1) for i in range(len(df.columns))])})
         """
 
+        start = time.perf_counter()
         try:
-            with self.create_connection() as connection:
-                with connection.cursor() as cursor:
+            with memory_stage("insert_data_to_db"), self.create_connection() as connection:
+                with connection.cursor() as cursor, self.sql_stats.track(connection, insert_query, operation="insert_data_to_db") as stats:
                     total_rows = len(df)
                     for start_idx in range(0, total_rows, batch_size):
                         end_idx = min(start_idx + batch_size, total_rows)
@@ -161,13 +167,146 @@ class DatabaseManager:
                         # Execute the batch insert
                         cursor.executemany(insert_query, data)
                         connection.commit()
+                        stats['round_trips'] += 2
+
+                    stats['rows'] = total_rows
 
                     logging.info(f"Inserted {total_rows} rows into {self.SCHEMA_NAME}.{table_name}.")
 
+            ROWS_INSERTED.inc(total_rows, firm=tenant(self.SCHEMA_NAME), table=table_name)
+            seconds = time.perf_counter() - start
+            if total_rows and seconds > 0:
+                INSERT_THROUGHPUT.observe(total_rows / seconds, firm=tenant(self.SCHEMA_NAME), table=table_name)
+
         except oracledb.DatabaseError as e:
             logging.error(f"Error inserting data into {self.SCHEMA_NAME}.{table_name}: {e}")
             raise
 
+    def table_exists(self, table_name: str) -> bool:
+        """
+        Checks whether the specified table exists in the schema.
+        """
+        query = f"""
+            SELECT COUNT(*)
+            FROM ALL_TABLES
+            WHERE TABLE_NAME = '{table_name.upper()}' AND OWNER = '{self.SCHEMA_NAME.upper()}'
+        """
+        try:
+            with self.create_connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(query)
+                    return cursor.fetchone()[0] > 0
+        except oracledb.DatabaseError as e:
+            logging.error(f"Error checking table {self.SCHEMA_NAME}.{table_name}: {e}")
+            raise
+
+    def merge_data_to_db(self, df: pd.DataFrame, table_name: str, staging_table: str, key_cols: list,
+                         target_filter: str = None, batch_size: int = 1000):
+        """
+        Upserts data from a DataFrame into the specified table through a staging table and a MERGE statement.
+
+        The staging table is created with the structure of the target table when it does not exist.
+
+        Args:
+            df (pd.DataFrame): DataFrame containing the inserted and changed rows.
+            table_name (str): Name of the target table.
+            staging_table (str): Name of the staging table.
+            key_cols (list): Columns identifying a row.
+            target_filter (str): Condition restricting the target rows that can be matched (e.g. "P15 IS NOT NULL").
+            batch_size (int): Number of rows to process in each batch.
+        """
+        if not self.table_exists(staging_table):
+            self.execute_statement(f"CREATE TABLE {self.SCHEMA_NAME}.{staging_table} AS SELECT * FROM {self.SCHEMA_NAME}.{table_name} WHERE 1=0")
+            logging.info(f"Staging table {self.SCHEMA_NAME}.{staging_table} created.")
+
+        self.delete_all_records_in_table(staging_table)
+        self.insert_data_to_db(df, staging_table, batch_size=batch_size)
+
+        table_columns = self.get_table_columns(table_name)
+        columns = [col for col in df.columns if col in table_columns]
+        update_cols = [col for col in columns if col not in key_cols + ["CREATED_BY", "CREATE_DATE"]]
+
+        key_join = " AND ".join([f"tgt.{col} = s.{col}" for col in key_cols])
+        where_clause = f"WHERE {target_filter}" if target_filter else ""
+
+        merge_query = f"""
+            MERGE INTO {self.SCHEMA_NAME}.{table_name} t
+            USING (
+                SELECT s.*, tgt.RID
+                FROM {self.SCHEMA_NAME}.{staging_table} s
+                LEFT JOIN (SELECT ROWID AS RID, {', '.join(key_cols)} FROM {self.SCHEMA_NAME}.{table_name} {where_clause}) tgt
+                    ON {key_join}
+            ) src
+            ON (t.ROWID = src.RID)
+            WHEN MATCHED THEN UPDATE SET {', '.join([f't.{col} = src.{col}' for col in update_cols])}
+            WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) VALUES ({', '.join([f'src.{col}' for col in columns])})
+        """
+
+        rows = self.execute_statement(merge_query)
+        logging.info(f"Merged {rows} rows into {self.SCHEMA_NAME}.{table_name}.")
+
+    def delete_rows_by_keys(self, keys_df: pd.DataFrame, table_name: str, target_filter: str = None, batch_size: int = 1000):
+        """
+        Deletes the rows whose key values are listed in keys_df.
+
+        Args:
+            keys_df (pd.DataFrame): DataFrame whose columns are the key columns of the table.
+            table_name (str): Name of the table.
+            target_filter (str): Additional condition on the deleted rows.
+            batch_size (int): Number of keys to process in each batch.
+        """
+        conditions = [f"{col} = :{i + 1}" for i, col in enumerate(keys_df.columns)]
+        if target_filter:
+            conditions.append(target_filter)
+
+        delete_query = f"DELETE FROM {self.SCHEMA_NAME}.{table_name} WHERE {' AND '.join(conditions)}"
+
+        try:
+            with self.create_connection() as connection:
+                with connection.cursor() as cursor, self.sql_stats.track(connection, delete_query, operation="delete_rows_by_keys") as stats:
+                    keys = keys_df.values.tolist()
+                    for start_idx in range(0, len(keys), batch_size):
+                        cursor.executemany(delete_query, keys[start_idx:start_idx + batch_size])
+                        stats['round_trips'] += 1
+                        stats['rows'] += cursor.rowcount
+                    connection.commit()
+                    stats['round_trips'] += 1
+                    logging.info(f"Deleted {len(keys)} keys from {self.SCHEMA_NAME}.{table_name}.")
+        except oracledb.DatabaseError as e:
+            logging.error(f"Error deleting rows from {self.SCHEMA_NAME}.{table_name}: {e}")
+            raise
+
+    def execute_statement(self, statement: str, template: str = None) -> int:
+        """
+        Executes a single SQL statement and returns the number of affected rows.
+        """
+        try:
+            with self.create_connection() as connection:
+                with connection.cursor() as cursor, self.sql_stats.track(connection, statement, template, "execute_statement") as stats:
+                    cursor.execute(statement)
+                    connection.commit()
+                    stats['rows'], stats['round_trips'] = cursor.rowcount, 2
+                    return cursor.rowcount
+        except oracledb.DatabaseError as e:
+            logging.error(f"Error executing statement: {e}")
+            raise
+
+    def delete_records(self, table_name: str, condition: str):
+        """
+        Deletes the records matching the condition from the specified table.
+        """
+        delete_query = f"DELETE FROM {self.SCHEMA_NAME}_ELT.{table_name} WHERE {condition}"
+        try:
+            with self.create_connection() as connection:
+                with connection.cursor() as cursor, self.sql_stats.track(connection, delete_query, operation="delete_records") as stats:
+                    cursor.execute(delete_query)
+                    connection.commit()
+                    stats['rows'], stats['round_trips'] = cursor.rowcount, 2
+                    logging.error(f"Records matching {condition} has been deleted from {table_name}.")
+        except oracledb.DatabaseError as e:
+            logging.error(f"Error deleting records from {table_name}: {e}")
+            raise
+
     def delete_all_records(self, table_name: str):
         """
         Deletes all records from the specified table.
@@ -176,9 +315,10 @@ class DatabaseManager:
         try:
             with self.create_connection() as connection:
                 logging.error(f"Truncating table: {table_name}.")
-                with connection.cursor() as cursor:
+                with connection.cursor() as cursor, self.sql_stats.track(connection, delete_query, operation="delete_all_records") as stats:
                     cursor.execute(delete_query)
                     connection.commit()
+                    stats['rows'], stats['round_trips'] = cursor.rowcount, 2
                     logging.error(f"All records has been deleted from {table_name}.")
         except oracledb.DatabaseError as e:
             logging.error(f"Error deleting records from {table_name}: {e}")
@@ -196,9 +336,10 @@ class DatabaseManager:
                 query = query.strip(" \n;")
 
             with self.create_connection() as connection:
-                with connection.cursor() as cursor:
+                with connection.cursor() as cursor, self.sql_stats.track(connection, query, query_path, "execute_query") as stats:
                     cursor.execute(query)
                     connection.commit()
+                    stats['rows'], stats['round_trips'] = cursor.rowcount, 2
                     logging.info(f"Query executed from file: {query_path}")
         except (oracledb.DatabaseError, FileNotFoundError) as e:
             logging.error(f"Error executing query: {e}")
@@ -227,8 +368,10 @@ class DatabaseManager:
                         query = query.replace("{end_dt}", end_dt)
                         query = query.replace("{SCHEMA_NAME}", schema_name)
                         query = query.replace("{schema_name}", schema_name)
-                        cursor.execute(query)
-                        connection.commit()
+                        with self.sql_stats.track(connection, query, query_file, "execute_queries") as stats:
+                            cursor.execute(query)
+                            connection.commit()
+                            stats['rows'], stats['round_trips'] = cursor.rowcount, 2
 
                         logging.info(f"Executed query from {query_file}")
         except Exception as e:
@@ -276,20 +419,21 @@ class DatabaseManager:
         else: 
             pass
         
-    def fetch_data_as_df(self, query: str, batch_size: int = 10000) -> pd.DataFrame:
+    def fetch_data_as_df(self, query: str, batch_size: int = 10000, template: str = None) -> pd.DataFrame:
         """
         Executes a SQL query and returns the result as a pandas DataFrame with optimized fetching using oracledb.
         
         Args:
             query (str): SQL query to execute.
             batch_size (int): Number of rows to fetch per batch.
+            template (str): Path of the SQL file of the query, recorded as its template in the SQL statistics.
             
         Returns:
             pd.DataFrame: Resulting data from the query as a DataFrame.
         """
         try:
             # Establish a connection
-            with self.create_connection() as connection:
+            with self.create_connection() as connection, self.sql_stats.track(connection, query, template, "fetch_data_as_df") as stats:
                 cursor = connection.cursor()
                 logging.info("Executing query...")
 
@@ -309,6 +453,9 @@ class DatabaseManager:
 
                 # Convert to DataFrame
                 df = pd.DataFrame(data, columns=column_names)
+                stats['rows'] = len(df)
+                stats['fetched_bytes'] = int(df.memory_usage(index=False, deep=True).sum())
+                stats['round_trips'] = self.sql_stats.fetch_round_trips(cursor, len(df))
                 logging.info("Data successfully fetched and converted to DataFrame.")
                 return df
 
@@ -329,9 +476,10 @@ class DatabaseManager:
         delete_query = f"TRUNCATE TABLE {self.SCHEMA_NAME}.{table_name}"
         try:
             with self.create_connection() as connection:
-                with connection.cursor() as cursor:
+                with connection.cursor() as cursor, self.sql_stats.track(connection, delete_query, operation="delete_all_records_in_table") as stats:
                     cursor.execute(delete_query)
                     connection.commit()
+                    stats['round_trips'] = 2
                     logging.info(f"All records deleted from {self.SCHEMA_NAME}.{table_name}.")
         except oracledb.DatabaseError as e:
             logging.error(f"Error truncating table {self.SCHEMA_NAME}.{table_name}: {e}")
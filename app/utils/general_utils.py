@@ -1,7 +1,9 @@
 from datetime import datetime
+from functools import lru_cache
 import pandas as pd
 import numpy as np
 import uuid
+import logging
 
 class GeneralUtils:
  
@@ -23,22 +25,145 @@ class GeneralUtils:
         return unique_id
 
     @staticmethod
-    def reduce_mem(df: pd.DataFrame) -> pd.DataFrame:
+    def parquet_column_stats(path: str) -> dict:
         """
-        Reduces memory usage of a DataFrame by downcasting numerical columns.
+        Reads the min/max statistics of the numeric columns from the Parquet footer.
+
+        Columns are only returned when every row group carries statistics for them.
+
+        Args:
+            path (str): Path of the Parquet file.
+
+        Returns:
+            dict: {column: (min, max)}
+        """
+        import pyarrow.parquet as pq
+
+        metadata = pq.ParquetFile(path).metadata
+        stats = {}
+        for i in range(metadata.num_columns):
+            name = metadata.schema.column(i).name
+            if metadata.schema.column(i).physical_type not in ('INT32', 'INT64', 'FLOAT', 'DOUBLE'):
+                continue
+
+            mins, maxs = [], []
+            for rg in range(metadata.num_row_groups):
+                col_stats = metadata.row_group(rg).column(i).statistics
+                if col_stats is None or not col_stats.has_min_max:
+                    break
+                mins.append(col_stats.min)
+                maxs.append(col_stats.max)
+            else:
+                if mins:
+                    stats[name] = (min(mins), max(maxs))
+
+        return stats
+
+    @staticmethod
+    def optimize_dtypes(df: pd.DataFrame, column_stats: dict = None, category_ratio: float = 0.5) -> tuple:
+        """
+        Picks the smallest safe dtype for every column.
+
+        - Integers are downcast to the smallest signed type holding their min/max.
+        - Floats are downcast to float32 only when their magnitude stays below 2**24, so that
+          integral values such as YYYYMMDD dates and ids are kept exact.
+        - String columns whose distinct ratio is at most category_ratio become categoricals.
+
+        Args:
+            df (pd.DataFrame): DataFrame to optimize in place.
+            column_stats (dict): {column: (min, max)} from parquet_column_stats, used instead of scanning the column.
+            category_ratio (float): Maximum distinct/non-null ratio for converting strings to categoricals.
+
+        Returns:
+            tuple: (optimized DataFrame, per column report with bytes before and after)
+        """
+        column_stats = column_stats or {}
+        report = []
+
+        for c in df.columns:
+            col = df[c]
+            dtype_before = str(col.dtype)
+            bytes_before = col.memory_usage(index=False, deep=col.dtype == object)
+            source = 'scan'
+
+            if pd.api.types.is_integer_dtype(col.dtype) or pd.api.types.is_float_dtype(col.dtype):
+                if c in column_stats:
+                    col_min, col_max = column_stats[c]
+                    source = 'parquet_stats'
+                else:
+                    col_min, col_max = col.min(), col.max()
+
+                if pd.isna(col_min) or pd.isna(col_max):
+                    new_dtype = None
+                elif pd.api.types.is_integer_dtype(col.dtype):
+                    new_dtype = next((t for t in (np.int8, np.int16, np.int32, np.int64)
+                                      if np.iinfo(t).min <= col_min and col_max <= np.iinfo(t).max), None)
+                elif max(abs(col_min), abs(col_max)) < 2 ** 24:
+                    new_dtype = np.float32
+                else:
+                    new_dtype = None
+
+                if new_dtype is not None and np.dtype(new_dtype) != col.dtype:
+                    df[c] = col.astype(new_dtype)
+
+            elif col.dtype == object:
+                non_null = col.dropna()
+                if len(non_null) and pd.api.types.infer_dtype(non_null.iloc[:10000], skipna=True) == 'string':
+                    sample = non_null.iloc[:10000]
+                    if sample.nunique() <= category_ratio * len(sample) and non_null.nunique() <= category_ratio * len(non_null):
+                        df[c] = col.astype('category')
+
+            report.append({
+                'COLUMN': c,
+                'DTYPE_BEFORE': dtype_before,
+                'DTYPE_AFTER': str(df[c].dtype),
+                'BYTES_BEFORE': bytes_before,
+                'BYTES_AFTER': df[c].memory_usage(index=False, deep=df[c].dtype == object),
+                'SOURCE': source
+            })
+
+        return df, pd.DataFrame(report)
+
+    @staticmethod
+    def reduce_mem(df: pd.DataFrame, column_stats: dict = None) -> pd.DataFrame:
+        """
+        Reduces memory usage of a DataFrame with optimize_dtypes and logs the saving.
         """
-        for c in df.select_dtypes("int64").columns:
-            df[c] = df[c].astype(np.int32)
+        from app.utils.memory_profiler import memory_stage
 
-        for c in df.select_dtypes("float64").columns:
-            df[c] = df[c].astype(np.float32)
+        with memory_stage("reduce_mem"):
+            df, report = GeneralUtils.optimize_dtypes(df, column_stats)
 
-        binary_cols = df.nunique().to_frame("unique_count").query("unique_count == 2").index.tolist()
-        for c in df[binary_cols].select_dtypes("int32").columns:
-            df[c] = df[c].astype(np.int8)
+        bytes_before, bytes_after = report['BYTES_BEFORE'].sum(), report['BYTES_AFTER'].sum()
+        logging.info(f"Memory reduced from {bytes_before / 1024 ** 2:.1f} MB to {bytes_after / 1024 ** 2:.1f} MB.")
+        logging.debug(f"Memory usage per column:\n{report.to_string(index=False)}")
 
         return df
 
+    @staticmethod
+    def read_parquet(path: str, columns: list = None) -> pd.DataFrame:
+        """
+        Reads a Parquet file and reduces its memory usage, taking the column ranges from the file statistics.
+        """
+        from app.utils.memory_profiler import memory_stage
+
+        with memory_stage("read_parquet"):
+            df = pd.read_parquet(path, columns=columns)
+        return GeneralUtils.reduce_mem(df, GeneralUtils.parquet_column_stats(path))
+
+    @staticmethod
+    def frame_fingerprint(df: pd.DataFrame) -> str:
+        """
+        Order-independent fingerprint of a DataFrame: the wrapping sum of its row hashes,
+        combined with its columns and row count.
+        """
+        import hashlib
+
+        row_hash_sum = int(pd.util.hash_pandas_object(df, index=False).to_numpy().sum(dtype=np.uint64))
+        key = f"{list(df.columns)}|{len(df)}|{row_hash_sum}"
+
+        return hashlib.sha256(key.encode("UTF-8")).hexdigest()[:32]
+
     @staticmethod
     def convert_to_datetime(date_num):
         """Converts a numeric date in 'YYYYMMDD' format to a datetime object.
@@ -55,6 +180,22 @@ class GeneralUtils:
         except ValueError:
             return pd.NaT
 
+    @staticmethod
+    def convert_series_to_datetime(series: pd.Series) -> pd.Series:
+        """Applies convert_to_datetime once per distinct value and maps the results back.
+
+        Date columns hold a few thousand distinct days, so this is much cheaper than a row-wise apply.
+
+        Args:
+            series: Series of numeric dates in 'YYYYMMDD' format.
+
+        Returns:
+            A datetime64 Series with NaT where the conversion fails.
+        """
+        uniques = series.dropna().unique()
+        mapping = {value: GeneralUtils.convert_to_datetime(value) for value in uniques}
+        return pd.to_datetime(series.map(mapping))
+
 
     @staticmethod
     def sql_dtype_setter(df: pd.DataFrame) -> dict:
@@ -95,6 +236,7 @@ class GeneralUtils:
         return num_dict[num]
 
     @staticmethod
+    @lru_cache(maxsize=4096, typed=True)
     def tr_ek(num:int):
         
         try:
@@ -153,9 +295,9 @@ class Analytical_Utils:
         """
 
         for col in columns:
-            # Apply square root transformation
+            # Apply square root transformation (in float64, downcast int8 columns would give float16)
             transformed_col = f"{col}_sqrt"
-            data[transformed_col] = np.sqrt(data[col])
+            data[transformed_col] = np.sqrt(data[col].astype('float64'))
 
             # Calculate mean and standard deviation
             col_mean = data[transformed_col].mean()
@@ -169,6 +311,107 @@ class Analytical_Utils:
 
         return data
 
+    @staticmethod
+    def suppress_outliers_by_group(data: pd.DataFrame, group_ids: np.ndarray, exclude_cols: list = None,
+                                   threshold: float = 0.01) -> pd.DataFrame:
+        """
+        Grouped version of detect_extreme_outlier_columns + suppress_outliers.
+
+        Within every group, the numeric columns flagged by the IQR rule are replaced by their square root,
+        clipped at mean + 3*std of the group. Quartiles, outlier ratios, means and standard deviations are
+        computed for all groups at once with groupby, instead of filtering a copy of the frame per group.
+
+        Args:
+            data (pd.DataFrame): Input DataFrame.
+            group_ids (np.ndarray): Non-negative group id per row, -1 for rows to drop.
+            exclude_cols (list): Numeric columns that are never suppressed (e.g. ids).
+            threshold (float): Proportion threshold of detect_extreme_outlier_columns.
+
+        Returns:
+            pd.DataFrame: Rows ordered by group id (keeping their order within a group) with suppressed columns.
+        """
+        group_ids = np.asarray(group_ids)
+        keep = np.flatnonzero(group_ids >= 0)
+        order = keep[np.argsort(group_ids[keep], kind='stable')]
+
+        data = data.iloc[order].copy()
+        groups = group_ids[order]
+
+        exclude_cols = exclude_cols or []
+        numeric_cols = [col for col in data.select_dtypes(include=[np.number]).columns if col not in exclude_cols]
+        if not numeric_cols or data.empty:
+            return data
+
+        # extreme outlier columns per group (groups are sorted, so the codes follow the group ids)
+        codes, uniques = pd.factorize(groups)
+        x = data[numeric_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+        flags = Analytical_Utils.extreme_outlier_flags(x, codes, len(uniques), threshold)
+
+        # sqrt transform and clipping at mean + 3*std within flagged groups
+        for j in np.flatnonzero(flags.any(axis=0)):
+            col = numeric_cols[j]
+            with np.errstate(invalid='ignore'):
+                transformed = pd.Series(np.sqrt(x[:, j]), index=data.index)
+            grouped_col = transformed.groupby(groups)
+            col_threshold = (grouped_col.transform('mean') + 3 * grouped_col.transform('std')).to_numpy()
+            transformed = np.where(transformed > col_threshold, col_threshold, transformed)
+
+            data[col] = np.where(flags[codes, j], transformed, x[:, j])
+
+        return data
+
+    @staticmethod
+    def stratified_sample(group_ids: np.ndarray, budget: int, min_rows: int = 1000, seed: int = 42) -> tuple:
+        """
+        Stratified random sample of at most about budget rows.
+
+        Every stratum keeps the same share of its rows, but at least min_rows (or all of them when it is
+        smaller), so that small programs and the minority class stay represented. The share is found by
+        bisection so that the sample fills the budget. Sampled rows are weighted by stratum size / sample size.
+        Rows without a stratum are all kept with weight 1 and count against the budget.
+
+        Args:
+            group_ids (np.ndarray): Non-negative stratum id per row, -1 for rows outside every stratum.
+            budget (int): Target number of sampled rows.
+            min_rows (int): Minimum rows kept per stratum.
+            seed (int): Seed of the row selection.
+
+        Returns:
+            tuple: (sorted positions of the sampled rows, their weights)
+        """
+        group_ids = np.asarray(group_ids)
+        valid = np.flatnonzero(group_ids >= 0)
+        unstratified = np.flatnonzero(group_ids < 0)
+        budget = max(budget - len(unstratified), 0)
+        codes, uniques = pd.factorize(group_ids[valid])
+        sizes = np.bincount(codes, minlength=len(uniques))
+
+        def allocation(ratio: float) -> np.ndarray:
+            return np.minimum(sizes, np.maximum(min_rows, np.ceil(sizes * ratio))).astype(np.int64)
+
+        if allocation(0.0).sum() > budget:
+            # the minimums alone exceed the budget, fall back to proportional allocation
+            sample_sizes = np.maximum(1, np.floor(sizes * budget / sizes.sum())).astype(np.int64)
+        else:
+            low, high = 0.0, 1.0
+            for _ in range(50):
+                middle = (low + high) / 2
+                low, high = (middle, high) if allocation(middle).sum() <= budget else (low, middle)
+            sample_sizes = allocation(low)
+
+        # random order within every stratum, the first sample_size rows of each are kept
+        rng = np.random.default_rng(seed)
+        order = np.lexsort((rng.random(len(valid)), codes))
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        rank = np.arange(len(order)) - np.repeat(starts, sizes)
+        selected = order[rank < sample_sizes[codes[order]]]
+        selected.sort()
+
+        positions = np.concatenate((valid[selected], unstratified))
+        weights = np.concatenate(((sizes / sample_sizes)[codes[selected]], np.ones(len(unstratified))))
+        order = np.argsort(positions, kind='stable')
+        return positions[order], weights[order]
+
     @staticmethod
     def scale_columns(data: pd.DataFrame, columns: list, scaler) -> pd.DataFrame:
         """
@@ -193,7 +436,86 @@ class Analytical_Utils:
 
         
     @staticmethod
-    def detect_extreme_outlier_columns(df: pd.DataFrame, threshold: float = 0.01) -> list:
+    def group_quartiles(values: np.ndarray, codes: np.ndarray, n_groups: int) -> tuple:
+        """
+        Nan-aware first and third quartiles of every column within every group.
+
+        Each column is sorted once by (group, value), after which all group quartiles are read from the
+        sorted array with the same linear interpolation as np.quantile / pd.Series.quantile.
+
+        Args:
+            values (np.ndarray): (rows, columns) float block with NaN for missing values.
+            codes (np.ndarray): Group code of every row in [0, n_groups).
+            n_groups (int): Number of groups.
+
+        Returns:
+            tuple: (q1, q3) arrays of shape (n_groups, columns), NaN for groups without values.
+        """
+        sizes = np.bincount(codes, minlength=n_groups)
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        q1 = np.full((n_groups, values.shape[1]), np.nan)
+        q3 = np.full((n_groups, values.shape[1]), np.nan)
+
+        for j in range(values.shape[1]):
+            # NaNs are sorted to the end of their group
+            sorted_values = values[np.lexsort((values[:, j], codes)), j]
+            n = np.bincount(codes, weights=~np.isnan(values[:, j]), minlength=n_groups).astype(np.int64)
+
+            for q, out in ((0.25, q1), (0.75, q3)):
+                virtual_index = n * q + (1 - q) - 1
+                previous = np.floor(virtual_index)
+                gamma = virtual_index - previous
+                previous = previous.astype(np.int64)
+                following = np.minimum(previous + 1, n - 1)
+
+                a = sorted_values[np.clip(starts + previous, 0, len(sorted_values) - 1)]
+                b = sorted_values[np.clip(starts + following, 0, len(sorted_values) - 1)]
+                diff = b - a
+                result = np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+                out[:, j] = np.where(n > 0, result, np.nan)
+
+        return q1, q3
+
+    @staticmethod
+    def extreme_outlier_flags(values: np.ndarray, codes: np.ndarray = None, n_groups: int = 1,
+                              threshold: float = 0.01) -> np.ndarray:
+        """
+        Flags the (group, column) pairs whose share of values outside [Q1 - 3*IQR, Q3 + 3*IQR] exceeds the threshold.
+
+        Args:
+            values (np.ndarray): (rows, columns) float block with NaN for missing values.
+            codes (np.ndarray): Group code of every row in [0, n_groups). All rows form one group when not given.
+            n_groups (int): Number of groups.
+            threshold (float): Proportion threshold.
+
+        Returns:
+            np.ndarray: Boolean array of shape (n_groups, columns).
+        """
+        if codes is None:
+            import warnings
+
+            codes, n_groups = np.zeros(len(values), dtype=np.int64), 1
+            with warnings.catch_warnings():
+                # all-NaN columns give NaN quartiles and are not flagged
+                warnings.simplefilter('ignore', RuntimeWarning)
+                q1, q3 = np.nanquantile(values, [0.25, 0.75], axis=0)[:, None, :]
+        else:
+            q1, q3 = Analytical_Utils.group_quartiles(values, codes, n_groups)
+
+        iqr = q3 - q1
+        lower = (q1 - 3 * iqr)[codes]
+        upper = (q3 + 3 * iqr)[codes]
+        outside = (values < lower) | (values > upper)
+
+        outside_counts = np.stack([np.bincount(codes, weights=outside[:, j], minlength=n_groups)
+                                   for j in range(values.shape[1])], axis=1)
+        counts = np.stack([np.bincount(codes, weights=~np.isnan(values[:, j]), minlength=n_groups)
+                           for j in range(values.shape[1])], axis=1)
+
+        return (counts > 0) & (outside_counts / np.maximum(counts, 1) > threshold)
+
+    @staticmethod
+    def detect_extreme_outlier_columns(df: pd.DataFrame, threshold: float = 0.01, group_col=None):
         """
         Automatically detects numeric columns with a high proportion of extreme outliers.
         
@@ -202,34 +524,34 @@ class Analytical_Utils:
         - Upper bound: Q3 + 3 * IQR
         
         If the fraction of values outside these bounds is greater than the threshold,
-        the column is flagged.
+        the column is flagged. The quartiles of all numeric columns are computed in one call.
         
         Args:
             df (pd.DataFrame): Input DataFrame.
             threshold (float): Proportion threshold (e.g., 0.01 means 1% of values).
+            group_col: Optional column name (or array of keys) to detect the columns separately per group.
             
         Returns:
             List[str]: A list of column names that have extreme outliers.
+            When group_col is given, a dict of {group: list of column names}. Rows without a key are ignored.
         """
-        extreme_cols = []
-        numeric_cols = df.select_dtypes(include=[np.number]).columns
-        for col in numeric_cols:
-            series = df[col].dropna()
-            if series.empty:
-                continue
-            
-            Q1 = series.quantile(0.25)
-            Q3 = series.quantile(0.75)
-            IQR = Q3 - Q1
-            lower_bound = Q1 - 3 * IQR
-            upper_bound = Q3 + 3 * IQR
-            
-            # Identify extreme outliers
-            extreme_outliers = series[(series < lower_bound) | (series > upper_bound)]
-            ratio = len(extreme_outliers) / len(series)
-            
-            
-            if ratio > threshold:
-                extreme_cols.append(col)
-                
-        return extreme_cols
\ No newline at end of file
+        if isinstance(group_col, str):
+            keys = df[group_col]
+            numeric_cols = df.select_dtypes(include=[np.number]).columns.drop(group_col, errors='ignore')
+        else:
+            keys = group_col
+            numeric_cols = df.select_dtypes(include=[np.number]).columns
+
+        values = df[numeric_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+
+        if keys is None:
+            if values.size == 0:
+                return []
+            flags = Analytical_Utils.extreme_outlier_flags(values, threshold=threshold)
+            return [col for col, flag in zip(numeric_cols, flags[0]) if flag]
+
+        codes, uniques = pd.factorize(keys)
+        has_key = codes >= 0
+        flags = Analytical_Utils.extreme_outlier_flags(values[has_key], codes[has_key], len(uniques), threshold)
+
+        return {group: [col for col, flag in zip(numeric_cols, flags[i]) if flag] for i, group in enumerate(uniques)}
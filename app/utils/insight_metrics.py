@@ -0,0 +1,189 @@
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+# segmentation output columns read by the calculator, with the P code they are written to in ANALYTIC_CUSTOMER
+SEGMENT_COLUMNS = {
+    'ILK_ODEME_TARIH': 'P1',
+    'SON_ODEME_TARIH': 'P2',
+    'RECENCY': 'P3',
+    'FREQUENCY': 'P4',
+    'MONETARY': 'P5',
+    'RECENCY_SEGMENT': 'P6',
+    'CUSTOMER_LIFESPAN': 'P11',
+    'AVG_PURCHASE_VALUE': 'P12',
+    'CLV': 'P14',
+    'CLV_SEGMENT': 'P15'
+}
+
+# segment labels compared by overall-firm.sql
+CLV_LABELS = {
+    'vip': 'VIP Customer',
+    'loyal': 'Loyal Customer',
+    'one_time': 'One-time Buyer',
+    'potential_growth': 'Potential Growth Customer',
+    'churn_risk': 'at Risk'
+}
+RECENCY_LABELS = {
+    'new': 'New Customer',
+    'active': 'Active Customer',
+    'at_risk': 'Active - at risk'
+}
+
+
+def segments_key(schema_name: str) -> str:
+    """
+    ArtifactStore key of the segmentation output of a firm, shared by Segmentation_Runner and SmartInsight.
+    """
+    return f"data/{schema_name.split('_ELT')[0]}_segments.parquet"
+
+
+class OverallFirmMetrics:
+    """
+    Computes the row of db_queries/Insight/overall-firm.sql from the segmentation output of the same job. Both
+    count the segmented customers only (P15 IS NOT NULL), not the churn rows of ANALYTIC_CUSTOMER.
+
+    The segmentation output holds the typed values behind the P columns of ANALYTIC_CUSTOMER (SEGMENT_COLUMNS),
+    so the counts, shares and medians are vectorized over them instead of scanning ANALYTIC_CUSTOMER and
+    converting its string columns back with TO_NUMBER / TO_DATE. Oracle semantics are kept: PERCENTILE_CONT
+    medians ignore NULLs, ROUND rounds half away from zero and the last year is TO_DATE(P2) >= ADD_MONTHS(SYSDATE, -12).
+    """
+
+    def __init__(self, now: datetime = None) -> None:
+        """
+        Args:
+            now (datetime): Time used as SYSDATE. Defaults to now.
+        """
+        self.now = pd.Timestamp(now or datetime.now())
+
+    @staticmethod
+    def oracle_round(value: float, decimals: int) -> float:
+        """
+        Rounds half away from zero like Oracle ROUND, NULL stays NULL.
+        """
+        if value is None or pd.isna(value):
+            return np.nan
+        factor = 10.0 ** decimals
+        return float(np.sign(value) * np.floor(abs(value) * factor + 0.5) / factor)
+
+    @staticmethod
+    def _as_number(value):
+        """
+        Integral values as int and the rest as float, like NUMBER columns fetched with oracledb.
+        """
+        if value is None or pd.isna(value):
+            return np.nan
+        return int(value) if float(value).is_integer() else float(value)
+
+    @staticmethod
+    def _to_date(values: pd.Series) -> pd.Series:
+        """
+        TO_DATE(value, 'YYYYMMDD') of YYYYMMDD strings or numbers, datetimes are kept.
+        """
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(values.cat.categories.dtype)
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values.dt.normalize()
+        if pd.api.types.is_numeric_dtype(values):
+            values = values.astype('Int64').astype('string')
+        return pd.to_datetime(values, format='%Y%m%d', errors='coerce')
+
+    def last_year(self, segments: pd.DataFrame) -> np.ndarray:
+        """
+        Mask of the customers in the LAST_ONE_YEAR subquery, TO_DATE(P2) >= ADD_MONTHS(SYSDATE, -12).
+        """
+        return (self._to_date(segments['SON_ODEME_TARIH']) >= self.now - pd.DateOffset(months=12)).to_numpy()
+
+    def _pct(self, count: int, total: int, decimals: int = 1) -> float:
+        return self.oracle_round(count * 100.0 / total, decimals) if total else np.nan
+
+    def compute(self, segments: pd.DataFrame, firm_id: int) -> pd.DataFrame:
+        """
+        Args:
+            segments (pd.DataFrame): Segmentation output with the SEGMENT_COLUMNS columns.
+            firm_id (int): Firm of the segmentation output.
+
+        Returns:
+            pd.DataFrame: One row with the columns of overall-firm.sql, empty when there are no customers.
+        """
+        if segments.empty:
+            return pd.DataFrame()
+
+        clv_segment = segments['CLV_SEGMENT'].to_numpy(dtype=object)
+        recency_segment = segments['RECENCY_SEGMENT'].to_numpy(dtype=object)
+        earliest = self._to_date(segments['ILK_ODEME_TARIH']).min()
+
+        total = len(segments)
+        total_counts = {name: int((clv_segment == label).sum()) for name, label in CLV_LABELS.items()}
+
+        # LAST_ONE_YEAR subquery
+        last_year = self.last_year(segments)
+        count = int(last_year.sum())
+        medians = {
+            name: segments.loc[last_year, column].astype(float).median() if count else np.nan
+            for name, column in [('median_recency', 'RECENCY'), ('median_frequency', 'FREQUENCY'),
+                                 ('median_monetary_value', 'MONETARY'), ('median_customer_lifespan_value', 'CUSTOMER_LIFESPAN'),
+                                 ('median_avg_purchase_value', 'AVG_PURCHASE_VALUE'), ('median_clv_value', 'CLV')]
+        }
+        clv_counts = {name: int((clv_segment[last_year] == label).sum()) for name, label in CLV_LABELS.items()}
+        recency_counts = {name: int((recency_segment[last_year] == label).sum()) for name, label in RECENCY_LABELS.items()}
+
+        # without customers in the last year the LEFT JOIN leaves the subquery columns NULL
+        def last_year_value(value):
+            return value if count else np.nan
+
+        row = {
+            'FIRM_ID': firm_id,
+            'EARLIEST_TRN_YEAR': earliest.year if pd.notna(earliest) else np.nan,
+            'EARLIEST_TRN_MONTH': earliest.month if pd.notna(earliest) else np.nan,
+            'TOTAL_CUSTOMERS': total,
+            'TOTAL_VIP_CUSTOMER_COUNT': total_counts['vip'],
+            'TOTAL_VIP_CUSTOMER_PCT': self._pct(total_counts['vip'], total),
+            'TOTAL_LOYAL_CUSTOMER_COUNT': total_counts['loyal'],
+            'TOTAL_LOYAL_CUSTOMER_PCT': self._pct(total_counts['loyal'], total),
+            'TOTAL_ONE_TIME_CUSTOMER_COUNT': total_counts['one_time'],
+            'TOTAL_ONE_TIME_CUSTOMER_PCT': self._pct(total_counts['one_time'], total),
+            'TOTAL_CHURN_RISK_CUSTOMER_COUNT': last_year_value(clv_counts['churn_risk']),
+            'TOTAL_CHURNED_CUSTOMER_COUNT': last_year_value(total_counts['churn_risk'] - clv_counts['churn_risk']),
+            'LAST_YEAR_CUSTOMER_COUNT': last_year_value(count),
+            'MEDIAN_RECENCY': medians['median_recency'],
+            'MEDIAN_FREQUENCY': medians['median_frequency'],
+            'MEDIAN_MONETARY_VALUE': medians['median_monetary_value'],
+            'MEDIAN_CUSTOMER_LIFESPAN_VALUE': medians['median_customer_lifespan_value'],
+            'MEDIAN_AVG_PURCHASE_VALUE': medians['median_avg_purchase_value'],
+            'MEDIAN_CLV_VALUE': medians['median_clv_value'],
+            'NEW_CUSTOMER_COUNT': last_year_value(recency_counts['new']),
+            'NEW_CUSTOMER_PCT': last_year_value(self._pct(recency_counts['new'], count)),
+            'ACTIVE_CUSTOMER_COUNT': last_year_value(recency_counts['active']),
+            'ACTIVE_CUSTOMER_PCT': last_year_value(self._pct(recency_counts['active'], count)),
+            'ONE_TIME_CUSTOMER_COUNT': last_year_value(clv_counts['one_time']),
+            'ONE_TIME_CUSTOMER_PCT': last_year_value(self._pct(clv_counts['one_time'], count)),
+            'VIP_CUSTOMER_COUNT': last_year_value(clv_counts['vip']),
+            'VIP_CUSTOMER_PCT': last_year_value(self._pct(clv_counts['vip'], count)),
+            'LOYAL_CUSTOMER_COUNT': last_year_value(clv_counts['loyal']),
+            'LOYAL_CUSTOMER_PCT': last_year_value(self._pct(clv_counts['loyal'], count)),
+            'POTENTIAL_GROWTH_CUSTOMER_COUNT': last_year_value(clv_counts['potential_growth']),
+            'POTENTIAL_GROWTH_CUSTOMER_PCT': last_year_value(self._pct(clv_counts['potential_growth'], count)),
+            'AT_RISK_CUSTOMER_COUNT': last_year_value(recency_counts['at_risk']),
+            'AT_RISK_CUSTOMER_PCT': last_year_value(self._pct(recency_counts['at_risk'], count)),
+            'CHURN_RISK_CUSTOMER_COUNT': last_year_value(clv_counts['churn_risk']),
+            'CHURN_RISK_CUSTOMER_PCT': last_year_value(self._pct(clv_counts['churn_risk'], count)),
+        }
+
+        active = recency_counts['active'] if count else np.nan
+        row['ONE_TIME_TO_ACTIVE_CONVERSION_RATE'] = (self._pct(active - clv_counts['one_time'], active, 2)
+                                                     if count else np.nan)
+        row['RETENTION_RATIO'] = self._pct(active, count, 2) if count else np.nan
+        row['NEW_CUSTOMER_CONTRIBUTION_PCT'] = self._pct(recency_counts['new'], active, 2) if count else np.nan
+        row['LOST_REVENUE_FROM_CHURN_RISK'] = self.oracle_round(
+            row['CHURN_RISK_CUSTOMER_COUNT'] * medians['median_avg_purchase_value'], 2)
+        row['PROJECTED_REVENUE_FROM_ACTIVE_CUSTOMERS'] = self.oracle_round(active * medians['median_avg_purchase_value'], 2)
+
+        return pd.DataFrame([{name: self._as_number(value) if name != 'FIRM_ID' else value for name, value in row.items()}])
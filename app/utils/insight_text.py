@@ -0,0 +1,190 @@
+import hashlib
+import os
+import string
+import sys
+
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+from app.utils.general_utils import GeneralUtils
+
+
+class InsightTemplate:
+    """
+    Insight text template rendered for all rows of a DataFrame in one pass.
+
+    Blocks are str.format templates over the columns of the DataFrame, or (condition, if_true, if_false)
+    tuples where condition maps the DataFrame to a boolean mask and the branches are templates (or '').
+    Templates are parsed once. Each field is formatted once per distinct value of its column, and the
+    texts are concatenated column-wise, so the cost does not grow with Python work per row.
+
+    Besides the format spec, a field can carry one of the conversions:
+        !e  Turkish suffix of the value (GeneralUtils.tr_ek), e.g. '{VIP_CUSTOMER_PCT}{VIP_CUSTOMER_PCT!e}'
+        !m  Turkish month name of the value (GeneralUtils.int_to_month)
+        !i  int(round(value, 0))
+        !r  round(value, 0)
+
+    Usage:
+        template = InsightTemplate("{segment_name} segmentinde toplam {customer_count:,} müşteri bulunmakta.")
+        texts = template.render(metrics)
+    """
+
+    CONVERSIONS = {
+        'e': GeneralUtils.tr_ek,
+        'm': GeneralUtils.int_to_month,
+        'i': lambda value: int(round(value, 0)),
+        'r': lambda value: round(value, 0),
+    }
+
+    def __init__(self, *blocks) -> None:
+        self.blocks = [
+            (block[0], self._compile(block[1]), self._compile(block[2])) if isinstance(block, tuple) else self._compile(block)
+            for block in blocks
+        ]
+        # texts of the blocks, so cached renderings can tell a changed template apart
+        texts = [text for block in blocks for text in (block[1:] if isinstance(block, tuple) else (block,))]
+        self.signature = hashlib.sha256("\x1f".join(texts).encode("UTF-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _compile(template: str) -> list:
+        return list(string.Formatter().parse(template))
+
+    def _format_field(self, values: pd.Series, conversion: str, spec: str) -> np.ndarray:
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        convert = self.CONVERSIONS[conversion] if conversion else None
+        formatted = np.array([format(convert(value) if convert else value, spec) for value in uniques], dtype=object)
+        return formatted[codes]
+
+    def _render_parts(self, parts: list, data: pd.DataFrame) -> np.ndarray:
+        text = np.full(len(data), '', dtype=object)
+        for literal, field, spec, conversion in parts:
+            if literal:
+                text = text + literal
+            if field is not None:
+                text = text + self._format_field(data[field], conversion, spec)
+        return text
+
+    def render(self, data: pd.DataFrame) -> pd.Series:
+        """
+        Renders the template for every row of data.
+
+        Args:
+            data (pd.DataFrame): One row per firm, segment or period with the template fields as columns.
+
+        Returns:
+            pd.Series: Texts indexed like data.
+        """
+        text = np.full(len(data), '', dtype=object)
+        for block in self.blocks:
+            if isinstance(block, list):
+                text = text + self._render_parts(block, data)
+                continue
+
+            condition, if_true, if_false = block
+            mask = np.asarray(condition(data), dtype=bool)
+            branch = np.full(len(data), '', dtype=object)
+            if mask.any():
+                branch[mask] = self._render_parts(if_true, data[mask])
+            if (~mask).any():
+                branch[~mask] = self._render_parts(if_false, data[~mask])
+            text = text + branch
+
+        return pd.Series(text, index=data.index, dtype=object)
+
+
+# overall firm insight of SmartInsight, over the columns of SmartInsight.derive_metrics and FIRM_NAME
+OVERALL_INSIGHT = InsightTemplate(
+    # Introduction: Firm History and Customer Base
+    "Veritabanında yer alan {FIRM_NAME} verilerine göre, {EARLIEST_TRN_YEAR} yılının {EARLIEST_TRN_MONTH!m} ayından itibaren {TOTAL_CUSTOMERS:,} müşteri {FIRM_NAME} markasından alışveriş yaptı. "
+    "Son 12 aylık döneme bakıldığında ise toplamda {LAST_YEAR_CUSTOMER_COUNT:,} müşterinin alışveriş yapmış ve bu müşterilerin %{ACTIVE_CUSTOMER_PCT}{ACTIVE_CUSTOMER_PCT!e} son üç aylık dönemde aktif olarak alışveriş yapmaya devam etmiştir. "
+    "RFM ve CLV analizleri sonucunda aktif müşterilerden beklenen bir yıllık toplam potansiyel gelir {PROJECTED_REVENUE_FROM_ACTIVE_CUSTOMERS!i:,} TL olarak tahminlenmiştir. "
+    "Aktif müşterilerin yaklaşık %{RETENTION_RATIO}{RETENTION_RATIO!e} son 12 aylık müşteri tabanından gelmektedir.",
+
+    # Conditional Insights: Retention and Churn Risks
+    (lambda data: data['RETENTION_RATIO'] > 80,
+     "Bu oran, müşteri sadakat stratejilerinizin oldukça güçlü olduğunu göstermektedir. "
+     "Sadık müşterilerinizle ilişkilerinizi geliştirmek için özel kampanyalar düzenleyebilirsiniz.\n\n",
+     ""),
+    (lambda data: data['RETENTION_RATIO'] < 50,
+     "Bu oran, müşteri sadakat stratejilerinizin güçlendirilmesi gerektiğine işaret ediyor. "
+     "Müşteri bağlılığını artırmak için düzenli iletişim ve ödül programları önerilebilir.\n\n",
+     ""),
+
+    # RFM Metrics: Recency, Frequency, Monetary
+    "Müşteri davranışlarını analiz etmek için kullanılan RFM (Recency-Frequency-Monetary) modelinin sonuçlarına göre, "
+    "bir müşterinin ortalama son alışveriş süresi {MEDIAN_RECENCY} gün, ortalama alışveriş sıklığı {MEDIAN_FREQUENCY} "
+    "ve işlem başına ortalama harcama tutarı {MEDIAN_MONETARY_VALUE!i:,} TL olarak ölçüldü. "
+
+    # Segment Definitions and Insights
+    "CLV ve RFM modellerinin sonuçları göz önüne alınarak {FIRM_NAME} markasının müşteri portföyü 6 farklı segmente ayrıldı:\n\n"
+    "**VIP Müşteriler**: İşlem başına harcama tutarları veya yaşam boyu değerleri (CLV) en üst %20'lik dilimde olan müşterilerdir. "
+    "Son bir yılda alışveriş yapmış müşterilerin %{VIP_CUSTOMER_PCT}{VIP_CUSTOMER_PCT!e} VIP segmentindedir. ",
+    (lambda data: data['VIP_CUSTOMER_PCT'] < 10,
+     "VIP müşteri oranı düşük görünüyor. Bu segmenti genişletmek için özel fırsatlar ve kampanyalar oluşturulabilir.\n\n",
+     "VIP müşteri oranı oldukça yüksek ve bu grup markaya en büyük gelir katkısını sağlıyor.\n\n"),
+
+    "**Sadık Müşteriler**: Düzenli alışveriş yapan ve alışveriş sıklığı üst %30’luk dilimde yer alan müşterilerden oluşuyor. "
+    "Toplam müşterilerinizin %{LOYAL_CUSTOMER_PCT}{LOYAL_CUSTOMER_PCT!e} sadık müşteri segmentinde yer alıyor.\n\n"
+
+    # One-Time Customers Insights
+    "**Tek Seferlik Müşteriler**: {FIRM_NAME} markasından bir kez alışveriş yapmış müşterilerdir. "
+    "Son bir yılda alışveriş yapan müşterilerin %{ONE_TIME_CUSTOMER_PCT}{ONE_TIME_CUSTOMER_PCT!e} ikinci kez alışveriş yapmamıştır. ",
+    (lambda data: data['ONE_TIME_TO_ACTIVE_CONVERSION_RATE'] > 50,
+     "Tek seferlik müşterilerinizin düzenli müşterilere dönüşme oranı %{ONE_TIME_TO_ACTIVE_CONVERSION_RATE} ile oldukça yüksek. "
+     "Tek seferlik müşteriler, iyi bir dönüşüm oranı ile sadakat segmentine taşınabilir."
+     "Bu trendi sürdürmek için yeni müşterilere kişiselleştirilmiş kampanyalar düzenleyebilirsiniz.\n\n",
+     "Tek seferlik müşterilerin düzenli müşterilere dönüşme oranı %{ONE_TIME_TO_ACTIVE_CONVERSION_RATE} seviyesindedir. "
+     "Tek seferlik müşteriler, iyi bir dönüşüm oranı ile sadakat segmentine taşınabilir."
+     "Daha fazla dönüşüm için hoş geldiniz indirimleri ve müşteri ödül programları düzenleyebilirsiniz.\n\n"),
+
+    # Churn Risk Insights
+    "**Kayıp Riski Taşıyan Müşteriler**: Son dönemlerde alışveriş yapmamış ve harcama düzeyleri düşük olan müşterilerden oluşuyor. "
+    "Son 12 ayda alışveriş yapan müşterilerinizin %{TOTAL_CHURN_RISK_CUSTOMER_PCT}{TOTAL_CHURN_RISK_CUSTOMER_PCT!e} bu segmentte yer alıyor. "
+    "Kayıp riski taşıyan müşterilere odaklanarak tahmini {LOST_REVENUE_FROM_CHURN_RISK!i:,} TL'lik gelir kaybının önüne geçebilirsiniz."
+    "\n\n"
+
+    # Churned Customers
+    "**Kayıp Müşteriler**: Son 12 aydan uzun süredir alışveriş yapmamış müşterilerden oluşuyor. "
+    "Toplam {CHURNED_CUSTOMER_COUNT:,} müşteri (%{ACTUAL_CHURN_RATE}) bu segmentte yer alıyor. "
+    "Kayıp müşterilerin geri kazanımı için özel iletişim stratejileri geliştirebilirsiniz.\n\n"
+
+    # Potential Growth Customers
+    "**Potansiyel Büyüme Müşterileri**: Harcamalarını artırma potansiyeline sahip müşterilerden oluşur. "
+    "Son 12 ayda alışveriş yapmış müşterilerinizin %{POTENTIAL_GROWTH_CUSTOMER_PCT}{POTENTIAL_GROWTH_CUSTOMER_PCT!e} bu segmentte yer alıyor. ",
+    (lambda data: data['POTENTIAL_GROWTH_CUSTOMER_PCT'] > data['TOTAL_CHURN_RISK_CUSTOMER_PCT'],
+     "Potansiyel büyüme müşterilerinin oranı kayıp riski taşıyan müşterilerden daha yüksek. Bu da {FIRM_NAME} için büyüme fırsatları sunuyor. "
+     "Bu müşterilere yönelik hedefli kampanyalar ile bu segmentten elde edilen geliri arttırabilirsiniz.",
+     "Potansiyel büyüme müşterilerinin oranı kayıp riski taşıyan müşterilere kıyasla düşüktür. "
+     "Kayıp riski taşıyan müşterileri bu segmente taşımak için özel teklifler sunabilirsiniz."),
+)
+
+# one sentence per segment of SmartInsight.generate_segment_insight
+SEGMENT_INSIGHT = InsightTemplate(
+    "{segment_name} segmentinde toplam {customer_count:,} müşteri bulunmakta olup, "
+    "ortalama harcama tutarı {avg_monetary!r:,} TL ve alışveriş sıklığı {avg_frequency:.2f} olarak belirlenmiştir."
+)
+
+# period-over-period paragraph of SmartInsight.generate_trend_insight, over the current metrics and their
+# *_PREVIOUS, *_CHANGE and *_CHANGE_PCT columns from the metric history
+TREND_INSIGHT = InsightTemplate(
+    "\n\n**Dönemsel Değişim**: {PREVIOUS_SNAPSHOT_DATE} tarihli görünüme göre toplam müşteri sayısı "
+    "{TOTAL_CUSTOMERS_PREVIOUS!i:,} seviyesinden {TOTAL_CUSTOMERS:,} seviyesine ",
+    (lambda data: data['TOTAL_CUSTOMERS_CHANGE'] >= 0,
+     "%{TOTAL_CUSTOMERS_CHANGE_PCT} artmıştır. ",
+     "%{TOTAL_CUSTOMERS_CHANGE_PCT} azalmıştır. "),
+    "Son 12 ayda alışveriş yapan müşteri sayısı {LAST_YEAR_CUSTOMER_COUNT_PREVIOUS!i:,} seviyesinden {LAST_YEAR_CUSTOMER_COUNT:,} seviyesine ",
+    (lambda data: data['LAST_YEAR_CUSTOMER_COUNT_CHANGE'] >= 0,
+     "yükselmiş, ",
+     "gerilemiş, "),
+    "aktif müşteri oranı %{RETENTION_RATIO_PREVIOUS} seviyesinden %{RETENTION_RATIO} seviyesine ",
+    (lambda data: data['RETENTION_RATIO_CHANGE'] >= 0,
+     "çıkmıştır. ",
+     "düşmüştür. "),
+    (lambda data: data['VIP_CUSTOMER_PCT_CHANGE'] >= 0,
+     "VIP müşteri oranı %{VIP_CUSTOMER_PCT_PREVIOUS} seviyesinden %{VIP_CUSTOMER_PCT} seviyesine yükselmiştir.",
+     "VIP müşteri oranı %{VIP_CUSTOMER_PCT_PREVIOUS} seviyesinden %{VIP_CUSTOMER_PCT} seviyesine gerilemiştir."),
+)
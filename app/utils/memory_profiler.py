@@ -0,0 +1,363 @@
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+from app.utils.metrics import STAGE_PEAK_RSS, tenant
+
+MB = 2 ** 20
+# the traced heap is grouped again at most every this many bytes of growth while a stage is open
+SNAPSHOT_MIN_GROWTH = 8 * MB
+
+
+class RSSSampler:
+    """
+    Samples the resident set size of the process every `interval` seconds in a thread and keeps the peak.
+    Outside Linux the RSS falls back to ru_maxrss, the peak of the whole process so far.
+
+    Usage:
+        with RSSSampler() as sampler:
+            run()
+        print(sampler.peak)
+    """
+
+    def __init__(self, interval: float = 0.02, callback=None) -> None:
+        """
+        Args:
+            interval (float): Seconds between two samples.
+            callback: Called with every sample in the sampler thread.
+        """
+        self.interval = interval
+        self.callback = callback
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def rss(self) -> int:
+        try:
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1]) * self.page_size
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def sample(self) -> int:
+        rss = self.rss()
+        self.peak = max(self.peak, rss)
+        if self.callback is not None:
+            self.callback(rss)
+        return rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.peak = 0
+        self.sample()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+class MemoryProfiler:
+    """
+    Opt-in memory profile of the pipeline stages of a firm (Config.memory_profiling).
+
+    While a profiler is active, every `memory_stage(name)` block records the RSS before, after and at its peak
+    (sampled in a thread every memory_profile_interval_ms), and with memory_profile_tracemalloc the Python heap
+    traced by tracemalloc (numpy and pandas buffers included). The traced heap is grouped by allocating code
+    location when a stage starts and again by the sampler whenever it reaches a new peak, so the grouping
+    closest to the peak of a stage is compared with the one of its start and the memory_profile_top code
+    locations that allocated the most are reported. Stages nest: a stage opened inside another is recorded as
+    "outer/inner".
+
+    On exit the report is written to {log_path}/memory/{schema_name}/{run}.json and compared with the previous
+    report of the firm: stages whose RSS growth exceeds the previous one by memory_regression_pct percent
+    (and by at least memory_regression_min_mb) are flagged as regressions and logged.
+
+    Memory of worker processes (segmentation partitions) is not included.
+
+    Usage:
+        with MemoryProfiler(firm_id, schema_name):
+            with memory_stage("segmentation"):
+                runner.run()
+    """
+
+    _active = None
+
+    def __init__(self, firm_id: int, schema_name: str, enabled: bool = None, report_dir: str = None) -> None:
+        from app.config import Config
+
+        self.config = Config()
+        self.firm_id = firm_id
+        self.schema_name = schema_name
+        self.enabled = self.config.memory_profiling if enabled is None else enabled
+        self.report_dir = report_dir or os.path.join(self.config.log_path, "memory", schema_name)
+        self.trace = self.config.memory_profile_tracemalloc
+        self.top = self.config.memory_profile_top
+
+        self.stages = []
+        self.report = None
+        self._stack = []
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._started_tracing = False
+        self._last_snapshot_size = 0
+
+    @classmethod
+    def active(cls):
+        return cls._active
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start(self.config.memory_profile_frames)
+            self._started_tracing = True
+
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self._sampler = RSSSampler(self.config.memory_profile_interval_ms / 1000, callback=self._on_sample)
+        self._sampler.__enter__()
+        self.rss_start = self._sampler.peak
+        MemoryProfiler._active = self
+        return self
+
+    def __exit__(self, *exc):
+        if not self.enabled:
+            return
+
+        MemoryProfiler._active = None
+        self._sampler.__exit__(*exc)
+        if self._started_tracing:
+            tracemalloc.stop()
+
+        try:
+            self.write_report()
+        except Exception as e:
+            logging.error(f"Memory report of {self.schema_name} could not be written: {e}")
+
+    def _allocations(self) -> dict:
+        """
+        Traced heap grouped by allocating code location: {(location, allocated_in): [bytes, blocks]}, where
+        location is the innermost frame of the repository (pandas, numpy and pyarrow buffers are attributed to
+        the repository line that called them) and allocated_in the line that made the allocation.
+        """
+        snapshot = tracemalloc.take_snapshot()
+        self._last_snapshot_size = tracemalloc.get_traced_memory()[0]
+
+        # statistics("traceback") only groups the traces by their frames, grouping them by file or line through
+        # Snapshot.statistics or compare_to takes minutes on the hundreds of thousands of traces of a loaded
+        # pandas process
+        allocations = {}
+        for statistic in snapshot.statistics("traceback"):
+            # Traceback frames run from the oldest to the allocating one
+            traceback = statistic.traceback
+            allocated_in = traceback[-1]
+            caller = next((frame for frame in reversed(traceback) if frame.filename.startswith(root_dir)), allocated_in)
+            # the groupings of the profiler itself are not attributed
+            if caller.filename == __file__:
+                continue
+            key = (_frame_location(caller), _frame_location(allocated_in))
+            entry = allocations.get(key)
+            if entry is None:
+                allocations[key] = [statistic.size, statistic.count]
+            else:
+                entry[0] += statistic.size
+                entry[1] += statistic.count
+        return allocations
+
+    def _on_sample(self, rss: int) -> None:
+        """
+        Runs in the sampler thread: updates the peaks of the open stages and, when the traced heap reached a new
+        peak SNAPSHOT_MIN_GROWTH (or a tenth of the growth of the outermost stage) above the last grouping,
+        groups it again so the peak allocations of the open stages can be attributed.
+        """
+        with self._lock:
+            stack = list(self._stack)
+        if not stack:
+            return
+
+        traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        for state in stack:
+            state['rss_peak'] = max(state['rss_peak'], rss)
+
+        min_growth = max(SNAPSHOT_MIN_GROWTH, 0.1 * (traced - stack[0]['traced_before']))
+        if traced > stack[-1]['traced_peak'] and traced - self._last_snapshot_size >= min_growth:
+            allocations = self._allocations()
+            for state in stack:
+                if traced > state['traced_peak']:
+                    state['traced_peak'] = traced
+                    state['peak_allocations'] = allocations
+        else:
+            for state in stack:
+                state['traced_peak'] = max(state['traced_peak'], traced)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Records the memory of the block as the stage `name`, nested in the open stages.
+        """
+        tracing = tracemalloc.is_tracing()
+        rss = self._sampler.rss()
+        traced = tracemalloc.get_traced_memory()[0] if tracing else 0
+        state = {
+            'name': "/".join([open_state['name'] for open_state in self._stack][-1:] + [name]),
+            'start': time.perf_counter(),
+            'rss_before': rss,
+            'rss_peak': rss,
+            'traced_before': traced,
+            'traced_peak': traced,
+            'start_allocations': self._allocations() if tracing else None,
+            'peak_allocations': None,
+        }
+        with self._lock:
+            self._stack.append(state)
+
+        try:
+            yield state
+        finally:
+            self._on_sample(self._sampler.sample())
+            if tracing and state['peak_allocations'] is None:
+                # the peak was too short or too small to be grouped by the sampler, attribute what the stage kept
+                state['peak_allocations'] = self._allocations()
+            with self._lock:
+                self._stack.remove(state)
+            self.stages.append(self._stage_record(state, tracing))
+
+    def _stage_record(self, state: dict, tracing: bool) -> dict:
+        rss_after = self._sampler.rss()
+        record = {
+            'stage': state['name'],
+            'seconds': round(time.perf_counter() - state['start'], 3),
+            'rss_before_mb': round(state['rss_before'] / MB, 1),
+            'rss_after_mb': round(rss_after / MB, 1),
+            'rss_peak_mb': round(state['rss_peak'] / MB, 1),
+            'rss_growth_mb': round((state['rss_peak'] - state['rss_before']) / MB, 1),
+        }
+        STAGE_PEAK_RSS.set(state['rss_peak'], firm=tenant(self.schema_name), stage=state['name'])
+        if tracing:
+            traced_after = tracemalloc.get_traced_memory()[0]
+            record['traced_peak_growth_mb'] = round((state['traced_peak'] - state['traced_before']) / MB, 1)
+            record['traced_retained_mb'] = round((traced_after - state['traced_before']) / MB, 1)
+            record['top_allocations'] = self.attribute(state['start_allocations'], state['peak_allocations'])
+        return record
+
+    def attribute(self, start_allocations: dict, peak_allocations: dict) -> list:
+        """
+        Code locations of the repository that allocated the most between the start of a stage and its peak,
+        with the library line that allocated the most of it.
+        """
+        if start_allocations is None or peak_allocations is None:
+            return []
+
+        locations = {}
+        for key, (size, blocks) in peak_allocations.items():
+            start_size, start_blocks = start_allocations.get(key, (0, 0))
+            if size <= start_size:
+                continue
+            location, allocated_in = key
+            entry = locations.setdefault(location, {'location': location, 'size_mb': 0, 'blocks': 0, 'allocated_in': {}})
+            entry['size_mb'] += size - start_size
+            entry['blocks'] += blocks - start_blocks
+            entry['allocated_in'][allocated_in] = size - start_size
+
+        allocations = sorted(locations.values(), key=lambda entry: entry['size_mb'], reverse=True)[:self.top]
+        for entry in allocations:
+            entry['allocated_in'] = max(entry['allocated_in'], key=entry['allocated_in'].get)
+            entry['size_mb'] = round(entry['size_mb'] / MB, 2)
+        return allocations
+
+    def _previous_report(self) -> dict:
+        path = os.path.join(self.report_dir, "latest.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="UTF-8") as f:
+            return json.load(f)
+
+    def regressions(self, previous: dict) -> list:
+        """
+        Stages whose RSS growth exceeds the one of the previous report by the configured threshold.
+        """
+        if previous is None:
+            return []
+
+        previous_stages = {stage['stage']: stage for stage in previous.get('stages', [])}
+        flagged = []
+        for stage in self.stages:
+            reference = previous_stages.get(stage['stage'])
+            if reference is None:
+                continue
+            growth, reference_growth = stage['rss_growth_mb'], max(reference['rss_growth_mb'], 0)
+            if (growth > reference_growth * (1 + self.config.memory_regression_pct / 100)
+                    and growth - reference_growth >= self.config.memory_regression_min_mb):
+                flagged.append({'stage': stage['stage'], 'rss_growth_mb': growth, 'previous_rss_growth_mb': reference_growth,
+                                'previous_run': previous.get('started_at')})
+        return flagged
+
+    def write_report(self) -> dict:
+        previous = self._previous_report()
+        self.report = {
+            'firm_id': self.firm_id,
+            'schema_name': self.schema_name,
+            'started_at': self.started_at.isoformat(timespec="seconds"),
+            'seconds': round(time.perf_counter() - self._start, 3),
+            'rss_start_mb': round(self.rss_start / MB, 1),
+            'rss_peak_mb': round(self._sampler.peak / MB, 1),
+            'tracemalloc': self.trace,
+            'stages': self.stages,
+            'regressions': self.regressions(previous),
+        }
+
+        for regression in self.report['regressions']:
+            logging.warning(f"MEMORY REGRESSION {self.schema_name} {regression['stage']}: RSS grew "
+                            f"{regression['rss_growth_mb']} MB, {regression['previous_rss_growth_mb']} MB on {regression['previous_run']}")
+
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f"{self.started_at:%Y%m%d_%H%M%S}.json")
+        for target in (path, os.path.join(self.report_dir, "latest.json")):
+            tmp_path = f"{target}.tmp"
+            with open(tmp_path, "w", encoding="UTF-8") as f:
+                json.dump(self.report, f, indent=2)
+            os.replace(tmp_path, target)
+
+        logging.info(f"Memory report of {self.schema_name} written to {path}, peak RSS {self.report['rss_peak_mb']} MB.")
+        return self.report
+
+
+def _frame_location(frame: tracemalloc.Frame) -> str:
+    """
+    file:line of a traceback frame, relative to the repository or to site-packages.
+    """
+    filename, lineno = frame.filename, frame.lineno
+    if filename.startswith(root_dir):
+        filename = os.path.relpath(filename, root_dir)
+    elif "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[-1]
+    return f"{filename}:{lineno}"
+
+
+def memory_stage(name: str):
+    """
+    Stage of the active MemoryProfiler, a no-op when profiling is off.
+    """
+    profiler = MemoryProfiler.active()
+    return profiler.stage(name) if profiler is not None else nullcontext()
@@ -0,0 +1,140 @@
+import logging
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+from app.config import Config
+
+# metric values are stored as int64 fixed-point with this many decimals, enough for the rounded KPIs of Smart Insight
+VALUE_DECIMALS = 4
+VALUE_SCALE = 10 ** VALUE_DECIMALS
+
+SCHEMA = pa.schema([
+    ('METRIC', pa.string()),
+    ('SNAPSHOT_DATE', pa.date32()),
+    ('VALUE', pa.int64())
+])
+
+
+class MetricHistory:
+    """
+    Local time series of the firm-level metrics of Smart Insight, one snapshot per day.
+
+    Snapshots are kept in long format (METRIC, SNAPSHOT_DATE, VALUE) in one Parquet file per month under
+    {metric_history_dir}/{schema_name}/YYYYMM.parquet. Rows are sorted by metric and date, the metric names are
+    dictionary encoded and the dates and fixed-point values are DELTA_BINARY_PACKED, so a year of daily snapshots
+    of a firm takes a few kilobytes. Looking up a day reads only the file of its month, so previous-period values
+    are found without scanning the history or querying the database.
+
+    Usage:
+        history = MetricHistory("FIRM_CDP")
+        history.record({"TOTAL_CUSTOMERS": 1200, "RETENTION_RATIO": 41.5})
+        previous_date, previous = history.previous(months=1)
+    """
+
+    def __init__(self, schema_name: str, history_dir: str = None) -> None:
+        self.schema_name = schema_name
+        self.config = Config()
+        self.history_dir = history_dir or os.path.join(self.config.metric_history_dir, schema_name)
+        self._months = {}
+
+    def _month_path(self, month: str) -> str:
+        return os.path.join(self.history_dir, f"{month}.parquet")
+
+    def _load_month(self, month: str) -> dict:
+        """
+        Snapshots of a month as {date: {metric: value}}, read once per instance.
+        """
+        if month in self._months:
+            return self._months[month]
+
+        snapshots = {}
+        path = self._month_path(month)
+        if os.path.exists(path):
+            table = pq.read_table(path).to_pandas(date_as_object=False)
+            table['VALUE'] = table['VALUE'] / VALUE_SCALE
+            for snapshot_date, day in table.groupby('SNAPSHOT_DATE', sort=True):
+                snapshots[pd.Timestamp(snapshot_date).normalize()] = dict(zip(day['METRIC'], day['VALUE']))
+
+        self._months[month] = snapshots
+        return snapshots
+
+    def _write_month(self, month: str, snapshots: dict) -> None:
+        rows = [(metric, snapshot_date, value) for snapshot_date, values in snapshots.items() for metric, value in values.items()]
+        data = pd.DataFrame(rows, columns=['METRIC', 'SNAPSHOT_DATE', 'VALUE']).sort_values(['METRIC', 'SNAPSHOT_DATE'])
+        data['VALUE'] = np.round(data['VALUE'].to_numpy(dtype=float) * VALUE_SCALE).astype(np.int64)
+
+        table = pa.Table.from_pandas(data, schema=SCHEMA, preserve_index=False)
+        os.makedirs(self.history_dir, exist_ok=True)
+        path = self._month_path(month)
+        tmp_path = f"{path}.tmp"
+        pq.write_table(table, tmp_path, compression='zstd', use_dictionary=['METRIC'],
+                       column_encoding={'SNAPSHOT_DATE': 'DELTA_BINARY_PACKED', 'VALUE': 'DELTA_BINARY_PACKED'})
+        os.replace(tmp_path, path)
+
+    def record(self, metrics: dict, snapshot_date: datetime = None) -> int:
+        """
+        Stores the snapshot of a day, replacing an earlier one of the same day.
+
+        Args:
+            metrics (dict): Metric name to value, e.g. a row of SmartInsight.derive_metrics. Values that are
+                not finite numbers (texts, NULLs) are skipped.
+            snapshot_date (datetime): Day of the snapshot. Defaults to today.
+
+        Returns:
+            int: Number of metrics stored.
+        """
+        snapshot_date = pd.Timestamp(snapshot_date or datetime.now()).normalize()
+        values = {}
+        for name, value in metrics.items():
+            if isinstance(value, (bool, np.bool_)) or not isinstance(value, (int, float, np.number)):
+                continue
+            if np.isfinite(value):
+                values[str(name)] = float(value)
+
+        month = snapshot_date.strftime('%Y%m')
+        snapshots = dict(self._load_month(month))
+        snapshots[snapshot_date] = values
+        self._write_month(month, snapshots)
+        self._months[month] = snapshots
+
+        logging.info(f"Recorded {len(values)} metrics of {self.schema_name} for {snapshot_date:%Y-%m-%d}.")
+        return len(values)
+
+    def snapshot(self, snapshot_date: datetime) -> dict:
+        """
+        Returns:
+            dict: Metrics recorded on the day, empty when there is no snapshot of it.
+        """
+        snapshot_date = pd.Timestamp(snapshot_date).normalize()
+        return dict(self._load_month(snapshot_date.strftime('%Y%m')).get(snapshot_date, {}))
+
+    def previous(self, snapshot_date: datetime = None, months: int = 1):
+        """
+        Snapshot of the previous period: the latest one on or before the same day `months` months earlier,
+        within that month.
+
+        Args:
+            snapshot_date (datetime): Day of the current snapshot. Defaults to today.
+            months (int): Length of the period.
+
+        Returns:
+            tuple: (date, {metric: value}) of the previous snapshot, or (None, {}) when there is none.
+        """
+        target = pd.Timestamp(snapshot_date or datetime.now()).normalize() - pd.DateOffset(months=months)
+        snapshots = self._load_month(target.strftime('%Y%m'))
+        dates = [day for day in snapshots if day <= target]
+        if not dates:
+            return None, {}
+
+        previous_date = max(dates)
+        return previous_date, dict(snapshots[previous_date])
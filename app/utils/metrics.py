@@ -0,0 +1,302 @@
+import bisect
+import logging
+import math
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+THROUGHPUT_BUCKETS = (100, 500, 1_000, 5_000, 10_000, 50_000, 100_000, 500_000, 1_000_000)
+
+
+def tenant(schema_name: str) -> str:
+    """
+    Firm label of a schema: FIRM_ELT and FIRM_CDP are both FIRM.
+    """
+    return re.sub(r"_(ELT|CDP)$", "", str(schema_name), flags=re.IGNORECASE)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def samples(self) -> list:
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value per label set, e.g. rows written.
+    """
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError(f"{self.name} can only be increased")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """
+    Last value per label set, e.g. the peak memory of a stage.
+    """
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels))
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values per label set in cumulative buckets, with their count and sum.
+    """
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DURATION_BUCKETS,
+                 registry=None) -> None:
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            state['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the seconds the block took, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state['count'] if state else 0
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), state['counts']):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", self._labels(key, {'le': _format_value(bound)}), cumulative))
+                samples.append((f"{self.name}_sum", self._labels(key), state['sum']))
+                samples.append((f"{self.name}_count", self._labels(key), state['count']))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Metrics of the process, rendered in the Prometheus text exposition format.
+
+    They are written to a file for the node_exporter textfile collector and/or served on GET /metrics by a
+    local HTTP endpoint. Values live in the process: a run of main.py starts them from zero, so alerts on the
+    file should use the values of the run (e.g. rate over the run's rows and seconds), not increases across runs.
+    """
+
+    def __init__(self) -> None:
+        self._metrics = {}
+        self._server = None
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Writes the metrics to `path` atomically, so a collector never reads a partial file.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="UTF-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, host: str, port: int) -> ThreadingHTTPServer:
+        """
+        Serves GET /metrics on host:port from a daemon thread.
+        """
+        registry = self
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                logging.debug(f"metrics endpoint {self.address_string()}: {format % args}")
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("UTF-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-endpoint", daemon=True).start()
+        logging.info(f"Metrics served on http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+REGISTRY = MetricsRegistry()
+
+# pipeline stages of main.py, per firm (schema without _ELT/_CDP) and ANALYTIC_METRICS.METRIC_ID
+STAGE_DURATION = Histogram("crm_stage_duration_seconds", "Duration of a pipeline stage.",
+                           ("firm", "metric_id", "stage"))
+STAGE_RUNS = Counter("crm_stage_runs_total", "Pipeline stage runs by status (success or fail).",
+                     ("firm", "metric_id", "stage", "status"))
+STAGE_LAST_SUCCESS = Gauge("crm_stage_last_success_timestamp_seconds", "Unix time of the last successful stage run.",
+                           ("firm", "metric_id", "stage"))
+ROWS_PROCESSED = Counter("crm_rows_processed_total", "Customers (or rows) processed by a stage.",
+                         ("firm", "stage"))
+
+# database writes and statements, per firm (schema without _ELT/_CDP)
+ROWS_INSERTED = Counter("crm_rows_inserted_total", "Rows inserted into a table.", ("firm", "table"))
+INSERT_THROUGHPUT = Histogram("crm_insert_rows_per_second", "Rows per second of an insert_data_to_db call.",
+                              ("firm", "table"), buckets=THROUGHPUT_BUCKETS)
+SQL_DURATION = Histogram("crm_sql_duration_seconds", "Duration of a SQL statement.", ("firm", "operation"))
+SQL_ERRORS = Counter("crm_sql_errors_total", "SQL statements that failed.", ("firm", "operation"))
+
+# churn model and memory
+MODEL_TRAINING_DURATION = Histogram("crm_model_training_seconds", "Duration of a churn model training (lgb.train).",
+                                    ("firm",))
+MODEL_TRAINING_ROWS = Gauge("crm_model_training_rows", "Rows of the last churn model training.", ("firm",))
+STAGE_PEAK_RSS = Gauge("crm_stage_peak_rss_bytes", "Peak RSS of a profiled stage (Config.memory_profiling).",
+                       ("firm", "stage"))
+
+
+@contextmanager
+def stage_metrics(schema_name: str, metric_id, stage: str):
+    """
+    Times a pipeline stage and counts it as a success, or as a failure when it raises or when the block sets
+    the yielded status to failed (for runners that log their errors instead of raising them). The stage is
+    labelled with the firm of schema_name, like the metrics of the lower layers.
+
+    Usage:
+        with stage_metrics(conn_data_user_elt, metric_id, "segmentation") as status:
+            status['failed'] = not job_runner.run()
+    """
+    labels = {'firm': tenant(schema_name), 'metric_id': metric_id, 'stage': stage}
+    status = {'failed': False}
+    start = time.perf_counter()
+    try:
+        yield status
+    except Exception:
+        STAGE_RUNS.inc(status="fail", **labels)
+        raise
+    else:
+        if status['failed']:
+            STAGE_RUNS.inc(status="fail", **labels)
+        else:
+            STAGE_RUNS.inc(status="success", **labels)
+            STAGE_LAST_SUCCESS.set(time.time(), **labels)
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, **labels)
+
+
+def start_metrics_server(config) -> None:
+    """
+    Starts the /metrics endpoint when Config.metrics_port is set.
+    """
+    if config.metrics_port:
+        try:
+            REGISTRY.serve(config.metrics_host, config.metrics_port)
+        except OSError as e:
+            logging.error(f"Metrics endpoint could not be started on {config.metrics_host}:{config.metrics_port}: {e}")
+
+
+def write_metrics(config) -> None:
+    """
+    Writes the metrics to Config.metrics_path ({log_path}/metrics.prom when empty).
+    """
+    path = config.metrics_path or os.path.join(config.log_path, "metrics.prom")
+    try:
+        REGISTRY.write(path)
+    except OSError as e:
+        logging.error(f"Metrics could not be written to {path}: {e}")
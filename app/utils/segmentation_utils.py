@@ -18,6 +18,7 @@ sys.path.append(root_dir)
 
 from app.utils.general_utils import Analytical_Utils, GeneralUtils
 from app.config import Config
+from app.utils.memory_profiler import memory_stage
 
 
 class SegmentationUtils:
@@ -30,19 +31,56 @@ class SegmentationUtils:
 
         self.FIRM_ID = FIRM_ID
 
-    def RFM_segmentation(self, data: pd.DataFrame) -> pd.DataFrame:
+    def RFM_statistics(self, data: pd.DataFrame) -> dict:
+        """
+        Computes the tenant-wide thresholds used by RFM_segmentation so that they can be
+        fitted once and applied to several partitions of the same tenant.
+
+        Args:
+            data (pd.DataFrame): DataFrame with monetary, frequency, ind_alv_orani and ort_indirim_orani columns.
+
+        Returns:
+            dict: Reference date, outlier thresholds, fitted scalers, cut edges and medians.
+        """
+
+        stats = {'today': datetime.today(), 'thresholds': {}, 'scalers': {}}
+
+        for col in ['monetary', 'frequency']:
+            sqrt_col = np.sqrt(data[col].astype('float64'))
+            stats['thresholds'][col] = sqrt_col.mean() + 3 * sqrt_col.std()
+            stats['scalers'][col] = MinMaxScaler().fit(data[[col]])
+
+        monetary_scaled = stats['scalers']['monetary'].transform(data[['monetary']])[:, 0]
+        _, stats['monetary_bins'] = pd.cut(monetary_scaled, bins=5, retbins=True)
+
+        stats['frequency_bins'] = None
+        multi_purchase = data.loc[data.frequency > 1, ['frequency']]
+        if not multi_purchase.empty:
+            frequency_scaled = stats['scalers']['frequency'].transform(multi_purchase)[:, 0]
+            _, stats['frequency_bins'] = pd.cut(frequency_scaled, bins=3, retbins=True)
+
+        stats['median_ind_alv_orani'] = data['ind_alv_orani'].median()
+        stats['median_ort_indirim_orani'] = data['ort_indirim_orani'].median()
+
+        return stats
+
+    def RFM_segmentation(self, data: pd.DataFrame, stats: dict = None) -> pd.DataFrame:
         """
         Performs RFM segmentation and labels customers based on recency, frequency, and monetary values.
         
         Args:
             data_origin (pd.DataFrame): The original DataFrame containing customer data.
+            stats (dict): Thresholds from RFM_statistics. Computed from data when not given.
 
         Returns:
             pd.DataFrame: DataFrame with segmentation labels.
         """
 
+        if stats is None:
+            stats = self.RFM_statistics(data)
+
         # Recency labelling
-        today = datetime.today()
+        today = stats['today']
 
         data['recency_segment'] = 'pasif müşteri'  # Default label
 
@@ -65,40 +103,45 @@ class SegmentationUtils:
             'recency_segment'
         ] = 'markayla yeni temas eden' 
 
-        data = self.a_utils.suppress_outliers(data,['monetary','frequency'])
-
-        scaler = MinMaxScaler()
+        for col in ['monetary', 'frequency']:
+            # Suppress outliers on the square root scale
+            transformed_col = f"{col}_sqrt"
+            col_threshold = stats['thresholds'][col]
+            data[transformed_col] = np.sqrt(data[col].astype('float64'))
+            data[transformed_col] = np.where(data[transformed_col] > col_threshold, col_threshold, data[transformed_col])
 
-        data = self.a_utils.scale_columns(data, ['monetary','frequency'], scaler)
+            data[f"{col}_scaled"] = stats['scalers'][col].transform(data[[col]])
 
         # Monetary labelling
-        data['monetary_segment'] = pd.cut(data['monetary_scaled'], bins=5, labels=['düşük', 'mütevazi', 'orta halli', 'yüksek', 'çok yüksek'])
+        data['monetary_segment'] = pd.cut(data['monetary_scaled'], bins=stats['monetary_bins'], labels=['düşük', 'mütevazi', 'orta halli', 'yüksek', 'çok yüksek'])
 
         # Frequency labelling
         data.loc[data.frequency == 1, 'frequency_segment'] = 'tek alışveriş'
-        data.loc[data.frequency > 1, 'frequency_segment'] = pd.cut(
-            data.loc[data.frequency > 1, 'frequency_scaled'],
-            bins=3,
-            labels=['seyrek', 'orta', 'sık']
-        )
+        if (data.frequency > 1).any():
+            data.loc[data.frequency > 1, 'frequency_segment'] = pd.cut(
+                data.loc[data.frequency > 1, 'frequency_scaled'],
+                bins=stats['frequency_bins'],
+                labels=['seyrek', 'orta', 'sık']
+            )
 
         # Discount sensitivity labelling
-        median_ind_alv_orani = data['ind_alv_orani'].median()
         data['indirim_duyarli_segment'] = 'indirime_duyarsiz'
-        data.loc[data['ind_alv_orani'] > median_ind_alv_orani, 'indirim_duyarli_segment'] = 'indirime_duyarli'
+        data.loc[data['ind_alv_orani'] > stats['median_ind_alv_orani'], 'indirim_duyarli_segment'] = 'indirime_duyarli'
 
         # Discount expectation labelling
-        median_ort_indirim_orani = data['ort_indirim_orani'].median()
         data['indirim_beklentisi_segment'] = 'standart seviyede'
-        data.loc[data['ort_indirim_orani'] > median_ort_indirim_orani, 'indirim_beklentisi_segment'] = 'yüksek seviyede'
+        data.loc[data['ort_indirim_orani'] > stats['median_ort_indirim_orani'], 'indirim_beklentisi_segment'] = 'yüksek seviyede'
 
         return data
 
-    def CLV_segmentation(self, data:pd.DataFrame) -> pd.DataFrame:
+    def CLV_values(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds the per-customer lifespan, purchase value, purchase frequency and CLV columns.
+        """
 
         # Customer Lifespan (days)
         data['customer_lifespan'] = (data['son_alv_tarih'] - data['ilk_odeme_tarih']).dt.days
-        data['customer_lifespan'] = data['customer_lifespan'].apply(lambda x: max(x, 1))  # Avoid division by zero
+        data['customer_lifespan'] = data['customer_lifespan'].clip(lower=1)  # Avoid division by zero
         
         # Customer Value
         data['avg_purchase_value'] = data['musteri_toplam_ciro'] / data['alisveris_adedi']
@@ -106,17 +149,40 @@ class SegmentationUtils:
 
         # CLV
         data['clv'] = round(data['avg_purchase_value'] * data['avg_purchase_frequency_rate'] * (data['customer_lifespan'] / 365), 0)
-            
-        clv_vip_threshold = data['clv'].quantile(0.80)
-        purchase_value_vip_threshold = data['avg_purchase_value'].quantile(0.80)
 
-        clv_loyal_threshold = data['clv'].quantile(0.50)
-        frequency_loyal_threshold = data['avg_purchase_frequency_rate'].quantile(0.50)
+        return data
+
+    def CLV_statistics(self, data: pd.DataFrame) -> dict:
+        """
+        Computes the quantile thresholds used by CLV_segmentation from a DataFrame with CLV_values columns.
+        """
+
+        return {
+            'clv_vip_threshold': data['clv'].quantile(0.80),
+            'purchase_value_vip_threshold': data['avg_purchase_value'].quantile(0.80),
+            'clv_loyal_threshold': data['clv'].quantile(0.50),
+            'frequency_loyal_threshold': data['avg_purchase_frequency_rate'].quantile(0.50),
+            'clv_growth_threshold': data['clv'].quantile(0.50),
+            'lifespan_growth_threshold': data['customer_lifespan'].quantile(0.50),
+        }
+
+    def CLV_segmentation(self, data:pd.DataFrame, stats: dict = None) -> pd.DataFrame:
+
+        data = self.CLV_values(data)
+
+        if stats is None:
+            stats = self.CLV_statistics(data)
+
+        clv_vip_threshold = stats['clv_vip_threshold']
+        purchase_value_vip_threshold = stats['purchase_value_vip_threshold']
+
+        clv_loyal_threshold = stats['clv_loyal_threshold']
+        frequency_loyal_threshold = stats['frequency_loyal_threshold']
 
-        clv_growth_threshold = data['clv'].quantile(0.50)  
-        lifespan_growth_threshold = data['customer_lifespan'].quantile(0.50)
+        clv_growth_threshold = stats['clv_growth_threshold']
+        lifespan_growth_threshold = stats['lifespan_growth_threshold']
 
-        clv_low_threshold = data['clv'].quantile(0.30)
+        # clv_low_threshold = data['clv'].quantile(0.30)
         # clv_risk_threshold = clv_low_threshold
         # lifespan_risk_threshold = data['customer_lifespan'].quantile(0.30)
 
@@ -170,10 +236,12 @@ class SegmentationUtils:
         # only metric columns
         data = data[cols]
 
-        melted_df = data.melt(id_vars=["UNIQUE_CUSTOMER_ID"], value_vars=definition_df["METRIC_NAME"].tolist(), var_name="METRIC_NAME", value_name="VALUE")
-        merged_df = melted_df.merge(definition_df, on="METRIC_NAME")
+        with memory_stage("melt"):
+            melted_df = data.melt(id_vars=["UNIQUE_CUSTOMER_ID"], value_vars=definition_df["METRIC_NAME"].tolist(), var_name="METRIC_NAME", value_name="VALUE")
+            merged_df = melted_df.merge(definition_df, on="METRIC_NAME")
 
-        pivot_df = merged_df.pivot_table(index=["UNIQUE_CUSTOMER_ID"], columns="P_CODE", values="VALUE", aggfunc='first').reset_index()
+        with memory_stage("pivot"):
+            pivot_df = merged_df.pivot_table(index=["UNIQUE_CUSTOMER_ID"], columns="P_CODE", values="VALUE", aggfunc='first').reset_index()
 
         pivot_df['CREATE_DATE'] = CREATE_DATE
         pivot_df['UPDATE_DATE'] = UPDATE_DATE
@@ -1,6 +1,7 @@
 import pandas as pd
 import logging
 from datetime import datetime
+import json
 import os 
 import sys
 
@@ -14,6 +15,10 @@ sys.path.append(root_dir)
 
 from app.utils.general_utils import GeneralUtils
 from app.utils.database import DatabaseManager
+from app.utils.artifact_store import ArtifactStore
+from app.utils.insight_metrics import OverallFirmMetrics, SEGMENT_COLUMNS, segments_key
+from app.utils.insight_text import OVERALL_INSIGHT, SEGMENT_INSIGHT, TREND_INSIGHT
+from app.utils.metric_history import MetricHistory
 from app.config import Config
 
 
@@ -31,6 +36,7 @@ class SmartInsight:
         self.config=Config()
 
         self.db_manager = DatabaseManager(self.schema_name)
+        self.history = MetricHistory(self.schema_name) if self.config.metric_history else None
 
     def data_prep(self, query_path: str) -> pd.DataFrame:
         """
@@ -53,8 +59,25 @@ class SmartInsight:
 
             # Fetch data using DatabaseManager
             logging.info(f"Executing query for schema: {self.schema_name}")
-            metrics_df = self.db_manager.fetch_data_as_df(query)
-            
+            metrics_df = self.db_manager.fetch_data_as_df(query, template=query_path)
+
+            return self.derive_metrics(metrics_df)
+
+        except Exception as e:
+            logging.error(f"Error preparing data for schema {self.schema_name}: {e}")
+            raise
+
+    def derive_metrics(self, metrics_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Derives the metrics used by the insight text from the columns of overall-firm.sql.
+
+        Args:
+            metrics_df (pd.DataFrame): Row of overall-firm.sql, from the database or OverallFirmMetrics.
+
+        Returns:
+            pd.DataFrame: DataFrame with the derived metrics.
+        """
+        try:
             ## derive new - required metrics 
             metrics_df = metrics_df.rename(columns={'TOTAL_CHURNED_CUSTOMER_COUNT':'CHURNED_CUSTOMER_COUNT'})
             metrics_df['TOTAL_CHURN_RISK_CUSTOMER_PCT'] = round((metrics_df['TOTAL_CHURN_RISK_CUSTOMER_COUNT'] / metrics_df['LAST_YEAR_CUSTOMER_COUNT'])*100, 1)
@@ -88,14 +111,41 @@ class SmartInsight:
         logging.info("Fetching segment metrics.")
         return self.db_manager.execute_query_from_file(query_path, firm_id=self.firm_id)
 
-    def fetch_overall_firm_metrics(self) -> pd.DataFrame:
+    def load_segments(self) -> pd.DataFrame:
+        """
+        Segmentation output of this process when insight_metrics_source is 'memory', released from the artifact store.
+
+        Returns:
+            pd.DataFrame: The SEGMENT_COLUMNS of the segmented customers, None when the SQL has to run.
+        """
+        if self.config.insight_metrics_source != 'memory':
+            return None
+
+        key = segments_key(self.schema_name)
+        if not ArtifactStore.contains(key):
+            logging.info(f"No segmentation output of {self.schema_name} in this process, running overall-firm.sql.")
+            return None
+
+        segments = ArtifactStore.read_pandas(key, columns=list(SEGMENT_COLUMNS))
+        ArtifactStore.release(key)
+        return segments
+
+    def fetch_overall_firm_metrics(self, segments: pd.DataFrame = None) -> pd.DataFrame:
         """
-        Fetch overall firm metrics by running the 'overall-firm.sql' query.
+        Fetch overall firm metrics by running the 'overall-firm.sql' query, or from the segmentation
+        output of this process when insight_metrics_source is 'memory'.
+
+        Args:
+            segments (pd.DataFrame): Output of load_segments, None runs the SQL.
         
         Returns:
             pd.DataFrame: DataFrame containing the metrics.
         """
-        query_path = "db_queries/smart_insight/overall-firm.sql"
+        if segments is not None:
+            logging.info(f"Computing overall firm metrics of {self.schema_name} from {len(segments):,} segmented customers in memory.")
+            return self.derive_metrics(OverallFirmMetrics().compute(segments, self.firm_id))
+
+        query_path = os.path.join(root_dir, "db_queries", "Insight", "overall-firm.sql")
         try:
             # Use data_prep to process the query and fetch data
             return self.data_prep(query_path=query_path)
@@ -113,137 +163,22 @@ class SmartInsight:
         Returns:
             str: Generated insight text in Turkish.
         """
-        # Extract metrics
-
-        total_customers = metrics['TOTAL_CUSTOMERS'].iloc[0]
-        earliest_year = metrics['EARLIEST_TRN_YEAR'].iloc[0]
-        earliest_month = metrics['EARLIEST_TRN_MONTH'].iloc[0]
-        median_recency = metrics['MEDIAN_RECENCY'].iloc[0]
-        median_frequency = metrics['MEDIAN_FREQUENCY'].iloc[0]
-        median_monetary = metrics['MEDIAN_MONETARY_VALUE'].iloc[0]
-        median_avg_purchase_value = metrics['MEDIAN_AVG_PURCHASE_VALUE'][0]
-        last_year_customer_count = metrics['LAST_YEAR_CUSTOMER_COUNT'].iloc[0]
-        active_customer_count = metrics['ACTIVE_CUSTOMER_COUNT'].iloc[0]
-        active_customer_pct = metrics['ACTIVE_CUSTOMER_PCT'].iloc[0]
-        one_time_conversion_rate = metrics['ONE_TIME_TO_ACTIVE_CONVERSION_RATE'].iloc[0]
-        retention_ratio = metrics['RETENTION_RATIO'].iloc[0]
-        lost_revenue = metrics['LOST_REVENUE_FROM_CHURN_RISK'].iloc[0]
-        projected_revenue = metrics['PROJECTED_REVENUE_FROM_ACTIVE_CUSTOMERS'].iloc[0]
-        churn_risk_count = metrics['CHURN_RISK_CUSTOMER_COUNT'].iloc[0]
-        churn_risk_pct = metrics['TOTAL_CHURN_RISK_CUSTOMER_PCT'].iloc[0]
-        churned_customer_count = metrics['CHURNED_CUSTOMER_COUNT'].iloc[0]
-        churned_customer_pct = metrics['ACTUAL_CHURN_RATE'].iloc[0]
-        vip_customer_pct = metrics['VIP_CUSTOMER_PCT'].iloc[0]
-        loyal_customer_pct = metrics['LOYAL_CUSTOMER_PCT'].iloc[0]
-        new_customer_pct = metrics['NEW_CUSTOMER_PCT'].iloc[0]
-        one_time_customer_pct = metrics['ONE_TIME_CUSTOMER_PCT'].iloc[0]
-        potential_growth_customer_pct = metrics['POTENTIAL_GROWTH_CUSTOMER_PCT'].iloc[0]
-
-        # Introduction: Firm History and Customer Base
-        insight = (
-            f"Veritabanında yer alan {self.firm_name} verilerine göre, {earliest_year} yılının {self.utils.int_to_month(earliest_month)} ayından itibaren {total_customers:,} müşteri {self.firm_name} markasından alışveriş yaptı. "
-            f"Son 12 aylık döneme bakıldığında ise toplamda {last_year_customer_count:,} müşterinin alışveriş yapmış ve bu müşterilerin %{active_customer_pct}{self.utils.tr_ek(active_customer_pct)} son üç aylık dönemde aktif olarak alışveriş yapmaya devam etmiştir. "
-            f"RFM ve CLV analizleri sonucunda aktif müşterilerden beklenen bir yıllık toplam potansiyel gelir {int(round(projected_revenue,0)):,} TL olarak tahminlenmiştir. "
-            f"Aktif müşterilerin yaklaşık %{retention_ratio}{self.utils.tr_ek(retention_ratio)} son 12 aylık müşteri tabanından gelmektedir."
-        )
-        # Conditional Insights: Retention and Churn Risks
-        if retention_ratio > 80:
-            insight += (
-                f"Bu oran, müşteri sadakat stratejilerinizin oldukça güçlü olduğunu göstermektedir. "
-                f"Sadık müşterilerinizle ilişkilerinizi geliştirmek için özel kampanyalar düzenleyebilirsiniz.\n\n"
-            )
-        elif retention_ratio < 50:
-            insight += (
-                f"Bu oran, müşteri sadakat stratejilerinizin güçlendirilmesi gerektiğine işaret ediyor. "
-                f"Müşteri bağlılığını artırmak için düzenli iletişim ve ödül programları önerilebilir.\n\n"
-            )
-
-        # RFM Metrics: Recency, Frequency, Monetary
-        insight += (
-            f"Müşteri davranışlarını analiz etmek için kullanılan RFM (Recency-Frequency-Monetary) modelinin sonuçlarına göre, "
-            f"bir müşterinin ortalama son alışveriş süresi {median_recency} gün, ortalama alışveriş sıklığı {median_frequency} "
-            f"ve işlem başına ortalama harcama tutarı {int(round(median_monetary,0)):,} TL olarak ölçüldü. "
-        )
-        
-
-        # Segment Definitions and Insights
-        insight += (
-            f"CLV ve RFM modellerinin sonuçları göz önüne alınarak {self.firm_name} markasının müşteri portföyü 6 farklı segmente ayrıldı:\n\n"
-            f"**VIP Müşteriler**: İşlem başına harcama tutarları veya yaşam boyu değerleri (CLV) en üst %20'lik dilimde olan müşterilerdir. "
-            f"Son bir yılda alışveriş yapmış müşterilerin %{vip_customer_pct}{self.utils.tr_ek(vip_customer_pct)} VIP segmentindedir. "
-        )
-        if vip_customer_pct < 10:
-            insight += (
-                f"VIP müşteri oranı düşük görünüyor. Bu segmenti genişletmek için özel fırsatlar ve kampanyalar oluşturulabilir.\n\n"
-            )
-        else:
-            insight += (
-                f"VIP müşteri oranı oldukça yüksek ve bu grup markaya en büyük gelir katkısını sağlıyor.\n\n"
-            )
-
-
-        insight += (
-            f"**Sadık Müşteriler**: Düzenli alışveriş yapan ve alışveriş sıklığı üst %30’luk dilimde yer alan müşterilerden oluşuyor. "
-            f"Toplam müşterilerinizin %{loyal_customer_pct}{self.utils.tr_ek(loyal_customer_pct)} sadık müşteri segmentinde yer alıyor.\n\n"
-        )
-
-        # One-Time Customers Insights
-        insight += (
-            f"**Tek Seferlik Müşteriler**: {self.firm_name} markasından bir kez alışveriş yapmış müşterilerdir. "
-            f"Son bir yılda alışveriş yapan müşterilerin %{one_time_customer_pct}{self.utils.tr_ek(one_time_customer_pct)} ikinci kez alışveriş yapmamıştır. "
-        )
-
-        if one_time_conversion_rate > 50:
-            insight += (
-                f"Tek seferlik müşterilerinizin düzenli müşterilere dönüşme oranı %{one_time_conversion_rate} ile oldukça yüksek. "
-                f"Tek seferlik müşteriler, iyi bir dönüşüm oranı ile sadakat segmentine taşınabilir."
-                f"Bu trendi sürdürmek için yeni müşterilere kişiselleştirilmiş kampanyalar düzenleyebilirsiniz.\n\n"
-            )
-        else:
-            insight += (
-                f"Tek seferlik müşterilerin düzenli müşterilere dönüşme oranı %{one_time_conversion_rate} seviyesindedir. "
-                f"Tek seferlik müşteriler, iyi bir dönüşüm oranı ile sadakat segmentine taşınabilir."
-                f"Daha fazla dönüşüm için hoş geldiniz indirimleri ve müşteri ödül programları düzenleyebilirsiniz.\n\n"
-            )
-
-        # Churn Risk Insights
-        insight += (
-            f"**Kayıp Riski Taşıyan Müşteriler**: Son dönemlerde alışveriş yapmamış ve harcama düzeyleri düşük olan müşterilerden oluşuyor. "
-        f"Son 12 ayda alışveriş yapan müşterilerinizin %{churn_risk_pct}{self.utils.tr_ek(churn_risk_pct)} bu segmentte yer alıyor. "
-        f"Kayıp riski taşıyan müşterilere odaklanarak tahmini {int(round(lost_revenue,0)):,} TL'lik gelir kaybının önüne geçebilirsiniz."
-        f"\n\n"
-        )
-
-
-        # Churned Customers
-        insight += (
-            f"**Kayıp Müşteriler**: Son 12 aydan uzun süredir alışveriş yapmamış müşterilerden oluşuyor. "
-            f"Toplam {churned_customer_count:,} müşteri (%{churned_customer_pct}) bu segmentte yer alıyor. "
-            f"Kayıp müşterilerin geri kazanımı için özel iletişim stratejileri geliştirebilirsiniz.\n\n"
-        )
-
-
-        # Potential Growth Customers
-        insight += (
-            f"**Potansiyel Büyüme Müşterileri**: Harcamalarını artırma potansiyeline sahip müşterilerden oluşur. "
-            f"Son 12 ayda alışveriş yapmış müşterilerinizin %{potential_growth_customer_pct}{self.utils.tr_ek(potential_growth_customer_pct)} bu segmentte yer alıyor. "
-        )
-
-
-        if potential_growth_customer_pct > churn_risk_pct:
-            insight += (
-                f"Potansiyel büyüme müşterilerinin oranı kayıp riski taşıyan müşterilerden daha yüksek. Bu da {self.firm_name} için büyüme fırsatları sunuyor. "
-                f"Bu müşterilere yönelik hedefli kampanyalar ile bu segmentten elde edilen geliri arttırabilirsiniz."
-            )
-        else:
-            insight += (
-                f"Potansiyel büyüme müşterilerinin oranı kayıp riski taşıyan müşterilere kıyasla düşüktür. "
-                f"Kayıp riski taşıyan müşterileri bu segmente taşımak için özel teklifler sunabilirsiniz."
-            )
+        return self.render_overall_insights(metrics.iloc[:1]).iloc[0]
 
+    def render_overall_insights(self, metrics: pd.DataFrame) -> pd.Series:
+        """
+        Renders the overall insight of every row of metrics in one pass (see app/utils/insight_text.py).
+        Rows without a FIRM_NAME column are rendered with the name of this firm.
 
-        return insight
+        Args:
+            metrics (pd.DataFrame): One row per firm or period with the columns of derive_metrics.
 
+        Returns:
+            pd.Series: Insight texts indexed like metrics.
+        """
+        if 'FIRM_NAME' not in metrics.columns:
+            metrics = metrics.assign(FIRM_NAME=self.firm_name)
+        return OVERALL_INSIGHT.render(metrics)
 
     def generate_segment_insight(self, metrics: pd.DataFrame) -> str:
         """
@@ -255,18 +190,7 @@ class SmartInsight:
         Returns:
             str: Generated insight text for segments.
         """
-        insights = []
-        for _, row in metrics.iterrows():
-            segment_name = row['segment_name']
-            customer_count = row['customer_count']
-            avg_monetary = row['avg_monetary']
-            avg_frequency = row['avg_frequency']
-
-            insights.append(
-                f"{segment_name} segmentinde toplam {customer_count:,} müşteri bulunmakta olup, "
-                f"ortalama harcama tutarı {round(avg_monetary,0):,} TL ve alışveriş sıklığı {avg_frequency:.2f} olarak belirlenmiştir."
-            )
-        return " ".join(insights)
+        return " ".join(SEGMENT_INSIGHT.render(metrics))
 
     def prep_output(self, metrics: pd.DataFrame) -> pd.DataFrame:
         """
@@ -329,26 +253,142 @@ class SmartInsight:
 
 
 
-    def generate_insight_report(self, metrics:pd.DataFrame) -> pd.DataFrame:
+    # metrics compared with the previous period by TREND_INSIGHT
+    TREND_METRICS = ['TOTAL_CUSTOMERS', 'LAST_YEAR_CUSTOMER_COUNT', 'RETENTION_RATIO', 'VIP_CUSTOMER_PCT']
+
+    def generate_trend_insight(self, metrics: pd.DataFrame, previous_date: datetime, previous: dict) -> pd.Series:
+        """
+        Renders the period-over-period paragraph of every row of metrics against a previous snapshot.
+
+        Args:
+            metrics (pd.DataFrame): Current metrics with the columns of derive_metrics.
+            previous_date (datetime): Day of the previous snapshot, None when there is none.
+            previous (dict): Metrics of the previous snapshot (MetricHistory.previous).
+
+        Returns:
+            pd.Series: Trend texts indexed like metrics, empty strings when a metric is missing.
+        """
+        texts = pd.Series('', index=metrics.index, dtype=object)
+        if previous_date is None or any(name not in previous or name not in metrics.columns for name in self.TREND_METRICS):
+            return texts
+
+        trend = metrics.assign(PREVIOUS_SNAPSHOT_DATE=f"{previous_date:%d.%m.%Y}")
+        for name in self.TREND_METRICS:
+            change = trend[name].astype(float) - previous[name]
+            trend[f"{name}_PREVIOUS"] = previous[name]
+            trend[f"{name}_CHANGE"] = change
+            trend[f"{name}_CHANGE_PCT"] = round(abs(change) / previous[name] * 100, 1) if previous[name] else 0.0
+
+        valid = trend[self.TREND_METRICS].notna().all(axis=1)
+        if valid.any():
+            texts[valid] = TREND_INSIGHT.render(trend[valid])
+        return texts
+
+    def generate_insight_report(self, metrics:pd.DataFrame, previous_date: datetime = None, previous: dict = None) -> pd.DataFrame:
         """
-        Generate and return the complete insight report for the firm.
+        Generate and return the complete insight report for the firm, with the trend paragraph when a
+        previous snapshot of the metric history is given.
         """
 
-        smart_insight = self.generate_overall_insight(metrics)
-        metrics['SMART_INSIGHT'] = smart_insight
+        metrics['SMART_INSIGHT'] = self.render_overall_insights(metrics)
+        if previous_date is not None:
+            metrics['SMART_INSIGHT'] = metrics['SMART_INSIGHT'] + self.generate_trend_insight(metrics, previous_date, previous)
 
         return metrics
 
+    def input_fingerprint(self, segments: pd.DataFrame = None, previous_date: datetime = None) -> str:
+        """
+        Cheap content fingerprint of the inputs of the insight: the segmented customers with their last year flag,
+        the firm name, the insight template and the previous snapshot the trend is computed against.
+
+        Args:
+            segments (pd.DataFrame): Output of load_segments, None fingerprints ANALYTIC_CUSTOMER in the database.
+            previous_date (datetime): Day of the previous snapshot of the metric history, if any.
+
+        Returns:
+            str: Fingerprint compared with the one of the cached insight.
+        """
+        if segments is not None:
+            calculator = OverallFirmMetrics()
+            data_fingerprint = self.utils.frame_fingerprint(segments.assign(LAST_YEAR=calculator.last_year(segments)))
+        else:
+            query_path = os.path.join(root_dir, "db_queries", "Insight", "overall-firm-fingerprint.sql")
+            with open(query_path, "r", encoding="utf-8") as f:
+                query = self.utils.format_schema_name(f.read(), self.schema_name, dt_start='', dt_end='')
+            row = self.db_manager.fetch_data_as_df(query, template=query_path)
+            row.columns = row.columns.str.upper()
+            data_fingerprint = "|".join(str(row.iloc[0][column]) for column in ["ROW_COUNT", "ROW_HASH", "LAST_YEAR_HASH"])
+
+        return (f"{data_fingerprint}|{self.firm_id}|{self.firm_name}|{OVERALL_INSIGHT.signature}"
+                f"|{TREND_INSIGHT.signature}|{previous_date}")
+
+    @property
+    def cache_path(self) -> str:
+        return os.path.join(self.config.insight_cache_dir, f"{self.schema_name}.json")
+
+    def load_cached_insight(self, fingerprint: str) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: Metrics and SMART_INSIGHT of the last generation when its fingerprint matches, else None.
+        """
+        if not os.path.exists(self.cache_path):
+            return None
+
+        with open(self.cache_path, "r", encoding="UTF-8") as f:
+            cached = json.load(f)
+
+        if cached.get("fingerprint") != fingerprint:
+            return None
+
+        logging.info(f"Inputs of Smart Insight for {self.schema_name} unchanged since {cached['created_at']}.")
+        return pd.DataFrame(cached["metrics"])
+
+    def save_cached_insight(self, fingerprint: str, metrics: pd.DataFrame) -> None:
+        os.makedirs(self.config.insight_cache_dir, exist_ok=True)
+        cached = {
+            "fingerprint": fingerprint,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "metrics": json.loads(metrics.to_json(orient="records")),
+        }
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="UTF-8") as f:
+            json.dump(cached, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
     def run(self): 
 
         logging.error("Starting job: SmartInsight")
 
-        smart_insight_metrics = self.fetch_overall_firm_metrics()
-        smart_insight_metrics = self.generate_insight_report(smart_insight_metrics)
-        
-        out_df = self.prep_output(smart_insight_metrics)
+        segments = self.load_segments()
 
-        table_name= f"ANALYTIC_FIRM_BASED"
-        
-        self.db_manager.insert_data_to_db(out_df, table_name)
-        logging.error(f"OUT DATAFRAME for SMART INSIGHT HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
+        previous_date, previous = None, {}
+        if self.history is not None:
+            previous_date, previous = self.history.previous(months=self.config.metric_history_trend_months)
+
+        fingerprint = None
+        smart_insight_metrics = None
+        if self.config.insight_cache:
+            fingerprint = self.input_fingerprint(segments, previous_date)
+            smart_insight_metrics = self.load_cached_insight(fingerprint)
+            if smart_insight_metrics is not None:
+                logging.info(f"SMART INSIGHT OF {self.schema_name} REUSED FROM {self.cache_path}, ANALYTIC_FIRM_BASED IS UNCHANGED")
+
+        if smart_insight_metrics is None:
+            smart_insight_metrics = self.fetch_overall_firm_metrics(segments)
+            smart_insight_metrics = self.generate_insight_report(smart_insight_metrics, previous_date, previous)
+
+            out_df = self.prep_output(smart_insight_metrics)
+
+            table_name= f"ANALYTIC_FIRM_BASED"
+
+            self.db_manager.insert_data_to_db(out_df, table_name)
+            logging.error(f"OUT DATAFRAME for SMART INSIGHT HAS BEEN INSERTED TO {self.schema_name}.{table_name}")
+
+            if fingerprint is not None:
+                self.save_cached_insight(fingerprint, smart_insight_metrics)
+
+        # today's snapshot is recorded whether the insight was generated or reused
+        if self.history is not None and not smart_insight_metrics.empty:
+            self.history.record(smart_insight_metrics.iloc[0].drop(['FIRM_ID'], errors='ignore').to_dict())
+
+        return smart_insight_metrics
@@ -0,0 +1,210 @@
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+from app.config import Config
+from app.utils.metrics import SQL_DURATION, SQL_ERRORS, tenant
+
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "MERGE")
+
+
+class SQLStats:
+    """
+    Execution statistics of the SQL statements run by DatabaseManager.
+
+    Every statement is recorded as one JSON line in Config.sql_stats_path ({log_path}/sql_stats.jsonl by default)
+    with its schema, template id, elapsed seconds, rows affected or fetched, fetched bytes (in-memory size of the
+    result) and the number of round trips to the database. Round trips are counted per driver call: an execute,
+    every batch of an executemany, every commit and every arraysize rows fetched.
+
+    The template id is the path of the SQL file when the statement was read from one, otherwise a hash of the
+    statement with its literals and the firm's schema name masked, so the same query of every tenant shares it.
+
+    Statements slower than Config.sql_explain_threshold_seconds (0 = never) also record the execution plan from
+    EXPLAIN PLAN and DBMS_XPLAN.DISPLAY.
+
+    Usage:
+        with stats.track(connection, query, template="db_queries/Insight/overall-firm.sql") as record:
+            cursor.execute(query)
+            record['round_trips'] += 1
+    """
+
+    def __init__(self, schema_name: str) -> None:
+        self.config = Config()
+        self.schema_name = schema_name
+        self.enabled = self.config.sql_stats
+        self.path = self.config.sql_stats_path or os.path.join(self.config.log_path, "sql_stats.jsonl")
+        self.explain_threshold = self.config.sql_explain_threshold_seconds
+
+    def normalize(self, sql: str) -> str:
+        """
+        Statement with the schema name of the firm, quoted literals and numbers masked and whitespace collapsed.
+        """
+        schema = tenant(self.schema_name) if self.schema_name else ""
+        if schema:
+            sql = re.sub(re.escape(schema), "{SCHEMA_NAME}", sql, flags=re.IGNORECASE)
+        sql = re.sub(r"'[^']*'", "?", sql)
+        sql = re.sub(r"\b\d+(\.\d+)?\b", "?", sql)
+        return " ".join(sql.split())
+
+    def template_id(self, sql: str, template: str = None) -> str:
+        if template:
+            return os.path.relpath(template, root_dir) if os.path.isabs(template) else template
+        return "sql:" + hashlib.sha1(self.normalize(sql).upper().encode("UTF-8")).hexdigest()[:12]
+
+    @staticmethod
+    def fetch_round_trips(cursor, rows: int) -> int:
+        """
+        Round trips of fetching `rows` rows: the driver fetches arraysize rows per trip, plus the empty last one.
+        """
+        return math.ceil(rows / max(cursor.arraysize, 1)) + 1
+
+    @contextmanager
+    def track(self, connection, sql: str, template: str = None, operation: str = "execute"):
+        """
+        Times the block and writes its record. The caller fills rows, fetched_bytes and round_trips of the
+        yielded record; errors are recorded and raised again.
+
+        Args:
+            connection (oracledb.Connection): Connection the statement runs on, used for the plan capture.
+            sql (str): Statement.
+            template (str): Path of the SQL file of the statement, if any.
+            operation (str): DatabaseManager method running the statement.
+        """
+        record = {
+            'timestamp': datetime.now().isoformat(timespec="milliseconds"),
+            'schema_name': self.schema_name,
+            'template': self.template_id(sql, template),
+            'operation': operation,
+            'seconds': None,
+            'rows': 0,
+            'fetched_bytes': 0,
+            'round_trips': 0,
+        }
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = str(e).splitlines()[0] if str(e) else type(e).__name__
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            SQL_DURATION.observe(record['seconds'], firm=tenant(self.schema_name), operation=operation)
+            if 'error' in record:
+                SQL_ERRORS.inc(firm=tenant(self.schema_name), operation=operation)
+            if self.enabled:
+                if 'error' not in record and 0 < self.explain_threshold <= record['seconds']:
+                    record['plan'] = self.explain(connection, sql)
+                if not template:
+                    record['statement'] = self.normalize(sql)[:300]
+                self.write(record)
+
+    def explain(self, connection, sql: str) -> list:
+        """
+        Returns:
+            list: Lines of the DBMS_XPLAN.DISPLAY output of the statement, empty when it cannot be explained.
+        """
+        if connection is None or not sql.lstrip(" \n(").upper().startswith(EXPLAINABLE):
+            return []
+
+        statement_id = f"CRM{time.time_ns() % 10 ** 15}"
+        statement = sql.strip(" \n;")
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {statement}")
+                cursor.execute("SELECT PLAN_TABLE_OUTPUT FROM TABLE(DBMS_XPLAN.DISPLAY('PLAN_TABLE', :id, 'TYPICAL'))",
+                               id=statement_id)
+                plan = [row[0] for row in cursor.fetchall()]
+            # the rows EXPLAIN PLAN wrote to PLAN_TABLE are not kept
+            connection.rollback()
+            return plan
+        except Exception as e:
+            logging.warning(f"Execution plan of a {self.schema_name} statement could not be captured: {e}")
+            return []
+
+    def write(self, record: dict) -> None:
+        logging.info(f"SQL {record['template']} on {self.schema_name}: {record['seconds']:.3f}s, {record['rows']} rows, "
+                     f"{record['round_trips']} round trips")
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # one write per line, appends of concurrent jobs do not interleave
+            with open(self.path, "a", encoding="UTF-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            logging.error(f"SQL statistics could not be written to {self.path}: {e}")
+
+
+def load_stats(path: str) -> pd.DataFrame:
+    """
+    Reads a SQL statistics file, skipping lines cut off by a crash.
+    """
+    records = []
+    with open(path, "r", encoding="UTF-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return pd.DataFrame(records)
+
+
+def summarize(stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Executions, total, mean and max seconds, rows, fetched bytes, round trips and errors per tenant and
+    template, slowest first.
+    """
+    stats = stats.assign(ERRORS=stats['error'].notna() if 'error' in stats else False)
+    summary = stats.groupby(['schema_name', 'template']).agg(
+        EXECUTIONS=('seconds', 'size'),
+        TOTAL_SECONDS=('seconds', 'sum'),
+        MEAN_SECONDS=('seconds', 'mean'),
+        MAX_SECONDS=('seconds', 'max'),
+        ROWS=('rows', 'sum'),
+        FETCHED_MB=('fetched_bytes', lambda values: values.sum() / 2 ** 20),
+        ROUND_TRIPS=('round_trips', 'sum'),
+        ERRORS=('ERRORS', 'sum'),
+    ).reset_index()
+    return summary.sort_values('TOTAL_SECONDS', ascending=False).round(3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slowest SQL templates per tenant from the SQL statistics file.")
+    parser.add_argument("--path", default=None, help="statistics file, Config.sql_stats_path by default")
+    parser.add_argument("--schema", default=None, help="only this tenant")
+    parser.add_argument("--since", default=None, help="only executions from this ISO date on")
+    parser.add_argument("--top", type=int, default=10, help="templates shown per tenant")
+    args = parser.parse_args()
+
+    path = args.path or SQLStats(None).path
+    stats = load_stats(path)
+    if stats.empty:
+        print(f"no statistics in {path}")
+        return
+    if args.schema:
+        stats = stats[stats['schema_name'] == args.schema]
+    if args.since:
+        stats = stats[stats['timestamp'] >= args.since]
+
+    summary = summarize(stats)
+    with pd.option_context('display.width', 200, 'display.max_colwidth', 60):
+        for schema_name, templates in summary.groupby('schema_name', sort=False):
+            print(f"\n{schema_name}")
+            print(templates.drop(columns='schema_name').head(args.top).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
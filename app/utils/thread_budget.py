@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import socket
+import time
+
+from threadpoolctl import threadpool_limits
+
+
+class ThreadBudget:
+    """
+    Shares the CPU cores between concurrently running jobs, also across processes.
+
+    Every active job holds a lease file in budget_dir. A job gets total_cores // active jobs threads
+    (the longest running jobs get the remainder), leases of processes that no longer exist are
+    removed. The share is applied to LightGBM through num_threads and to OpenMP/BLAS pools through
+    threadpoolctl, and is rebalanced while training when other jobs start or finish.
+
+    Usage:
+        with ThreadBudget("churn_FIRM_CDP") as budget:
+            params['num_threads'] = budget.current_threads
+            lgb.train(params, ..., callbacks=[budget.lightgbm_callback()])
+    """
+
+    def __init__(self, job_name: str, budget_dir: str = "data/thread_budget", total_cores: int = 0,
+                 refresh_seconds: float = 5.0) -> None:
+        """
+        Args:
+            job_name (str): Name of the job, shown in the utilization snapshot.
+            budget_dir (str): Directory holding the leases, shared by all jobs of the host.
+            total_cores (int): Cores shared by the jobs. Defaults to the cores available to the process.
+            refresh_seconds (float): Minimum interval between two rebalancing checks during training.
+        """
+        self.job_name = job_name
+        self.budget_dir = budget_dir
+        self.total_cores = total_cores or (len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count())
+        self.refresh_seconds = refresh_seconds
+        self.hostname = socket.gethostname()
+        self.lease_path = os.path.join(budget_dir, f"{self.hostname}_{os.getpid()}_{id(self)}.json")
+
+        self.current_threads = None
+        self.rebalances = 0
+        self._limiter = None
+        self._started_at = None
+        self._cpu_start = None
+        self._last_check = 0.0
+
+    @staticmethod
+    def _is_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def active_leases(self) -> list:
+        """
+        Returns the leases of the running jobs on this host, oldest first, and removes stale ones.
+        """
+        leases = []
+        if not os.path.isdir(self.budget_dir):
+            return leases
+
+        for file_name in os.listdir(self.budget_dir):
+            if not file_name.endswith(".json"):
+                continue
+            path = os.path.join(self.budget_dir, file_name)
+            try:
+                with open(path, "r", encoding="UTF-8") as f:
+                    lease = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            if lease.get("hostname") != self.hostname:
+                continue
+            if not self._is_alive(lease["pid"]):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+
+            lease["path"] = path
+            leases.append(lease)
+
+        return sorted(leases, key=lambda lease: (lease["started_at"], lease["path"]))
+
+    def _write_lease(self) -> None:
+        lease = {
+            "job_name": self.job_name,
+            "pid": os.getpid(),
+            "hostname": self.hostname,
+            "started_at": self._started_at,
+            "threads": self.current_threads
+        }
+        tmp_path = f"{self.lease_path}.tmp"
+        with open(tmp_path, "w", encoding="UTF-8") as f:
+            json.dump(lease, f)
+        os.replace(tmp_path, self.lease_path)
+
+    def threads(self) -> int:
+        """
+        Current fair share of this job.
+        """
+        leases = self.active_leases()
+        paths = [lease["path"] for lease in leases]
+        if self.lease_path not in paths:
+            return self.total_cores
+
+        share, remainder = divmod(self.total_cores, len(leases))
+        return max(1, share + (1 if paths.index(self.lease_path) < remainder else 0))
+
+    def acquire(self) -> int:
+        os.makedirs(self.budget_dir, exist_ok=True)
+        self._started_at = time.time()
+        self._cpu_start = sum(os.times()[:2])
+        self._write_lease()
+
+        self.current_threads = self.threads()
+        self._write_lease()
+        self._limiter = threadpool_limits(limits=self.current_threads)
+        logging.info(f"{self.job_name}: {self.current_threads} of {self.total_cores} cores "
+                     f"({len(self.active_leases())} active jobs).")
+
+        return self.current_threads
+
+    def rebalance(self) -> bool:
+        """
+        Recomputes the share and applies it to the native thread pools. Returns True when it changed.
+        """
+        threads = self.threads()
+        if threads == self.current_threads:
+            return False
+
+        logging.info(f"{self.job_name}: rebalanced from {self.current_threads} to {threads} threads.")
+        self.current_threads = threads
+        self.rebalances += 1
+        threadpool_limits(limits=threads)
+        self._write_lease()
+
+        return True
+
+    def release(self) -> dict:
+        metrics = self.utilization()
+        logging.info(f"{self.job_name} thread budget: {metrics}")
+
+        if self._limiter is not None:
+            self._limiter.restore_original_limits()
+            self._limiter = None
+        if os.path.exists(self.lease_path):
+            os.remove(self.lease_path)
+
+        return metrics
+
+    def lightgbm_callback(self):
+        """
+        LightGBM callback that moves the booster to the current share when it changes.
+        """
+        def _callback(env):
+            now = time.time()
+            if now - self._last_check < self.refresh_seconds:
+                return
+            self._last_check = now
+
+            if self.rebalance():
+                env.model.reset_parameter({"num_threads": self.current_threads})
+
+        _callback.order = 5
+        return _callback
+
+    def utilization(self) -> dict:
+        """
+        Utilization metrics of this job and of the host.
+
+        cpu_efficiency is the CPU time used by the process divided by the wall time times the allocated threads.
+        """
+        wall_seconds = time.time() - self._started_at if self._started_at else 0.0
+        cpu_seconds = sum(os.times()[:2]) - self._cpu_start if self._cpu_start is not None else 0.0
+        leases = self.active_leases()
+
+        return {
+            "job_name": self.job_name,
+            "threads": self.current_threads,
+            "total_cores": self.total_cores,
+            "active_jobs": len(leases),
+            "allocated_threads": sum(lease.get("threads") or 0 for lease in leases),
+            "rebalances": self.rebalances,
+            "wall_seconds": round(wall_seconds, 2),
+            "cpu_seconds": round(cpu_seconds, 2),
+            "cpu_efficiency": round(cpu_seconds / (wall_seconds * self.current_threads), 3)
+                if wall_seconds and self.current_threads else None,
+            "load_average_1m": os.getloadavg()[0] if hasattr(os, "getloadavg") else None
+        }
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
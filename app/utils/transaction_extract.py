@@ -0,0 +1,274 @@
+import json
+import logging
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+sys.path.append(root_dir)
+
+from app.config import Config
+from app.utils.general_utils import GeneralUtils
+
+# narrow Arrow types of the extract columns, the amounts keep float64 for parity with Oracle NUMBER sums
+COLUMN_TYPES = {
+    'CUSTOMER_ID': pa.int64(),
+    'PROGRAM_ID': pa.int32(),
+    'TRX_STATE_ID': pa.int8(),
+    'TRANSACTION_ID': pa.int64(),
+    'TRANSACTION_DATE': pa.timestamp('ns'),
+    'TIMED_ID_TRANSACTION': pa.float64(),
+    'AMOUNT_AFTER_DISCOUNT': pa.float64(),
+    'AMOUNT_DISCOUNT': pa.float64(),
+    'AMOUNT_EARNED_POINT': pa.float64(),
+    'AMOUNT_USED_POINT': pa.float64()
+}
+
+
+class TransactionExtract:
+    """
+    Per firm extract of TRANSACTION_MAIN shared by the segmentation and churn modules.
+
+    db_queries/extract/transactions.sql scans the valid transactions (IS_DELETED = 0, TRX_STATE_ID IN (1, 3))
+    once per firm and day into month partitions under {transaction_extract_dir}/{schema_name}/transactions/,
+    sorted by CUSTOMER_ID and zstd compressed. CUSTOMER_STG and DIM_PROGRAM are small and fetched whole on every
+    refresh, so customer merges and program changes reach old transactions without reloading them.
+
+    A refresh reloads the months touched by the last transaction_extract_reload_days days; every
+    transaction_extract_full_refresh_days days the whole history is reloaded to pick up late deletions.
+    Either way the transactions are fetched and written one month at a time into a staging directory, which
+    replaces the stored months only when all of them were written, so a failed refresh keeps the last extract.
+    The consumers read their columns from the partitions through rfm_transactions and churn_transactions.
+
+    Usage:
+        extract = TransactionExtract("FIRM_CDP")
+        extract.refresh(db_manager)
+        transactions = extract.rfm_transactions()
+    """
+
+    def __init__(self, schema_name: str, extract_dir: str = None) -> None:
+        self.schema_name = schema_name
+        self.config = Config()
+        self.extract_dir = extract_dir or os.path.join(self.config.transaction_extract_dir, schema_name)
+        self.manifest_path = os.path.join(self.extract_dir, "manifest.json")
+        self.months_dir = os.path.join(self.extract_dir, "transactions")
+        self.customers_path = os.path.join(self.extract_dir, "customers.parquet")
+        self.programs_path = os.path.join(self.extract_dir, "programs.parquet")
+
+    def load_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {"refreshed_on": None, "full_refresh_on": None, "first_transaction_date": None, "rows": {}}
+
+        with open(self.manifest_path, "r", encoding="UTF-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: dict) -> None:
+        manifest["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="UTF-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def months(self) -> list:
+        """
+        Months of the stored partitions (YYYYMM), oldest first.
+        """
+        if not os.path.isdir(self.months_dir):
+            return []
+        return sorted(name.split("=")[1] for name in os.listdir(self.months_dir)
+                      if name.startswith("month=") and not name.endswith(".tmp"))
+
+    def _month_path(self, month: str, months_dir: str = None) -> str:
+        return os.path.join(months_dir or self.months_dir, f"month={month}", "part-0.parquet")
+
+    @staticmethod
+    def month_windows(start: pd.Timestamp, end: pd.Timestamp) -> list:
+        """
+        (YYYYMM, window start, window end) of the calendar months covering start <= date < end.
+        """
+        windows = []
+        month_start = start.replace(day=1)
+        while month_start < end:
+            next_month = month_start + pd.offsets.MonthBegin(1)
+            windows.append((month_start.strftime("%Y%m"), max(start, month_start), min(next_month, end)))
+            month_start = next_month
+        return windows
+
+    def _fetch(self, db_manager, file_name: str, dt_start: str = '', dt_end: str = '') -> pd.DataFrame:
+        query_path = os.path.join(root_dir, "db_queries", "extract", file_name)
+        with open(query_path, "r", encoding="utf-8") as f:
+            query = GeneralUtils.format_schema_name(f.read(), self.schema_name, dt_start=dt_start, dt_end=dt_end)
+
+        data = db_manager.fetch_data_as_df(query, template=query_path)
+        data.columns = data.columns.str.upper()
+        return data
+
+    @staticmethod
+    def _to_table(transactions: pd.DataFrame) -> pa.Table:
+        table = pa.Table.from_pandas(transactions, preserve_index=False)
+        for name, column_type in COLUMN_TYPES.items():
+            table = table.set_column(table.schema.get_field_index(name), name, table[name].cast(column_type))
+        return table
+
+    def _write_month(self, path: str, transactions: pd.DataFrame) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = self._to_table(transactions.sort_values(['CUSTOMER_ID', 'TRANSACTION_DATE'], kind='stable'))
+        pq.write_table(table, path, compression='zstd')
+
+    def _first_transaction_date(self, db_manager, start: pd.Timestamp, end: pd.Timestamp) -> pd.Timestamp:
+        first_date = self._fetch(db_manager, "transactions-first-date.sql", dt_start=start.strftime("%Y%m%d"),
+                                 dt_end=end.strftime("%Y%m%d"))['FIRST_TRANSACTION_DATE']
+        return pd.Timestamp(first_date.iloc[0]) if len(first_date) and pd.notna(first_date.iloc[0]) else None
+
+    def refresh(self, db_manager, today: datetime = None, force: bool = False) -> dict:
+        """
+        Brings the extract up to date with TRANSACTION_MAIN, at most once per day unless force is set.
+
+        Args:
+            db_manager (DatabaseManager): Connection to the firm's CDP schema.
+            today (datetime): Day of the refresh. Defaults to today.
+            force (bool): Refresh even if the extract was already refreshed today.
+
+        Returns:
+            dict: The updated manifest.
+        """
+        today = pd.Timestamp(today or datetime.now()).normalize()
+        manifest = self.load_manifest()
+        if not force and manifest["refreshed_on"] == today.strftime("%Y-%m-%d"):
+            return manifest
+
+        full_refresh = (manifest["full_refresh_on"] is None or
+                        (today - pd.Timestamp(manifest["full_refresh_on"])).days >= self.config.transaction_extract_full_refresh_days)
+        # the extract covers the transactions of today as well, like the queries it replaces
+        end = today + pd.Timedelta(days=1)
+        if full_refresh:
+            start = pd.Timestamp(self.config.transaction_extract_start_dt)
+            # the months before the first transaction are not queried one by one
+            first_date = self._first_transaction_date(db_manager, start, end)
+            windows = self.month_windows(max(start, first_date.normalize().replace(day=1)), end) if first_date else []
+        else:
+            reload_from = min(pd.Timestamp(manifest["refreshed_on"]),
+                              today - pd.Timedelta(days=self.config.transaction_extract_reload_days))
+            start = reload_from.replace(day=1)
+            windows = self.month_windows(start, end)
+
+        # one month in memory at a time, written to the staging directory
+        staging_dir = f"{self.months_dir}.staging"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        rows = {}
+        for month, window_start, window_end in windows:
+            transactions = self._fetch(db_manager, "transactions.sql", dt_start=window_start.strftime("%Y%m%d"),
+                                       dt_end=window_end.strftime("%Y%m%d"))
+            if transactions.empty:
+                continue
+            transactions['TRANSACTION_DATE'] = pd.to_datetime(transactions['TRANSACTION_DATE'])
+            self._write_month(self._month_path(month, staging_dir), transactions)
+            rows[month] = len(transactions)
+            del transactions
+
+        # the stored months are replaced only after all new months were written
+        if full_refresh:
+            old_dir = f"{self.months_dir}.old"
+            shutil.rmtree(old_dir, ignore_errors=True)
+            if os.path.isdir(self.months_dir):
+                os.replace(self.months_dir, old_dir)
+            os.replace(staging_dir, self.months_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            manifest["rows"] = rows
+        else:
+            os.makedirs(self.months_dir, exist_ok=True)
+            for month in self.months():
+                if month >= start.strftime("%Y%m"):
+                    shutil.rmtree(os.path.dirname(self._month_path(month)))
+                    manifest["rows"].pop(month, None)
+            for month in rows:
+                os.replace(os.path.dirname(self._month_path(month, staging_dir)), os.path.dirname(self._month_path(month)))
+            shutil.rmtree(staging_dir)
+            manifest["rows"].update(rows)
+
+        self._fetch(db_manager, "customers.sql").to_parquet(self.customers_path, index=False)
+        self._fetch(db_manager, "programs.sql").to_parquet(self.programs_path, index=False)
+
+        stored = self.months()
+        if stored:
+            first_dates = pq.read_table(self._month_path(stored[0]), columns=['TRANSACTION_DATE'])['TRANSACTION_DATE']
+            manifest["first_transaction_date"] = pd.Timestamp(first_dates.to_pandas().min()).strftime("%Y-%m-%d")
+        else:
+            manifest["first_transaction_date"] = None
+        manifest["refreshed_on"] = today.strftime("%Y-%m-%d")
+        if full_refresh:
+            manifest["full_refresh_on"] = today.strftime("%Y-%m-%d")
+        self._save_manifest(manifest)
+
+        logging.info(f"Transaction extract of {self.schema_name} refreshed from {start:%Y-%m-%d} "
+                     f"({'full' if full_refresh else 'incremental'}), {sum(manifest['rows'].values()):,} transactions "
+                     f"in {len(stored)} months.")
+
+        return manifest
+
+    def first_transaction_date(self) -> pd.Timestamp:
+        first_date = self.load_manifest()["first_transaction_date"]
+        return pd.Timestamp(first_date) if first_date else None
+
+    def read_transactions(self, columns: list, start: pd.Timestamp = None, end: pd.Timestamp = None) -> pd.DataFrame:
+        """
+        Reads columns of the transactions with start <= TRANSACTION_DATE < end from the month partitions.
+        """
+        months = [month for month in self.months()
+                  if (start is None or month >= start.strftime("%Y%m")) and (end is None or month <= end.strftime("%Y%m"))]
+        read_columns = list(dict.fromkeys(columns + ['TRANSACTION_DATE']))
+        tables = [pq.read_table(self._month_path(month), columns=read_columns) for month in months]
+        if not tables:
+            return pa.schema([(name, COLUMN_TYPES[name]) for name in read_columns]).empty_table().to_pandas()[columns]
+
+        transactions = pa.concat_tables(tables).to_pandas()
+        if start is not None:
+            transactions = transactions[transactions['TRANSACTION_DATE'] >= start]
+        if end is not None:
+            transactions = transactions[transactions['TRANSACTION_DATE'] < end]
+
+        return transactions[columns].reset_index(drop=True)
+
+    def rfm_transactions(self) -> pd.DataFrame:
+        """
+        Transactions in the format of the RFM engine (RFMEngine.read_extract): joined to CUSTOMER_STG and to
+        the program of the customer in DIM_PROGRAM, like 1-RFM.sql.
+        """
+        transactions = self.read_transactions(['CUSTOMER_ID', 'TRX_STATE_ID', 'TIMED_ID_TRANSACTION', 'TRANSACTION_DATE',
+                                               'TRANSACTION_ID', 'AMOUNT_AFTER_DISCOUNT', 'AMOUNT_EARNED_POINT',
+                                               'AMOUNT_USED_POINT'])
+        customers = pd.read_parquet(self.customers_path, columns=['CUSTOMER_ID', 'UNIQUE_CUSTOMER_ID', 'PROGRAM_ID'])
+        programs = pd.read_parquet(self.programs_path)
+
+        customers = customers.merge(programs, on='PROGRAM_ID', how='inner').drop(columns='PROGRAM_ID')
+        transactions = transactions.merge(customers, on='CUSTOMER_ID', how='inner', sort=False)
+
+        return transactions[['UNIQUE_CUSTOMER_ID', 'PROGRAM_NAME', 'TRX_STATE_ID', 'TIMED_ID_TRANSACTION',
+                             'TRANSACTION_DATE', 'TRANSACTION_ID', 'AMOUNT_AFTER_DISCOUNT', 'AMOUNT_EARNED_POINT',
+                             'AMOUNT_USED_POINT']]
+
+    def churn_transactions(self, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+        """
+        Transactions of start <= TRANSACTION_DATE < end in the format of the churn feature store: the active
+        customers of CUSTOMER_STG and the program of the transaction, like V1.sql and V3.sql.
+        """
+        transactions = self.read_transactions(['CUSTOMER_ID', 'PROGRAM_ID', 'TRANSACTION_DATE', 'AMOUNT_AFTER_DISCOUNT',
+                                               'AMOUNT_DISCOUNT', 'AMOUNT_USED_POINT', 'AMOUNT_EARNED_POINT'],
+                                              start, end)
+        customers = pd.read_parquet(self.customers_path, columns=['CUSTOMER_ID', 'UNIQUE_CUSTOMER_ID', 'FIRM_ID', 'IS_DELETED'])
+        programs = pd.read_parquet(self.programs_path)
+
+        customers = customers[customers['IS_DELETED'] == 0].drop(columns='IS_DELETED')
+        transactions = transactions.merge(customers, on='CUSTOMER_ID', how='inner', sort=False)
+        transactions = transactions.merge(programs, on='PROGRAM_ID', how='left', sort=False)
+        transactions = transactions.rename(columns={'PROGRAM_ID': 'DWH_PROGRAM_ID'})
+
+        return transactions[['UNIQUE_CUSTOMER_ID', 'FIRM_ID', 'DWH_PROGRAM_ID', 'PROGRAM_NAME', 'TRANSACTION_DATE',
+                             'AMOUNT_AFTER_DISCOUNT', 'AMOUNT_DISCOUNT', 'AMOUNT_USED_POINT', 'AMOUNT_EARNED_POINT']]
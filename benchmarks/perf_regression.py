@@ -0,0 +1,372 @@
+"""
+Hot functions of the pipeline measured one at a time on a fixed-seed synthetic firm, fully offline.
+
+Every case runs one function on a firm from benchmarks/synthetic_data.py (with a fixed reference date so the
+rows do not change from day to day): GeneralUtils.reduce_mem, SegmentationUtils.RFM_segmentation,
+CLV_segmentation and prep_output, Churn.train_data_prep, and DatabaseManager.insert_data_to_db and
+fetch_data_as_df against an in-memory stand-in of the oracledb connection, so their own row formatting and
+batched fetching is what is measured. Inputs are prepared outside the timed region.
+
+For every case the fastest of --repeat runs is kept, and the peak of the Python heap allocated by the function
+(numpy and pandas buffers included) is measured in a separate run under tracemalloc, so tracing does not slow
+the timed runs.
+
+The checks are the pytest tests of tests/perf/test_hot_functions.py, which compare every case with
+benchmarks/baselines/perf_regression.json. This script records that baseline, together with the reference
+host it ran on and the seconds of a fixed calibration workload there; the tests scale the time limits by the
+calibration seconds of the host they run on.
+
+    python benchmarks/perf_regression.py                       # after an intended change, then commit the baseline
+    python benchmarks/perf_regression.py --customers 50k 200k
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.append(root_dir)
+sys.path.append(current_dir)
+
+from synthetic_data import SyntheticLoyaltyData
+from pipeline_benchmark import parse_scale, scale_label
+
+DEFAULT_BASELINE = os.path.join(current_dir, "baselines", "perf_regression.json")
+REFERENCE_DATE = "2025-06-30"
+
+
+class StandInCursor:
+    """
+    oracledb cursor answering fetches from a list of row tuples and counting the rows of executemany.
+    """
+    arraysize = 100
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.description = [(name,) for name in connection.columns]
+        self.rowcount = 0
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, statement, *args, **kwargs):
+        self._position = 0
+
+    def executemany(self, statement, data):
+        self.rowcount = len(data)
+        self.connection.rows_written += len(data)
+
+    def fetchmany(self, size: int) -> list:
+        rows = self.connection.rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def close(self):
+        pass
+
+
+class StandInConnection:
+    """
+    oracledb connection of the stand-in: fetches return `rows` with the columns `columns`.
+    """
+
+    def __init__(self, rows: list = None, columns: list = None) -> None:
+        self.rows = rows or []
+        self.columns = columns or []
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def cursor(self):
+        return StandInCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def stand_in_database(schema_name: str, connection: StandInConnection):
+    """
+    DatabaseManager whose connections are the stand-in and whose tables have the columns of any inserted frame.
+    """
+    from app.utils.database import DatabaseManager
+
+    db_manager = DatabaseManager(schema_name)
+    db_manager.create_connection = lambda: connection
+    db_manager.get_table_columns = lambda table_name: list(db_manager.insert_columns)
+    db_manager.insert_columns = []
+    return db_manager
+
+
+class Fixtures:
+    """
+    Inputs of the cases, built once per scale and copied for every run.
+    """
+
+    def __init__(self, customers: int, transactions_per_customer: float = 12, programs: int = 20, skew: float = 1.5,
+                 seed: int = 2024, firm_id: int = 1) -> None:
+        self.customers = customers
+        self.firm_id = firm_id
+        self.schema_name = f"PERF_{scale_label(customers).upper()}"
+        self.generator = SyntheticLoyaltyData(customers, transactions_per_customer, programs, skew, seed,
+                                              reference_date=pd.Timestamp(REFERENCE_DATE))
+
+    @cached_property
+    def all_data(self) -> pd.DataFrame:
+        return self.generator.all_data()
+
+    @cached_property
+    def segmentation_input(self) -> pd.DataFrame:
+        from app.segmentation.segment import prepare_segmentation_input
+        from app.utils.general_utils import GeneralUtils
+
+        data = GeneralUtils.reduce_mem(self.all_data.copy())
+        data.columns = data.columns.map(str.lower)
+        return prepare_segmentation_input(data)
+
+    @cached_property
+    def segmentation_utils(self):
+        from app.utils.segmentation_utils import SegmentationUtils
+        return SegmentationUtils(self.firm_id)
+
+    @cached_property
+    def rfm(self) -> pd.DataFrame:
+        return self.segmentation_utils.RFM_segmentation(self.segmentation_input.copy())
+
+    @cached_property
+    def clv(self) -> pd.DataFrame:
+        return self.segmentation_utils.CLV_segmentation(self.rfm.copy())
+
+    @cached_property
+    def out_data(self) -> pd.DataFrame:
+        return self.segmentation_utils.prep_output(self.clv.copy())
+
+    @cached_property
+    def all_data_rows(self) -> list:
+        return list(self.all_data.itertuples(index=False, name=None))
+
+    @cached_property
+    def churn_train_path(self) -> str:
+        train, _ = self.generator.churn_datasets()
+        path = f"data/churn/TR_{self.schema_name}_churn_dataset.parquet"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        train.to_parquet(path, index=False)
+        return path
+
+
+# every case prepares its input from the fixtures and returns the measured call, which returns its row count
+
+def case_reduce_mem(fixtures: Fixtures):
+    from app.utils.general_utils import GeneralUtils
+
+    data = fixtures.all_data.copy()
+    return lambda: len(GeneralUtils.reduce_mem(data))
+
+
+def case_rfm_segmentation(fixtures: Fixtures):
+    data = fixtures.segmentation_input.copy()
+    return lambda: len(fixtures.segmentation_utils.RFM_segmentation(data))
+
+
+def case_clv_segmentation(fixtures: Fixtures):
+    data = fixtures.rfm.copy()
+    return lambda: len(fixtures.segmentation_utils.CLV_segmentation(data))
+
+
+def case_prep_output(fixtures: Fixtures):
+    data = fixtures.clv.copy()
+    return lambda: len(fixtures.segmentation_utils.prep_output(data))
+
+
+def case_train_data_prep(fixtures: Fixtures):
+    from app.churn.modelling import Churn
+
+    fixtures.churn_train_path
+    churn = Churn(fixtures.firm_id, fixtures.schema_name)
+
+    def run():
+        X_train, X_val, _, _ = churn.train_data_prep()
+        return len(X_train) + len(X_val)
+    return run
+
+
+def case_insert_data_to_db(fixtures: Fixtures):
+    connection = StandInConnection()
+    db_manager = stand_in_database(f"{fixtures.schema_name}_ELT", connection)
+    data = fixtures.out_data
+    db_manager.insert_columns = list(data.columns)
+
+    def run():
+        db_manager.insert_data_to_db(data, "ANALYTIC_CUSTOMER")
+        return connection.rows_written
+    return run
+
+
+def case_fetch_data_as_df(fixtures: Fixtures):
+    connection = StandInConnection(fixtures.all_data_rows, list(fixtures.all_data.columns))
+    db_manager = stand_in_database(f"{fixtures.schema_name}_ELT", connection)
+    return lambda: len(db_manager.fetch_data_as_df(f"SELECT * FROM {fixtures.schema_name}_ELT.ANALYTIC_ALL_DATA"))
+
+
+CASES = {
+    'reduce_mem': case_reduce_mem,
+    'RFM_segmentation': case_rfm_segmentation,
+    'CLV_segmentation': case_clv_segmentation,
+    'prep_output': case_prep_output,
+    'train_data_prep': case_train_data_prep,
+    'insert_data_to_db': case_insert_data_to_db,
+    'fetch_data_as_df': case_fetch_data_as_df,
+}
+
+
+def measure(case, fixtures: Fixtures, repeat: int) -> dict:
+    seconds = []
+    for _ in range(repeat):
+        run = case(fixtures)
+        gc.collect()
+        start = time.perf_counter()
+        rows = run()
+        seconds.append(time.perf_counter() - start)
+
+    # the input of the traced run is allocated before tracing starts, only the function's own memory is traced
+    run = case(fixtures)
+    gc.collect()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'seconds': round(min(seconds), 4), 'peak_mb': round(peak / 2 ** 20, 2), 'rows': rows}
+
+
+def calibrate(repeat: int = 5) -> float:
+    """
+    Returns:
+        float: Fastest seconds of a fixed sort, groupby and row iteration workload, the speed of the host.
+    """
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame({'key': rng.integers(0, 1_000, 2_000_000), 'value': rng.random(2_000_000)})
+    seconds = []
+    # the first run is a warm-up of the allocator and the pandas code paths
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        data.sort_values('value').groupby('key')['value'].agg(['sum', 'std', 'median'])
+        sum(value for _, value in data.head(200_000).itertuples(index=False, name=None))
+        seconds.append(time.perf_counter() - start)
+    return round(min(seconds[1:]), 4)
+
+
+def load_baseline(path: str = DEFAULT_BASELINE) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="UTF-8") as f:
+        return json.load(f)
+
+
+def limits(reference: dict, host_factor: float, time_tolerance: float, memory_tolerance: float,
+           min_seconds: float, min_mb: float) -> tuple:
+    """
+    Time and memory limits of a case from its baseline.
+
+    Args:
+        reference (dict): Baseline seconds and peak_mb of the case.
+        host_factor (float): Calibration seconds of this host over those of the reference host, at least 1.
+        time_tolerance (float): Allowed fraction over the baseline seconds.
+        memory_tolerance (float): Allowed fraction over the baseline peak.
+        min_seconds (float): Absolute time slack, for the fast cases.
+        min_mb (float): Absolute memory slack, for the small cases.
+
+    Returns:
+        tuple: Seconds and MB limits.
+    """
+    # a faster host keeps the limits of the reference host, calibration noise does not tighten them
+    time_limit = reference['seconds'] * max(host_factor, 1.0) * (1 + time_tolerance) + min_seconds
+    memory_limit = reference['peak_mb'] * (1 + memory_tolerance) + min_mb
+    return time_limit, memory_limit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=parse_scale, nargs='+', default=[50_000])
+    parser.add_argument('--transactions-per-customer', type=float, default=12)
+    parser.add_argument('--programs', type=int, default=20)
+    parser.add_argument('--skew', type=float, default=1.5)
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--firm-id', type=int, default=1)
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workdir', default=None, help='directory of the data/ folder, a temporary one by default')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    # the stand-in statements are not recorded in the SQL statistics of the host
+    os.environ['SQL_STATS'] = 'false'
+    baseline_path = os.path.abspath(args.baseline)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="crm_perf_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    print(f"working directory {workdir}")
+
+    data = {'transactions_per_customer': args.transactions_per_customer, 'programs': args.programs,
+            'skew': args.skew, 'seed': args.seed, 'firm_id': args.firm_id}
+    baseline = load_baseline(baseline_path)
+    if baseline.get('_meta', {}).get('data', data) != data:
+        # the rows of the other scales were recorded on other data, they are not kept
+        baseline = {}
+
+    calibration_seconds = calibrate()
+    for customers in args.customers:
+        label = scale_label(customers)
+        fixtures = Fixtures(customers, **data)
+        for name in args.cases:
+            result = measure(CASES[name], fixtures, args.repeat)
+            baseline.setdefault(label, {})[name] = result
+            print(f"{label:>4} {name:<18} {result['seconds']:8.3f}s {result['peak_mb']:8.1f} MB {result['rows']:>10,} rows")
+
+    baseline['_meta'] = {
+        'updated_at': datetime.now().isoformat(timespec='seconds'),
+        'data': data,
+        'repeat': args.repeat,
+        # reference host: the tests scale the time limits by their calibration seconds over these
+        'calibration_seconds': calibration_seconds,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+    os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+    tmp_path = f"{baseline_path}.tmp"
+    with open(tmp_path, "w", encoding="UTF-8") as f:
+        json.dump(baseline, f, indent=2)
+    os.replace(tmp_path, baseline_path)
+    print(f"baseline written to {baseline_path} (calibration {calibration_seconds:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Times the Segmentation_Runner, Churn and SmartInsight stages end to end on synthetic firms.
+
+For every scale a firm is generated with benchmarks/synthetic_data.py (not timed), its ANALYTIC_ALL_DATA and
+churn TR/PR datasets are written where the stages read them, and the stages run in the order of app/main.py
+against an in-memory stand-in of the database that counts the inserted rows. For every stage the wall time,
+the throughput in customers per second, the peak RSS of the process while the stage ran (sampled from
+/proc/self/statm) and the rows written are recorded. --tracemalloc adds the peak of the Python heap (numpy and
+pandas buffers included), but slows allocation-heavy stages down several times, so its timings are only
+compared with baselines recorded with --tracemalloc as well. --memory-profile writes the per-stage memory report
+of app/utils/memory_profiler.py (timings are then slowed down the same way).
+
+Results are compared with a baseline JSON: a stage is reported as a regression when it is more than
+--tolerance slower, or writes a different number of rows (the data is seeded, so the output is fixed).
+
+    python benchmarks/pipeline_benchmark.py --customers 100k 1m
+    python benchmarks/pipeline_benchmark.py --customers 100k --save-baseline
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.append(root_dir)
+sys.path.append(current_dir)
+
+from synthetic_data import SyntheticLoyaltyData
+from app.utils.memory_profiler import MemoryProfiler, RSSSampler, memory_stage
+
+DEFAULT_BASELINE = os.path.join(current_dir, "baselines", "pipeline_benchmark.json")
+STAGES = ['segmentation', 'churn', 'smart_insight']
+
+
+def parse_scale(value: str) -> int:
+    """
+    Customer count with an optional k/m suffix, e.g. 100k or 10m.
+    """
+    value = value.lower().replace('_', '')
+    factor = {'k': 1_000, 'm': 1_000_000}.get(value[-1], 1)
+    return int(float(value.rstrip('km')) * factor)
+
+
+def scale_label(customers: int) -> str:
+    if customers >= 1_000_000 and customers % 1_000_000 == 0:
+        return f"{customers // 1_000_000}m"
+    if customers >= 1_000 and customers % 1_000 == 0:
+        return f"{customers // 1_000}k"
+    return str(customers)
+
+
+def install_benchmark_database(inserted: dict) -> None:
+    """
+    Replaces the DatabaseManager of the benchmarked modules with a stand-in that keeps the inserted row
+    counts in `inserted` and answers the DEF_FIRM_METRICS query of SmartInsight.
+    """
+    import app.churn.modelling as modelling
+    import app.segmentation.segment as segment
+    import app.utils.smart_insight_utils as smart_insight_utils
+    from app.utils.database import DatabaseManager
+
+    class BenchmarkDatabase(DatabaseManager):
+
+        def insert_data_to_db(self, df: pd.DataFrame, table_name: str, batch_size: int = 1000):
+            inserted[table_name] = inserted.get(table_name, 0) + len(df)
+
+        def fetch_data_as_df(self, query: str, batch_size: int = 10000, template: str = None) -> pd.DataFrame:
+            if 'DEF_FIRM_METRICS' in query:
+                names = ['TOTAL_CUSTOMERS', 'LAST_YEAR_CUSTOMER_COUNT', 'RETENTION_RATIO', 'VIP_CUSTOMER_PCT', 'SMART_INSIGHT']
+                return pd.DataFrame({'DEFINITION_NAME': names, 'DEFINITION_NO': [f"P{i}" for i in range(1, len(names) + 1)]})
+            raise RuntimeError(f"The benchmark database does not answer queries: {query[:80]}")
+
+        def log_to_db(self, *args, **kwargs):
+            pass
+
+    for module in (segment, modelling, smart_insight_utils):
+        module.DatabaseManager = BenchmarkDatabase
+
+
+def run_stage(name: str, func, customers: int, inserted: dict, trace: bool) -> dict:
+    before = dict(inserted)
+    # with --memory-profile the profiler is already tracing
+    started_tracing = trace and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if trace:
+        tracemalloc.reset_peak()
+
+    with RSSSampler() as sampler, memory_stage(name):
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+
+    peak_mb = None
+    if trace:
+        peak_mb = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+    if started_tracing:
+        tracemalloc.stop()
+
+    rows_written = {table: rows - before.get(table, 0) for table, rows in inserted.items() if rows != before.get(table, 0)}
+    result = {
+        'seconds': round(seconds, 3),
+        'customers_per_second': round(customers / seconds, 1) if seconds else None,
+        'peak_rss_mb': round(sampler.peak / 2 ** 20, 1),
+        'tracemalloc_peak_mb': peak_mb,
+        'rows_written': rows_written
+    }
+    print(f"  {name:<14} {seconds:9.2f}s {result['customers_per_second'] or 0:>12,.0f} customers/s "
+          f"peak RSS {result['peak_rss_mb']:>8} MB  heap {peak_mb if peak_mb is not None else '-':>8} MB  rows {rows_written}")
+    return result
+
+
+def benchmark_scale(args, customers: int, inserted: dict) -> dict:
+    from app.churn.modelling import Churn
+    from app.churn.registry import ModelRegistry
+    from app.segmentation.segment import Segmentation_Runner
+    from app.utils.smart_insight_utils import SmartInsight
+
+    label = scale_label(customers)
+    schema = f"BENCH_{label.upper()}"
+    generator = SyntheticLoyaltyData(customers, args.transactions_per_customer, args.programs, args.skew, args.seed)
+
+    start = time.perf_counter()
+    os.makedirs("data/churn", exist_ok=True)
+    generator.all_data().to_parquet(f"data/{schema}_all_data.parquet", index=False)
+    train, predict = generator.churn_datasets(args.churn_threshold)
+    train.to_parquet(f"data/churn/TR_{schema}_churn_dataset.parquet", index=False)
+    predict.to_parquet(f"data/churn/PR_{schema}_churn_dataset.parquet", index=False)
+    print(f"{label}: {customers:,} customers, {generator.n_transactions:,} transactions, "
+          f"{len(train):,}/{len(predict):,} churn TR/PR rows, generated in {time.perf_counter() - start:.1f}s")
+    del train, predict
+
+    def churn():
+        job = Churn(args.firm_id, schema)
+        # a fresh registry, so every run trains instead of reusing the model of the previous one
+        shutil.rmtree(os.path.join("models", schema), ignore_errors=True)
+        job.registry = ModelRegistry(schema, model_dir=os.path.join("models", schema),
+                                     keep_versions=job.parameters.registry_keep_versions)
+        job.run()
+
+    stages = {
+        'segmentation': lambda: Segmentation_Runner(FIRM_ID=args.firm_id, SCHEMA_NAME=f"{schema}_ELT").run(),
+        'churn': churn,
+        'smart_insight': lambda: SmartInsight(firm_id=args.firm_id, firm_name=schema, schema_name=f"{schema}_ELT").run(),
+    }
+
+    with MemoryProfiler(args.firm_id, schema, enabled=args.memory_profile) as profiler:
+        results = {name: run_stage(name, stages[name], customers, inserted, args.tracemalloc)
+                   for name in STAGES if name in args.stages}
+    if profiler.report is not None:
+        for stage in profiler.report['regressions']:
+            print(f"  memory regression {stage['stage']}: {stage['previous_rss_growth_mb']} MB -> {stage['rss_growth_mb']} MB")
+        print(f"  memory report in {profiler.report_dir}")
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns:
+        list: Messages of the stages slower than the baseline by more than tolerance or with other row counts.
+    """
+    regressions = []
+    for label, stages in results.items():
+        for stage, result in stages.items():
+            # the stages log and swallow their errors, a stage that failed wrote nothing
+            if not result['rows_written']:
+                regressions.append(f"{label} {stage}: no rows written, the stage failed")
+            reference = baseline.get(label, {}).get(stage)
+            if reference is None:
+                continue
+            if (reference['tracemalloc_peak_mb'] is None) != (result['tracemalloc_peak_mb'] is None):
+                print(f"  {label:>4} {stage:<14} timings not compared, the baseline was recorded "
+                      f"{'with' if reference['tracemalloc_peak_mb'] is not None else 'without'} --tracemalloc")
+                continue
+            ratio = result['seconds'] / reference['seconds'] if reference['seconds'] else 1.0
+            print(f"  {label:>4} {stage:<14} {reference['seconds']:9.2f}s -> {result['seconds']:9.2f}s ({ratio:5.2f}x)")
+            if ratio > 1 + tolerance:
+                regressions.append(f"{label} {stage}: {ratio:.2f}x the baseline time")
+            if result['rows_written'] != reference['rows_written']:
+                regressions.append(f"{label} {stage}: rows written {result['rows_written']} != {reference['rows_written']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=parse_scale, nargs='+', default=[100_000])
+    parser.add_argument('--transactions-per-customer', type=float, default=12)
+    parser.add_argument('--programs', type=int, default=20)
+    parser.add_argument('--skew', type=float, default=1.5)
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--churn-threshold', type=int, default=180)
+    parser.add_argument('--firm-id', type=int, default=1)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--workdir', default=None, help='directory of the data/ and models/ folders, a temporary one by default')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--tracemalloc', action='store_true')
+    parser.add_argument('--memory-profile', action='store_true', help='write the per-stage memory report of app/utils/memory_profiler.py')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    # SmartInsight aggregates the segmentation output of the same process, there is no ANALYTIC_CUSTOMER to query
+    os.environ['INSIGHT_METRICS_SOURCE'] = 'memory'
+    baseline_path = os.path.abspath(args.baseline)
+
+    inserted = {}
+    install_benchmark_database(inserted)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="crm_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    print(f"working directory {workdir}")
+
+    results = {scale_label(customers): benchmark_scale(args, customers, inserted) for customers in args.customers}
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path, "r", encoding="UTF-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        baseline['_meta'] = {'updated_at': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                             'machine': platform.machine(), 'cpus': os.cpu_count()}
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="UTF-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"baseline written to {baseline_path}")
+        return
+
+    if not os.path.exists(baseline_path):
+        print(f"no baseline at {baseline_path}, run with --save-baseline to create it")
+        return
+
+    with open(baseline_path, "r", encoding="UTF-8") as f:
+        baseline = json.load(f)
+    print(f"compared with {baseline_path}:")
+    regressions = compare(results, baseline, args.tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Validates the NumPy RFM engine against 1-RFM.sql column by column.
+
+Without arguments the engine runs on synthetic transactions and is compared with a
+pandas transliteration of 1-RFM.sql. With --schema it is compared with the RFM_STG rows produced by
+the database, on the shared transaction extract of the schema or on a Parquet extract given with --extract.
+
+    python benchmarks/rfm_engine_validation.py --transactions 1000000
+    python benchmarks/rfm_engine_validation.py --schema FIRM_CDP
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.append(root_dir)
+
+from app.segmentation.rfm_engine import RFMEngine, RFM_COLUMNS
+
+
+def synthetic_transactions(n_transactions: int, n_customers: int, seed: int = 2024) -> pd.DataFrame:
+    """
+    Generates a transaction extract with returns, missing values and point usage.
+    """
+    rng = np.random.default_rng(seed)
+    today = pd.Timestamp.today().normalize()
+
+    transaction_dates = today - pd.to_timedelta(rng.integers(0, 730 * 24 * 60, n_transactions), unit='min')
+    amount = np.round(rng.lognormal(4, 1, n_transactions), 2)
+    state = np.where(rng.random(n_transactions) < 0.08, 3, 1)
+
+    df = pd.DataFrame({
+        'UNIQUE_CUSTOMER_ID': rng.integers(0, n_customers, n_transactions),
+        'PROGRAM_NAME': rng.choice(['GOLD', 'SILVER', 'BRONZE', None], n_transactions, p=[0.2, 0.3, 0.45, 0.05]),
+        'TRX_STATE_ID': state,
+        'TIMED_ID_TRANSACTION': transaction_dates.strftime('%Y%m%d').astype(np.int64),
+        'TRANSACTION_DATE': transaction_dates,
+        'TRANSACTION_ID': np.arange(n_transactions),
+        'AMOUNT_AFTER_DISCOUNT': np.where(state == 3, -amount, amount),
+        'AMOUNT_EARNED_POINT': np.where(rng.random(n_transactions) < 0.5, np.round(amount * 0.02, 2), 0.0),
+        'AMOUNT_USED_POINT': np.where(rng.random(n_transactions) < 0.1, np.round(amount * 0.1, 2), np.nan),
+    })
+    df.loc[rng.random(n_transactions) < 0.01, 'AMOUNT_AFTER_DISCOUNT'] = np.nan
+    df.loc[rng.random(n_transactions) < 0.01, 'AMOUNT_EARNED_POINT'] = np.nan
+
+    return df
+
+
+def sql_reference(transactions: pd.DataFrame, reference_date: pd.Timestamp, min_monetary: float = 15) -> pd.DataFrame:
+    """
+    Row-by-row transliteration of the SELECT in 1-RFM.sql with pandas group-by semantics.
+    """
+    df = transactions.copy()
+    sale = df['TRX_STATE_ID'] == 1
+    ret = df['TRX_STATE_ID'] == 3
+    day = df['TRANSACTION_DATE'].dt.normalize()
+    timed_id = np.trunc(df['TIMED_ID_TRANSACTION'].astype(float))
+
+    df['SALE_TIMED_ID'] = timed_id.where(sale)
+    df['RETURN_TIMED_ID'] = timed_id.where(ret)
+    df['DAY'] = day
+    df['SALE_DAY'] = day.where(sale)
+    df['RETURN_DAY'] = day.where(ret)
+    df['SALE_ID'] = df['TRANSACTION_ID'].where(sale)
+    df['RETURN_ID'] = df['TRANSACTION_ID'].where(ret)
+    df['SALE_AMOUNT'] = df['AMOUNT_AFTER_DISCOUNT'].where(sale)
+    df['RETURN_AMOUNT'] = df['AMOUNT_AFTER_DISCOUNT'].where(ret)
+    df['EARNED'] = df['AMOUNT_EARNED_POINT'].fillna(0)
+    df['USED'] = df['AMOUNT_USED_POINT'].fillna(0)
+    df['EARNED_TRX'] = (df['AMOUNT_EARNED_POINT'] > 0).astype(int)
+    df['USED_TRX'] = (df['AMOUNT_USED_POINT'] > 0).astype(int)
+
+    g = df.groupby(['UNIQUE_CUSTOMER_ID', 'PROGRAM_NAME'], dropna=False)
+    out = g.agg(
+        SON_ALV_TARIH=('SALE_TIMED_ID', 'max'),
+        SON_IADE_TARIH=('RETURN_TIMED_ID', 'max'),
+        LAST_DAY=('DAY', 'max'),
+        LAST_SALE_DAY=('SALE_DAY', 'max'),
+        LAST_RETURN_DAY=('RETURN_DAY', 'max'),
+        FREQUENCY=('TRANSACTION_ID', 'count'),
+        FREQUENCY_GECERLI=('SALE_ID', 'count'),
+        FREQUENCY_IADE=('RETURN_ID', 'count'),
+        MONETARY=('AMOUNT_AFTER_DISCOUNT', lambda s: s.sum(min_count=1)),
+        MONETARY_GECERLI=('SALE_AMOUNT', lambda s: s.sum(min_count=1)),
+        MONETARY_IADE=('RETURN_AMOUNT', lambda s: s.sum(min_count=1)),
+        KAZANILAN_TUTAR=('EARNED', 'sum'),
+        HARCANAN_TUTAR=('USED', 'sum'),
+        KAZANILAN_TRX_CNT=('EARNED_TRX', 'sum'),
+        HARCANILAN_TRX_CNT=('USED_TRX', 'sum'),
+    ).reset_index().rename(columns={'PROGRAM_NAME': 'KART_TIP_DETAY'})
+
+    out['RECENCY'] = (reference_date - out['LAST_DAY']).dt.days
+    out['RECENCY_GECERLI'] = (reference_date - out['LAST_SALE_DAY']).dt.days
+    out['RECENCY_IADE'] = (reference_date - out['LAST_RETURN_DAY']).dt.days
+    out['SON_ISLEM_IADE'] = (out['RECENCY_IADE'] <= out['RECENCY_GECERLI']).astype(int)
+    out['IADE_ORANI'] = RFMEngine.oracle_round(out['FREQUENCY_IADE'] / out['FREQUENCY'].replace(0, np.nan), 4)
+    out['IADE_CIRO_ORANI'] = (out['MONETARY_IADE'] * -1) / out['MONETARY_GECERLI'].replace(0, np.nan)
+    ratio = (out['HARCANAN_TUTAR'] / out['KAZANILAN_TUTAR'].replace(0, np.nan)).fillna(0)
+    out['KAZANILAN_HARCANAN_TUTAR_ORAN'] = RFMEngine.oracle_round(ratio, 4)
+
+    return out[out['MONETARY'] > min_monetary][RFM_COLUMNS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transactions', type=int, default=1_000_000)
+    parser.add_argument('--customers', type=int, default=100_000)
+    parser.add_argument('--schema', help="CDP schema whose RFM_STG is compared with the engine")
+    parser.add_argument('--extract', help="Parquet transaction extract of the schema (default: its shared extract)")
+    args = parser.parse_args()
+
+    engine = RFMEngine()
+
+    if args.schema:
+        from app.utils.database import DatabaseManager
+        from app.utils.transaction_extract import TransactionExtract
+
+        db_manager = DatabaseManager(args.schema)
+        if args.extract:
+            transactions = RFMEngine.read_extract(args.extract)
+        else:
+            extract = TransactionExtract(args.schema)
+            extract.refresh(db_manager)
+            transactions = extract.rfm_transactions()
+        reference = db_manager.fetch_data_as_df(f"SELECT * FROM {args.schema}_ELT.RFM_STG")
+    else:
+        transactions = synthetic_transactions(args.transactions, args.customers)
+        reference = sql_reference(transactions, engine.reference_date)
+
+    start = time.perf_counter()
+    result = engine.compute(transactions)
+    elapsed = time.perf_counter() - start
+
+    print(f"Engine: {len(transactions):,} transactions -> {len(result):,} rows in {elapsed:.2f}s "
+          f"({len(transactions) / elapsed:,.0f} transactions/s)")
+
+    report = RFMEngine.compare(result, reference)
+    print(report.to_string(index=False))
+
+    if report['MISMATCHES'].sum() > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
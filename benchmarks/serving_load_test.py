@@ -0,0 +1,122 @@
+"""
+Load test of the local churn scoring service (app/churn/serving.py).
+
+Sends scoring requests of --batch-size records from --concurrency keep-alive connections for
+--duration seconds and reports the latency percentiles and the throughput. Records are sampled from the
+firm's prediction dataset, or generated when it does not exist.
+
+    python app/churn/serving.py --port 8765 &
+    python benchmarks/serving_load_test.py --schema FIRM_CDP --concurrency 16 --batch-size 1
+    python benchmarks/serving_load_test.py --schema FIRM_CDP --socket /tmp/churn.sock --batch-size 50
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.append(root_dir)
+
+from app.config import ChurnConfig
+from churn_outliers import synthetic_churn_dataset
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path: str, timeout: float = 30.0) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def load_records(schema_name: str, n_records: int = 10_000) -> list:
+    features = [col for col in ChurnConfig().model_features if col != 'IS_CHURN']
+    path = os.path.join("data", "churn", f"PR_{schema_name}_churn_dataset.parquet")
+    if os.path.exists(path):
+        data = pd.read_parquet(path, columns=['UNIQUE_CUSTOMER_ID'] + features)
+        data = data.sample(min(n_records, len(data)), random_state=2024)
+    else:
+        print(f"{path} not found, using synthetic records")
+        data = synthetic_churn_dataset(n_records, 50)[['UNIQUE_CUSTOMER_ID'] + features]
+
+    data = data.astype(object).where(data.notna(), None)
+    return json.loads(data.to_json(orient='records'))
+
+
+def worker(args, records: list, deadline: float, latencies: list, errors: list) -> None:
+    if args.socket:
+        connection = UnixHTTPConnection(args.socket)
+    else:
+        connection = http.client.HTTPConnection(args.host, args.port, timeout=30)
+    rng = np.random.default_rng(threading.get_ident() % 2**32)
+    headers = {"Content-Type": "application/json"}
+
+    while time.perf_counter() < deadline:
+        start = rng.integers(0, max(1, len(records) - args.batch_size))
+        body = json.dumps({"records": records[start:start + args.batch_size]}).encode("UTF-8")
+        sent = time.perf_counter()
+        try:
+            connection.request("POST", f"/score/{args.schema}", body=body, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+            if response.status != 200:
+                errors.append(f"{response.status}: {payload[:200]}")
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection.close()
+            continue
+        latencies.append(time.perf_counter() - sent)
+
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schema', required=True)
+    parser.add_argument('--host', default=ChurnConfig().serving_host)
+    parser.add_argument('--port', type=int, default=ChurnConfig().serving_port)
+    parser.add_argument('--socket', default=None)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=20.0)
+    args = parser.parse_args()
+
+    records = load_records(args.schema)
+    latencies, errors = [], []
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=worker, args=(args, records, deadline, latencies, errors))
+               for _ in range(args.concurrency)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.concurrency} connections, {args.batch_size} records per request, {elapsed:.1f}s")
+    print(f"requests: {len(latencies):,} ok, {len(errors):,} failed")
+    if errors:
+        print(f"first error: {errors[0]}")
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        print(f"latency ms: p50 {p50:.1f}, p95 {p95:.1f}, p99 {p99:.1f}, max {max(latencies) * 1000:.1f}")
+        print(f"throughput: {len(latencies) / elapsed:,.0f} requests/s, "
+              f"{len(latencies) * args.batch_size / elapsed:,.0f} records/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Generates loyalty program data of a synthetic firm offline.
+
+The source tables (TRANSACTION_MAIN, CUSTOMER_STG and DIM_PROGRAM) are generated in the column layout of
+db_queries/extract/, and the derived ANALYTIC_ALL_DATA and churn TR/PR datasets are computed from the generated
+transactions with the RFM engine and the churn feature store aggregates. Transactions are produced in chunks of
+customers, so the derived datasets of 10M customers are built without holding all transactions in memory.
+
+Program sizes and transactions per customer follow Pareto tails with shape --skew (lower is more skewed).
+
+    python benchmarks/synthetic_data.py --customers 1000000 --out data/synthetic
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.append(root_dir)
+
+from app.churn.feature_store import ChurnFeatureStore, KEYS
+from app.segmentation.rfm_engine import RFMEngine
+
+
+class SyntheticLoyaltyData:
+    """
+    Synthetic firm with a fixed seed: the same arguments always generate the same rows.
+
+    Usage:
+        generator = SyntheticLoyaltyData(customers=100_000, transactions_per_customer=12)
+        all_data = generator.all_data()
+        train, predict = generator.churn_datasets(churn_threshold=180)
+    """
+
+    def __init__(self, customers: int, transactions_per_customer: float = 12, programs: int = 20, skew: float = 1.5,
+                 seed: int = 2024, history_days: int = 730, firm_id: int = 1, chunk_customers: int = 250_000,
+                 reference_date: pd.Timestamp = None) -> None:
+        """
+        Args:
+            customers (int): Number of customers.
+            transactions_per_customer (float): Mean transactions per customer over the history.
+            programs (int): Number of loyalty programs in DIM_PROGRAM.
+            skew (float): Pareto shape of the program sizes and transactions per customer, lower is more skewed.
+            seed (int): Seed of all random draws.
+            history_days (int): Days of transaction history before the reference date.
+            firm_id (int): FIRM_ID of the customers.
+            chunk_customers (int): Customers per generated transaction chunk.
+            reference_date (pd.Timestamp): Day after the last transaction. Defaults to today.
+        """
+        self.n_customers = customers
+        self.n_programs = programs
+        self.seed = seed
+        self.history_days = history_days
+        self.firm_id = firm_id
+        self.chunk_customers = chunk_customers
+        self.reference_date = pd.Timestamp(reference_date or pd.Timestamp.today()).normalize()
+
+        rng = np.random.default_rng([seed, 0])
+        program_weights = rng.pareto(skew, programs) + 0.01
+        self.customer_program = rng.choice(np.arange(1, programs + 1), customers,
+                                           p=program_weights / program_weights.sum()).astype(np.int32)
+
+        # Lomax tail scaled to the requested mean (the mean is infinite for skew <= 1, so the tail is capped)
+        scale = (transactions_per_customer - 1) * (skew - 1) if skew > 1 else transactions_per_customer - 1
+        counts = 1 + np.floor(rng.pareto(skew, customers) * scale)
+        self.transaction_counts = np.minimum(counts, 50 * transactions_per_customer).astype(np.int64)
+
+        # first purchase day and the day the customer stops buying (about a third churns before the reference date)
+        self.first_day = rng.integers(0, history_days, customers)
+        lifetime = history_days - self.first_day
+        churned = rng.random(customers) < 0.35
+        self.last_day = np.where(churned, self.first_day + (rng.random(customers) * lifetime * 0.8).astype(np.int64),
+                                 history_days - 1)
+        self.basket_mean = rng.lognormal(4, 0.6, customers)
+        self.discount_share = rng.beta(1, 4, customers)
+
+    @property
+    def n_transactions(self) -> int:
+        return int(self.transaction_counts.sum())
+
+    def programs(self) -> pd.DataFrame:
+        """
+        DIM_PROGRAM rows of db_queries/extract/programs.sql.
+        """
+        return pd.DataFrame({
+            'PROGRAM_ID': np.arange(1, self.n_programs + 1, dtype=np.int32),
+            'PROGRAM_NAME': [f"PROGRAM_{program_id}" for program_id in range(1, self.n_programs + 1)]
+        })
+
+    def customers(self) -> pd.DataFrame:
+        """
+        CUSTOMER_STG rows of db_queries/extract/customers.sql, one CUSTOMER_ID per UNIQUE_CUSTOMER_ID.
+        """
+        rng = np.random.default_rng([self.seed, 1])
+        customer_ids = np.arange(1, self.n_customers + 1, dtype=np.int64)
+        return pd.DataFrame({
+            'CUSTOMER_ID': customer_ids,
+            'UNIQUE_CUSTOMER_ID': customer_ids,
+            'FIRM_ID': self.firm_id,
+            'PROGRAM_ID': self.customer_program,
+            'IS_DELETED': (rng.random(self.n_customers) < 0.005).astype(np.int8)
+        })
+
+    def chunks(self):
+        """
+        Yields (first, last) customer positions of the transaction chunks.
+        """
+        for first in range(0, self.n_customers, self.chunk_customers):
+            yield first, min(first + self.chunk_customers, self.n_customers)
+
+    def transactions(self, first: int, last: int) -> pd.DataFrame:
+        """
+        TRANSACTION_MAIN rows of db_queries/extract/transactions.sql for the customers at positions [first, last).
+        About 8% are returns (TRX_STATE_ID 3), 1% have no amount.
+        """
+        rng = np.random.default_rng([self.seed, 2, first])
+        counts = self.transaction_counts[first:last]
+        customer = np.repeat(np.arange(first, last), counts)
+        n = len(customer)
+
+        span = self.last_day[customer] - self.first_day[customer] + 1
+        day = self.first_day[customer] + (rng.random(n) * span).astype(np.int64)
+        # the first transaction of a customer is on its first purchase day
+        starts = np.r_[0, np.cumsum(counts)[:-1]]
+        day[starts] = self.first_day[first:last]
+
+        start_date = self.reference_date - pd.Timedelta(days=self.history_days)
+        transaction_date = (start_date.to_datetime64() + day.astype('timedelta64[D]')
+                            + rng.integers(8 * 3600, 23 * 3600, n).astype('timedelta64[s]'))
+
+        amount = np.round(self.basket_mean[customer] * rng.lognormal(0, 0.5, n), 2)
+        state = np.where(rng.random(n) < 0.08, 3, 1).astype(np.int8)
+        discounted = rng.random(n) < self.discount_share[customer]
+        discount = np.where(discounted, np.round(amount * rng.uniform(0.05, 0.3, n), 2), 0.0)
+
+        transactions = pd.DataFrame({
+            'CUSTOMER_ID': customer.astype(np.int64) + 1,
+            'PROGRAM_ID': self.customer_program[customer],
+            'TRX_STATE_ID': state,
+            'TRANSACTION_ID': np.arange(n, dtype=np.int64) + int(self.transaction_counts[:first].sum()),
+            'TRANSACTION_DATE': transaction_date.astype('datetime64[ns]'),
+            'TIMED_ID_TRANSACTION': pd.DatetimeIndex(transaction_date).strftime('%Y%m%d').astype(np.float64),
+            'AMOUNT_AFTER_DISCOUNT': np.where(state == 3, -amount, amount),
+            'AMOUNT_DISCOUNT': discount,
+            'AMOUNT_EARNED_POINT': np.where(rng.random(n) < 0.5, np.round(amount * 0.02, 2), 0.0),
+            'AMOUNT_USED_POINT': np.where(rng.random(n) < 0.1, np.round(amount * 0.1, 2), np.nan),
+        })
+        transactions.loc[rng.random(n) < 0.01, 'AMOUNT_AFTER_DISCOUNT'] = np.nan
+
+        return transactions
+
+    def _joined(self, transactions: pd.DataFrame, customers: pd.DataFrame, programs: pd.DataFrame) -> pd.DataFrame:
+        """
+        Transactions joined to CUSTOMER_STG and DIM_PROGRAM, like TransactionExtract.rfm_transactions
+        and churn_transactions.
+        """
+        customers = customers[customers['IS_DELETED'] == 0].drop(columns=['IS_DELETED', 'PROGRAM_ID'])
+        transactions = transactions.merge(customers, on='CUSTOMER_ID', how='inner', sort=False)
+        return transactions.merge(programs, on='PROGRAM_ID', how='left', sort=False)
+
+    def profile(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """
+        ANALYTICAL_PROFILE columns of 2-Alv-profiles.sql read by the segmentation, with random demographics.
+        """
+        sales = transactions[(transactions['TRX_STATE_ID'] == 1) & transactions['AMOUNT_AFTER_DISCOUNT'].notna()]
+        sales = sales.assign(DAY=sales['TRANSACTION_DATE'].dt.normalize(), IS_DISCOUNTED=sales['AMOUNT_DISCOUNT'] > 0,
+                             DISCOUNT_RATE=sales['AMOUNT_DISCOUNT'] / (sales['AMOUNT_AFTER_DISCOUNT'] + sales['AMOUNT_DISCOUNT']),
+                             LAST_YEAR=sales['TRANSACTION_DATE'] >= self.reference_date - pd.DateOffset(years=1))
+        grouped = sales.groupby('UNIQUE_CUSTOMER_ID')
+        profile = grouped.agg(
+            ALISVERIS_ADEDI=('TRANSACTION_ID', 'size'),
+            MUSTERI_TOPLAM_CIRO=('AMOUNT_AFTER_DISCOUNT', 'sum'),
+            ILK_ODEME_DAY=('DAY', 'min'),
+            SON_ODEME_DAY=('DAY', 'max'),
+            INDIRIMLI_ALV_SAYISI=('IS_DISCOUNTED', 'sum'),
+            ORT_INDIRIM_ORANI=('DISCOUNT_RATE', 'mean'),
+            SON_1_YIL_TOPLAM_ISLEM=('LAST_YEAR', 'sum'),
+        ).reset_index()
+
+        profile['ILK_ODEME_TARIH'] = profile.pop('ILK_ODEME_DAY').dt.strftime('%Y%m%d').astype(np.int64)
+        profile['SON_ODEME_TARIH'] = profile.pop('SON_ODEME_DAY').dt.strftime('%Y%m%d').astype(np.int64)
+        profile['ILK_ODEMEDEN_GECEN_GUN'] = (self.reference_date - pd.to_datetime(profile['ILK_ODEME_TARIH'].astype(str))).dt.days
+        profile['IND_ALV_ORANI'] = np.round(profile['INDIRIMLI_ALV_SAYISI'] / profile['ALISVERIS_ADEDI'], 4)
+        profile['ORT_INDIRIM_ORANI'] = np.round(profile['ORT_INDIRIM_ORANI'], 4)
+
+        rng = np.random.default_rng([self.seed, 3, int(profile['UNIQUE_CUSTOMER_ID'].min()) if len(profile) else 0])
+        n = len(profile)
+        profile['CEP_TEL_VAR_MI'] = (rng.random(n) < 0.8).astype(np.int8)
+        profile['EMAIL_VAR_MI'] = (rng.random(n) < 0.6).astype(np.int8)
+        profile['AGE'] = rng.integers(18, 80, n)
+        profile['CINSIYET_ACIKLAMA'] = rng.choice(['KADIN', 'ERKEK', 'BELIRTILMEMIS'], n, p=[0.5, 0.45, 0.05])
+
+        return profile
+
+    def all_data(self) -> pd.DataFrame:
+        """
+        ANALYTIC_ALL_DATA (4-all-data.sql): RFM_STG of the RFM engine joined with the customer profile.
+        """
+        customers, programs = self.customers(), self.programs()
+        engine = RFMEngine(reference_date=self.reference_date)
+
+        parts = []
+        for first, last in self.chunks():
+            transactions = self._joined(self.transactions(first, last), customers, programs)
+            rfm = engine.compute(transactions)
+            # NUMBER columns without NULLs come back from Oracle as integers (every row here has a sale)
+            rfm['SON_ALV_TARIH'] = rfm['SON_ALV_TARIH'].astype(np.int64)
+            parts.append(self.profile(transactions).merge(rfm, on='UNIQUE_CUSTOMER_ID', how='inner'))
+
+        return pd.concat(parts, ignore_index=True)
+
+    def churn_datasets(self, churn_threshold: int = 180, training_rows: int = None) -> tuple:
+        """
+        Churn TR (V1.sql) and PR (V3.sql) datasets, from the aggregates of the churn feature store.
+
+        Args:
+            churn_threshold (int): Days without transactions after which a customer is labelled churned.
+            training_rows (int): Rows sampled into the training dataset. Defaults to feature_store_training_rows.
+
+        Returns:
+            tuple: (training dataset, prediction dataset)
+        """
+        customers, programs = self.customers(), self.programs()
+        store = ChurnFeatureStore(f"SYNTHETIC_{self.seed}", store_dir=os.devnull)
+        cutoff = self.reference_date - pd.Timedelta(days=churn_threshold)
+        training_rows = training_rows or store.parameters.feature_store_training_rows
+
+        train_parts, predict_parts = [], []
+        for first, last in self.chunks():
+            transactions = self._joined(self.transactions(first, last), customers, programs)
+            transactions = transactions.rename(columns={'PROGRAM_ID': 'DWH_PROGRAM_ID'})
+            before = transactions['TRANSACTION_DATE'] < cutoff
+
+            state, sketch = store.merge(*[[part] for part in store.aggregate(transactions, None)[:2]])
+            predict_parts.append(store.materialize(state, sketch, self.reference_date))
+
+            state, sketch = store.merge(*[[part] for part in store.aggregate(transactions[before], None)[:2]])
+            after, _ = store.merge([store.aggregate(transactions[~before], None)[0]])
+
+            # as ChurnFeatureStore.training_dataset
+            data = store.materialize(state, sketch, cutoff).rename(columns={'LAST_TRANSACTION_DATE': 'LAST_TRANSACTION_BEFORE_CUTOFF'})
+            after_cutoff = after.set_index(KEYS)['N_ALL'].reindex(pd.MultiIndex.from_frame(data[KEYS]))
+            position = data.columns.get_loc('CUSTOMER_LIFETIME') + 1
+            data.insert(position, 'TRANSACTIONS_AFTER_CUTOFF', after_cutoff.fillna(0).astype(np.int64).to_numpy())
+            data.insert(position + 1, 'IS_CHURN', (data['TRANSACTIONS_AFTER_CUTOFF'] == 0).astype(np.int64))
+            train_parts.append(data[(data['IS_CHURN'] == 0) | (data['DAYS_SINCE_LAST_TRANSACTION'] <= churn_threshold)])
+
+        rng = np.random.default_rng([self.seed, 4])
+        train = pd.concat(train_parts, ignore_index=True)
+        train = train.iloc[rng.permutation(len(train))[:training_rows]].reset_index(drop=True)
+        train['RND'] = rng.random(len(train))
+
+        predict = pd.concat(predict_parts, ignore_index=True)
+        predict['IS_CHURN'] = 0
+
+        return train, predict
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=100_000)
+    parser.add_argument('--transactions-per-customer', type=float, default=12)
+    parser.add_argument('--programs', type=int, default=20)
+    parser.add_argument('--skew', type=float, default=1.5)
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--churn-threshold', type=int, default=180)
+    parser.add_argument('--out', default='data/synthetic')
+    parser.add_argument('--with-transactions', action='store_true',
+                        help='also write the TRANSACTION_MAIN chunks, CUSTOMER_STG and DIM_PROGRAM')
+    args = parser.parse_args()
+
+    generator = SyntheticLoyaltyData(args.customers, args.transactions_per_customer, args.programs, args.skew, args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    print(f"{args.customers:,} customers, {generator.n_transactions:,} transactions, {args.programs} programs")
+
+    start = time.perf_counter()
+    if args.with_transactions:
+        generator.customers().to_parquet(os.path.join(args.out, 'customers.parquet'), index=False)
+        generator.programs().to_parquet(os.path.join(args.out, 'programs.parquet'), index=False)
+        for i, (first, last) in enumerate(generator.chunks()):
+            generator.transactions(first, last).to_parquet(os.path.join(args.out, f'transactions-{i:04d}.parquet'), index=False)
+
+    generator.all_data().to_parquet(os.path.join(args.out, 'all_data.parquet'), index=False)
+    train, predict = generator.churn_datasets(args.churn_threshold)
+    train.to_parquet(os.path.join(args.out, 'TR_churn_dataset.parquet'), index=False)
+    predict.to_parquet(os.path.join(args.out, 'PR_churn_dataset.parquet'), index=False)
+    print(f"written to {args.out} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+SELECT 
+    COUNT(*) AS row_count,
+    SUM(ORA_HASH(UNIQUE_CUSTOMER_ID || '|' || P1 || '|' || P2 || '|' || P3 || '|' || P4 || '|' || P5 || '|' || P6
+                 || '|' || P11 || '|' || P12 || '|' || P14 || '|' || P15)) AS row_hash,
+    -- overall-firm.sql looks back 12 months from SYSDATE, so the window moves without any row changing
+    SUM(CASE WHEN TO_DATE(P2, 'YYYYMMDD') >= ADD_MONTHS(SYSDATE, -12) THEN ORA_HASH(UNIQUE_CUSTOMER_ID) ELSE 0 END) AS last_year_hash
+FROM 
+    {SCHEMA_NAME}.ANALYTIC_CUSTOMER
+WHERE 
+    P15 IS NOT NULL
@@ -93,12 +93,17 @@ LEFT JOIN (
     FROM 
         {SCHEMA_NAME}.ANALYTIC_CUSTOMER
     WHERE 
-        TO_DATE(P2, 'YYYYMMDD') >= ADD_MONTHS(SYSDATE, -12)
+        P15 IS NOT NULL
+        AND TO_DATE(P2, 'YYYYMMDD') >= ADD_MONTHS(SYSDATE, -12)
     GROUP BY 
         FIRM_ID
 ) LAST_ONE_YEAR
 ON TOTAL.FIRM_ID = LAST_ONE_YEAR.FIRM_ID
 
+-- Segmented customers only: the churn rows of ANALYTIC_CUSTOMER (P15 IS NULL) would count a customer twice
+WHERE 
+    TOTAL.P15 IS NOT NULL
+
 GROUP BY 
     TOTAL.FIRM_ID,
     LAST_ONE_YEAR.customer_count,
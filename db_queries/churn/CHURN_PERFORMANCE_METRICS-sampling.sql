@@ -0,0 +1,8 @@
+-- Training sample columns of CHURN_PERFORMANCE_METRICS (Churn.create_performance_metrics_df), run once per firm schema.
+ALTER TABLE {SCHEMA_NAME}.CHURN_PERFORMANCE_METRICS ADD (
+    TRAIN_ROWS NUMBER,
+    SAMPLED_TRAIN_ROWS NUMBER,
+    SAMPLING_RATIO NUMBER,
+    SAMPLING_STRATEGY VARCHAR2(50),
+    AUC_UNWEIGHTED NUMBER
+)
@@ -0,0 +1,7 @@
+SELECT
+    cust.CUSTOMER_ID,
+    cust.UNIQUE_CUSTOMER_ID,
+    cust.FIRM_ID,
+    cust.PROGRAM_ID,
+    cust.IS_DELETED
+FROM {SCHEMA_NAME}.CUSTOMER_STG cust
@@ -0,0 +1,4 @@
+SELECT
+    prg.PROGRAM_ID,
+    prg.PROGRAM_NAME
+FROM {SCHEMA_NAME}.DIM_PROGRAM prg
@@ -0,0 +1,7 @@
+SELECT
+    MIN(trx.TRANSACTION_DATE) AS FIRST_TRANSACTION_DATE
+FROM {SCHEMA_NAME}.TRANSACTION_MAIN trx
+WHERE trx.IS_DELETED = 0
+  AND trx.TRX_STATE_ID IN (1, 3)
+  AND trx.TRANSACTION_DATE >= TO_DATE('{dt_start}', 'YYYYMMDD')
+  AND trx.TRANSACTION_DATE < TO_DATE('{dt_end}', 'YYYYMMDD')
@@ -0,0 +1,16 @@
+SELECT
+    trx.CUSTOMER_ID,
+    trx.PROGRAM_ID,
+    trx.TRX_STATE_ID,
+    trx.TRANSACTION_ID,
+    trx.TRANSACTION_DATE,
+    trx.TIMED_ID_TRANSACTION,
+    trx.AMOUNT_AFTER_DISCOUNT,
+    trx.AMOUNT_DISCOUNT,
+    trx.AMOUNT_EARNED_POINT,
+    trx.AMOUNT_USED_POINT
+FROM {SCHEMA_NAME}.TRANSACTION_MAIN trx
+WHERE trx.IS_DELETED = 0
+  AND trx.TRX_STATE_ID IN (1, 3)
+  AND trx.TRANSACTION_DATE >= TO_DATE('{dt_start}', 'YYYYMMDD')
+  AND trx.TRANSACTION_DATE < TO_DATE('{dt_end}', 'YYYYMMDD')
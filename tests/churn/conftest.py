@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+from app.churn.modelling import Churn
+from app.churn.registry import ModelRegistry
+
+
+@pytest.fixture
+def churn(tmp_path, monkeypatch, synthetic_firm):
+    """
+    Churn of a synthetic firm working in tmp_path, with its training dataset written and a new registry.
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data/churn")
+    train, _ = synthetic_firm.generator.churn_datasets()
+
+    churn = Churn(1, "TEST_CDP")
+    churn.registry = ModelRegistry("TEST_CDP", model_dir=str(tmp_path / "models"))
+    churn.parameters.max_model_age_days = 0
+    train.to_parquet(churn.train_path, index=False)
+    churn.thread_budget.acquire()
+    yield churn
+    churn.thread_budget.release()
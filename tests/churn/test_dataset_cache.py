@@ -0,0 +1,22 @@
+import logging
+
+import pandas as pd
+
+
+def test_warm_start_trains_on_cached_datasets(churn, caplog):
+    X_train, X_val, y_train, y_val = churn.train_data_prep()
+    churn.train_model(X_train, X_val, y_train, y_val)
+    first = churn.registry.current()
+
+    # the training data changed since the first model; the tuning search of a run bins it before the training
+    X_train, y_train = X_train.iloc[:-100], y_train.iloc[:-100]
+    fingerprint = churn.utils.frame_fingerprint(pd.concat([X_train, X_val]).assign(IS_CHURN=pd.concat([y_train, y_val])))
+    churn.cached_datasets(X_train, X_val, y_train, y_val, fingerprint, dict(churn.parameters.lgbm_params))
+
+    with caplog.at_level(logging.INFO):
+        churn.train_model(X_train, X_val, y_train, y_val)
+
+    second = churn.registry.current()
+    assert "loaded binned churn datasets" in caplog.text
+    assert second['warm_started_from'] == first['version']
+    assert second['num_trees'] > first['num_trees']
@@ -0,0 +1,183 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.churn.feature_store import KEYS, ChurnFeatureStore
+from app.utils.transaction_extract import TransactionExtract
+
+CHURN_THRESHOLD = 10
+BACKFILL_DAY = pd.Timestamp("2025-03-20")
+
+
+class ExtractDatabase:
+    """
+    DatabaseManager stand-in answering the extract queries from a TRANSACTION_MAIN frame with an IS_DELETED column.
+    """
+
+    def __init__(self, transactions: pd.DataFrame) -> None:
+        self.transactions = transactions
+
+    def fetch_data_as_df(self, query: str, batch_size: int = 10000, template: str = None) -> pd.DataFrame:
+        name = os.path.basename(template)
+        customers = np.sort(self.transactions['CUSTOMER_ID'].unique())
+        if name == "customers.sql":
+            return pd.DataFrame({'CUSTOMER_ID': customers, 'UNIQUE_CUSTOMER_ID': customers, 'PROGRAM_ID': 1,
+                                 'FIRM_ID': 1, 'IS_DELETED': 0})
+        if name == "programs.sql":
+            return pd.DataFrame({'PROGRAM_ID': [1, 2], 'PROGRAM_NAME': ['A', 'B']})
+
+        start, end = (pd.Timestamp(value) for value in re.findall(r"TO_DATE\('(\d{8})'", query))
+        window = self.transactions[(self.transactions['IS_DELETED'] == 0) &
+                                   (self.transactions['TRANSACTION_DATE'] >= start) &
+                                   (self.transactions['TRANSACTION_DATE'] < end)]
+        if name == "transactions-first-date.sql":
+            return pd.DataFrame({'FIRST_TRANSACTION_DATE': [window['TRANSACTION_DATE'].min()]})
+        return window.drop(columns='IS_DELETED')
+
+
+def make_transactions(start: str, end: str, customers: int = 80, first_id: int = 0, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    rows = int((end - start).days * customers * 0.15)
+    dates = start + pd.to_timedelta(rng.integers(0, int((end - start).total_seconds()), rows), unit='s')
+    amount = np.round(rng.lognormal(3.5, 0.8, rows), 2)
+    return pd.DataFrame({
+        'CUSTOMER_ID': rng.integers(1, customers + 1, rows),
+        'PROGRAM_ID': rng.integers(1, 3, rows),
+        'TRX_STATE_ID': 1,
+        'TRANSACTION_ID': np.arange(first_id, first_id + rows),
+        'TRANSACTION_DATE': dates,
+        'TIMED_ID_TRANSACTION': dates.strftime("%Y%m%d").astype(float),
+        'AMOUNT_AFTER_DISCOUNT': np.where(rng.random(rows) < 0.05, np.nan, amount),
+        'AMOUNT_DISCOUNT': np.where(rng.random(rows) < 0.3, np.round(amount * 0.1, 2), 0.0),
+        'AMOUNT_EARNED_POINT': np.round(amount * 0.01, 2),
+        'AMOUNT_USED_POINT': np.where(rng.random(rows) < 0.2, 5.0, 0.0),
+        'IS_DELETED': 0
+    })
+
+
+def replica(transactions: pd.DataFrame, end: pd.Timestamp, cutoff: pd.Timestamp = None) -> pd.DataFrame:
+    """
+    V1.sql (with cutoff) or V3.sql (without) in pandas, over the valid transactions before end.
+    """
+    transactions = transactions[(transactions['IS_DELETED'] == 0) & (transactions['TRANSACTION_DATE'] < end)]
+    reference = cutoff if cutoff is not None else end
+    valid = transactions[(transactions['TRANSACTION_DATE'] < reference) & transactions['AMOUNT_AFTER_DISCOUNT'].notna()]
+    valid = valid.sort_values(['CUSTOMER_ID', 'TRANSACTION_DATE'], kind='stable')
+    previous = valid.groupby('CUSTOMER_ID')['TRANSACTION_DATE'].shift()
+    valid = valid.assign(GAP=(valid['TRANSACTION_DATE'] - previous).dt.total_seconds() / 86400,
+                         DISCOUNT=valid['AMOUNT_DISCOUNT'].clip(lower=0),
+                         IS_DISCOUNTED=(valid['AMOUNT_DISCOUNT'] > 0).astype(int),
+                         USED_POINT=valid['AMOUNT_USED_POINT'].clip(lower=0),
+                         IS_POINT_USED=(valid['AMOUNT_USED_POINT'] > 0).astype(int),
+                         EARNED_POINT=valid['AMOUNT_EARNED_POINT'].clip(lower=0))
+
+    data = valid.groupby(['CUSTOMER_ID', 'PROGRAM_ID']).agg(
+        FIRST_TRANSACTION_DATE=('TRANSACTION_DATE', 'min'),
+        LAST_TRANSACTION_DATE=('TRANSACTION_DATE', 'max'),
+        TOTAL_TRANSACTIONS=('AMOUNT_AFTER_DISCOUNT', 'size'),
+        TOTAL_SPENT=('AMOUNT_AFTER_DISCOUNT', 'sum'),
+        AVG_SPENT=('AMOUNT_AFTER_DISCOUNT', 'mean'),
+        MAX_SPENT=('AMOUNT_AFTER_DISCOUNT', 'max'),
+        MIN_SPENT=('AMOUNT_AFTER_DISCOUNT', 'min'),
+        AVG_DAYS_BETWEEN_TRANSACTIONS=('GAP', 'mean'),
+        MEDIAN_BASKET_SIZE=('AMOUNT_AFTER_DISCOUNT', 'median'),
+        BASKET_SIZE_STDDEV=('AMOUNT_AFTER_DISCOUNT', 'std'),
+        TOTAL_DISCOUNT_EARNED=('DISCOUNT', 'sum'),
+        DISCOUNTED_TRANSACTIONS=('IS_DISCOUNTED', 'sum'),
+        TOTAL_USED_POINT=('USED_POINT', 'sum'),
+        TOTAL_EARNED_POINT=('EARNED_POINT', 'sum'),
+        POINT_USED_TRANSACTIONS=('IS_POINT_USED', 'sum')
+    )
+    data = data[(data['TOTAL_TRANSACTIONS'] > 3) & (data['TOTAL_SPENT'] > 100)]
+    data['DAYS_SINCE_LAST_TRANSACTION'] = (reference - data['LAST_TRANSACTION_DATE']) / pd.Timedelta(days=1)
+    data['CUSTOMER_LIFETIME'] = (data['LAST_TRANSACTION_DATE'] - data['FIRST_TRANSACTION_DATE']) / pd.Timedelta(days=1)
+    data['DISTINCT_TRANSACTIONS'] = data['TOTAL_TRANSACTIONS']
+
+    if cutoff is not None:
+        after = transactions[transactions['TRANSACTION_DATE'] >= cutoff].groupby(['CUSTOMER_ID', 'PROGRAM_ID']).size()
+        data['TRANSACTIONS_AFTER_CUTOFF'] = after.reindex(data.index).fillna(0).astype(int)
+        data['IS_CHURN'] = (data['TRANSACTIONS_AFTER_CUTOFF'] == 0).astype(int)
+        data = data[(data['IS_CHURN'] == 0) | (data['DAYS_SINCE_LAST_TRANSACTION'] <= CHURN_THRESHOLD)]
+        data = data.rename(columns={'LAST_TRANSACTION_DATE': 'LAST_TRANSACTION_BEFORE_CUTOFF'})
+
+    data.index.names = KEYS
+    return data.reset_index()
+
+
+def assert_matches(computed: pd.DataFrame, expected: pd.DataFrame) -> None:
+    computed = computed.sort_values(KEYS).reset_index(drop=True)
+    expected = expected.sort_values(KEYS).reset_index(drop=True)
+    assert len(computed) == len(expected) > 0
+    for column in expected.columns:
+        if column == 'MEDIAN_BASKET_SIZE':
+            # the sketch keeps the median within its relative accuracy
+            np.testing.assert_allclose(computed[column], expected[column], rtol=0.011, err_msg=column)
+        elif pd.api.types.is_datetime64_any_dtype(expected[column]):
+            assert (pd.to_datetime(computed[column]) == expected[column]).all(), column
+        else:
+            np.testing.assert_allclose(computed[column].astype(float), expected[column].astype(float),
+                                       rtol=1e-9, atol=1e-9, err_msg=column)
+
+
+def assert_store_matches(store: ChurnFeatureStore, transactions: pd.DataFrame, today: pd.Timestamp) -> None:
+    cutoff = today - pd.Timedelta(days=CHURN_THRESHOLD)
+    training = store.training_dataset(CHURN_THRESHOLD, now=today, seed=0).drop(columns='RND')
+    assert_matches(training, replica(transactions, today, cutoff))
+    assert_matches(store.prediction_dataset(now=today), replica(transactions, today))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ChurnFeatureStore("TEST_CDP", store_dir=str(tmp_path / "feature_store"))
+    store.extract = TransactionExtract("TEST_CDP", extract_dir=str(tmp_path / "extract"))
+    store.parameters.feature_store_start_dt = '20000101'
+    store.parameters.feature_store_retention_days = 30
+    store.parameters.feature_store_reload_days = 3
+    return store
+
+
+@pytest.fixture
+def db(store):
+    db = ExtractDatabase(make_transactions("2025-01-01", BACKFILL_DAY))
+    store.update(db, today=BACKFILL_DAY)
+    return db
+
+
+def test_backfill_matches_the_queries(store, db):
+    manifest = store.load_manifest()
+
+    assert manifest["snapshot_date"] == "2025-02-18"
+    assert min(store.days()) >= pd.Timestamp(manifest["snapshot_date"])
+    assert_store_matches(store, db.transactions, BACKFILL_DAY)
+
+
+def test_daily_update_folds_expired_days_and_picks_up_late_rows(store, db):
+    today = BACKFILL_DAY + pd.Timedelta(days=2)
+    # transactions of the day before the backfill that arrived after it, and the days since
+    late = make_transactions(BACKFILL_DAY - pd.Timedelta(days=1), BACKFILL_DAY, first_id=100_000, seed=1)
+    new = make_transactions(BACKFILL_DAY, today, first_id=200_000, seed=2)
+    db.transactions = pd.concat([db.transactions, late, new], ignore_index=True)
+
+    manifest = store.update(db, today=today)
+
+    assert manifest["snapshot_date"] == "2025-02-20"
+    assert min(store.days()) >= pd.Timestamp("2025-02-20")
+    assert_store_matches(store, db.transactions, today)
+
+
+@pytest.mark.parametrize("reload, deleted_day", [("retention", "2025-02-28"), ("all", "2025-01-15")])
+def test_full_refresh_of_the_extract_drops_deleted_transactions(store, db, reload, deleted_day):
+    store.parameters.feature_store_full_refresh_reload = reload
+    # a week after the backfill the extract reloads the whole history, the deleted month is not reloaded before
+    today = BACKFILL_DAY + pd.Timedelta(days=store.extract.config.transaction_extract_full_refresh_days)
+    day = db.transactions['TRANSACTION_DATE'].dt.normalize() == pd.Timestamp(deleted_day)
+    db.transactions.loc[day & db.transactions['AMOUNT_AFTER_DISCOUNT'].notna(), 'IS_DELETED'] = 1
+
+    manifest = store.update(db, today=today)
+
+    assert manifest["extract_full_refresh_on"] == today.strftime("%Y-%m-%d")
+    assert_store_matches(store, db.transactions, today)
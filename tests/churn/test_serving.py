@@ -0,0 +1,117 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+from app.churn import serving
+from app.churn.registry import ModelRegistry
+from app.churn.serving import MicroBatcher, ModelStore, ScoringService
+
+
+@pytest.fixture
+def trained(churn, synthetic_firm, monkeypatch):
+    """
+    A model trained and registered for the synthetic firm, request records of its prediction dataset and
+    the probabilities of the batch scoring for them. Every firm is served from the registry of the model.
+    """
+    churn.train_model(*churn.train_data_prep())
+    monkeypatch.setattr(serving, "ModelRegistry",
+                        lambda schema_name: ModelRegistry(schema_name, model_dir=churn.registry.model_dir))
+
+    _, predict = synthetic_firm.generator.churn_datasets()
+    predict = predict.iloc[:200].reset_index(drop=True)
+    features = [col for col in churn.parameters.model_features if col != 'IS_CHURN']
+    data = predict[['UNIQUE_CUSTOMER_ID'] + features]
+    records = json.loads(data.astype(object).where(data.notna(), None).to_json(orient='records'))
+
+    X, customer_info = churn.predict_data_prep(predict.copy())
+    expected = churn.predict(X, customer_info)['churn_prob'].to_numpy()
+    return churn, records, expected
+
+
+def post(url: str, body: dict) -> tuple:
+    request = urllib.request.Request(url, data=json.dumps(body).encode("UTF-8"), method="POST",
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_batcher_scores_concurrent_requests_together(trained):
+    churn, records, expected = trained
+    batcher = MicroBatcher(ModelStore(), "TEST_CDP", max_batch_rows=10_000, max_wait_ms=200)
+    results = [None] * 10
+
+    def submit(i):
+        results[i] = batcher.submit(records[i * 20:(i + 1) * 20])
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.stop()
+
+    assert batcher.stats["requests"] == 10 and batcher.stats["batches"] < 10
+    predictions = [prediction for result in results for prediction in result["predictions"]]
+    assert [prediction["UNIQUE_CUSTOMER_ID"] for prediction in predictions] == [record["UNIQUE_CUSTOMER_ID"] for record in records]
+    np.testing.assert_allclose([prediction["churn_prob"] for prediction in predictions], expected, atol=1e-9)
+    assert {result["model_version"] for result in results} == {churn.registry.current()["version"]}
+
+
+def test_server_scores_and_rejects_invalid_requests(trained):
+    _, records, expected = trained
+    service = ScoringService(host="127.0.0.1", port=0, socket_path="")
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+    try:
+        status, body = post(f"{service.address}/score/TEST_CDP", {"records": records[:5]})
+        assert status == 200
+        np.testing.assert_allclose([prediction["churn_prob"] for prediction in body["predictions"]], expected[:5], atol=1e-9)
+
+        with urllib.request.urlopen(f"{service.address}/health", timeout=30) as response:
+            assert json.loads(response.read())["firms"]["TEST_CDP"]["rows"] == 5
+
+        assert post(f"{service.address}/score/TEST_CDP", {"records": [{"DWH_PROGRAM_ID": 1}]})[0] == 400
+        assert post(f"{service.address}/score/TEST_CDP", {"records": []})[0] == 400
+        assert post(f"{service.address}/score/TEST_CDP/extra", {"records": records[:1]})[0] == 404
+    finally:
+        service.shutdown()
+
+
+def test_model_store_loads_outside_the_lock(trained, monkeypatch):
+    churn, _, _ = trained
+    load = ModelStore._load
+    slow, loading, release = threading.Event(), threading.Event(), threading.Event()
+
+    def slow_load(registry, entry, registry_mtime):
+        if slow.is_set() and registry.schema_name == "SLOW_CDP":
+            loading.set()
+            release.wait(30)
+        return load(registry, entry, registry_mtime)
+
+    monkeypatch.setattr(ModelStore, "_load", staticmethod(slow_load))
+    store = ModelStore(reload_seconds=0)
+    first = store.get("SLOW_CDP")
+
+    # a new version is loaded by one request while the others keep getting the current model
+    churn.registry.register(first["model"], 2, "new", {}, first["features"], {})
+    slow.set()
+    reloaded = []
+    thread = threading.Thread(target=lambda: reloaded.append(store.get("SLOW_CDP")))
+    thread.start()
+    assert loading.wait(30)
+    try:
+        assert store.get("SLOW_CDP") is first
+        assert store.get("OTHER_CDP")["entry"]["model_id"] == 2
+    finally:
+        release.set()
+        thread.join()
+
+    assert reloaded[0]["entry"]["model_id"] == 2
+    assert store.get("SLOW_CDP") is reloaded[0]
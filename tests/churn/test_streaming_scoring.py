@@ -0,0 +1,43 @@
+import pandas as pd
+
+
+class RecordingDatabase:
+    """
+    DatabaseManager stand-in keeping the frames inserted into every table.
+    """
+
+    def __init__(self) -> None:
+        self.inserted = {}
+
+    def insert_data_to_db(self, df, table_name, *args, **kwargs):
+        self.inserted.setdefault(table_name, []).append(df)
+
+
+def test_streaming_scoring_matches_memory_scoring(churn, synthetic_firm):
+    churn.train_model(*churn.train_data_prep())
+
+    # every other customer gets a row in a second program, so the batches split customers
+    _, predict = synthetic_firm.generator.churn_datasets()
+    programs = sorted(predict['DWH_PROGRAM_ID'].unique())
+    second = predict.iloc[::2].assign(DWH_PROGRAM_ID=lambda frame: frame['DWH_PROGRAM_ID'].map(
+        dict(zip(programs, programs[1:] + programs[:1]))))
+    predict = pd.concat([predict, second]).sort_values('UNIQUE_CUSTOMER_ID', kind='stable').reset_index(drop=True)
+    predict.to_parquet(churn.predict_path, index=False)
+
+    X, customer_info = churn.predict_data_prep()
+    expected = churn.postprocessing(churn.predict(X, customer_info))
+    expected['IS_CHURN'] = expected['IS_CHURN'].apply(lambda x: 'CHURN' if x == 1 else 'CHURN RİSKİ YOK')
+
+    db = RecordingDatabase()
+    churn.parameters.scoring_batch_rows = 7
+    summary = churn.score_streaming(db)
+
+    chunks = db.inserted["ANALYTIC_CUSTOMER"]
+    assert len(chunks) > len(predict) // 7 - 1
+    streamed = pd.concat(chunks, ignore_index=True)
+    assert not streamed['UNIQUE_CUSTOMER_ID'].duplicated().any()
+    pd.testing.assert_frame_equal(streamed.sort_values('UNIQUE_CUSTOMER_ID').reset_index(drop=True),
+                                  churn.prep_output(expected).sort_values('UNIQUE_CUSTOMER_ID').reset_index(drop=True))
+
+    pd.testing.assert_frame_equal(churn.summarize_results(summary), churn.summarize_results(expected),
+                                  check_dtype=False, check_categorical=False)
@@ -0,0 +1,62 @@
+import os
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.churn.tuning import HyperparameterTuner
+
+BASE_PARAMS = {'objective': 'binary', 'verbose': -1}
+SEARCH_SPACE = {'num_leaves': [4, 32, 'int'], 'learning_rate': [0.01, 0.3, 'log']}
+
+
+@pytest.fixture(scope="module")
+def dataset_paths(tmp_path_factory):
+    """
+    Binary training and validation datasets of a small separable problem, as Churn.cached_datasets saves them.
+    """
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(3_000, 5))
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(scale=0.5, size=len(X)) > 0).astype(int)
+
+    directory = tmp_path_factory.mktemp("tuning")
+    train_path, val_path = str(directory / "train.bin"), str(directory / "val.bin")
+    train_data = lgb.Dataset(X[:2_400], y[:2_400], params=BASE_PARAMS)
+    train_data.save_binary(train_path)
+    lgb.Dataset(X[2_400:], y[2_400:], reference=train_data, params=BASE_PARAMS).save_binary(val_path)
+    return train_path, val_path
+
+
+def tuner(**kwargs) -> HyperparameterTuner:
+    return HyperparameterTuner(BASE_PARAMS, SEARCH_SPACE, **dict(dict(n_trials=4, min_rounds=5, max_rounds=20, eta=2,
+                                                                     time_budget_seconds=600, workers=2), **kwargs))
+
+
+def test_successive_halving_keeps_the_best_trials_of_every_rung(dataset_paths):
+    result = tuner().run(*dataset_paths)
+
+    # 4 trials at 5 rounds, the best 2 at 10 and the best one at 20
+    assert sorted(trial['rounds'] for trial in result['trials']) == [5, 5, 10, 20]
+    assert not result['timed_out'] and result['rounds'] == 20
+    best = max(result['trials'], key=lambda trial: (trial['rounds'], trial['auc']))
+    assert result['params'] == best['params'] and result['auc'] == best['auc'] > 0.5
+
+
+def test_deadline_stops_the_trials_and_the_search(dataset_paths):
+    result = tuner(min_rounds=50, max_rounds=400, time_budget_seconds=0).run(*dataset_paths)
+
+    assert result['timed_out']
+    assert all(trial['rounds'] == 50 and trial['best_iteration'] <= 1 for trial in result['trials'])
+
+
+def test_timed_out_search_is_not_saved(churn):
+    X_train, X_val, y_train, y_val = churn.train_data_prep()
+    fingerprint = churn.utils.frame_fingerprint(pd.concat([X_train, X_val]).assign(IS_CHURN=pd.concat([y_train, y_val])))
+    churn.parameters.tuning_trials = 2
+    churn.parameters.tuning_workers = 1
+    churn.parameters.tuning_time_budget_seconds = 0
+
+    churn.tuned_params(X_train, X_val, y_train, y_val, fingerprint, dict(churn.parameters.lgbm_params))
+
+    assert not os.path.exists(os.path.join(churn.registry.model_dir, "tuned_params.json"))
@@ -0,0 +1,29 @@
+import joblib
+import numpy as np
+import pandas as pd
+
+
+def test_warm_start_keeps_the_programs_of_the_previous_model(churn):
+    train = pd.read_parquet(churn.train_path)
+    # churn decided by the program, so the trees split on it
+    train['IS_CHURN'] = (train['DWH_PROGRAM_ID'] % 2).astype(train['IS_CHURN'].dtype)
+    added_program = train['DWH_PROGRAM_ID'].min()
+
+    # the first model has not seen the program with the lowest id, which shifts every category code
+    train[train['DWH_PROGRAM_ID'] != added_program].to_parquet(churn.train_path, index=False)
+    X_train, X_val, y_train, y_val = churn.train_data_prep()
+    churn.train_model(X_train, X_val, y_train, y_val)
+    first = churn.registry.current()
+    expected = churn.registry.load_model(first).predict(X_val)
+    assert len(np.unique(expected.round(3))) > 1
+
+    # boosting rounds that change nothing: the warm-started model has to predict what the first one did
+    churn.parameters.lgbm_params = dict(churn.parameters.lgbm_params, learning_rate=1e-9)
+    churn.parameters.warm_start_rounds = 5
+    train.to_parquet(churn.train_path, index=False)
+    churn.train_model(*churn.train_data_prep())
+
+    second = churn.registry.current()
+    assert second['warm_started_from'] == first['version']
+    model = joblib.load(churn.registry.model_path(second))
+    np.testing.assert_allclose(model.predict(X_val), expected, atol=1e-6)
@@ -0,0 +1,65 @@
+"""
+Time and memory regression checks of the hot functions against benchmarks/baselines/perf_regression.json.
+
+The cases, their inputs and the measurement are those of benchmarks/perf_regression.py, which also records the
+baseline. The time limits are scaled by the calibration seconds of this host over those of the reference host
+the baseline was recorded on (never below 1), so a slower CI runner does not fail at random, and a case over its
+time limit is measured once more before it fails. The tolerances can be set with the PERF_TIME_TOLERANCE,
+PERF_MEMORY_TOLERANCE, PERF_MIN_SECONDS, PERF_MIN_MB and PERF_REPEAT environment variables.
+"""
+import os
+
+import pytest
+
+from perf_regression import CASES, Fixtures, calibrate, limits, load_baseline, measure, parse_scale
+
+TIME_TOLERANCE = float(os.environ.get('PERF_TIME_TOLERANCE', 0.5))
+MEMORY_TOLERANCE = float(os.environ.get('PERF_MEMORY_TOLERANCE', 0.2))
+MIN_SECONDS = float(os.environ.get('PERF_MIN_SECONDS', 0.05))
+MIN_MB = float(os.environ.get('PERF_MIN_MB', 2))
+
+BASELINE = load_baseline()
+META = BASELINE.get('_meta', {})
+REPEAT = int(os.environ.get('PERF_REPEAT', META.get('repeat', 5)))
+SCALES = [label for label in BASELINE if label != '_meta']
+
+pytestmark = [
+    pytest.mark.perf,
+    pytest.mark.skipif(not SCALES, reason="no baseline, record it with python benchmarks/perf_regression.py"),
+]
+
+
+@pytest.fixture(scope="module")
+def host_factor():
+    return calibrate() / META['calibration_seconds']
+
+
+@pytest.fixture(scope="module", params=SCALES)
+def fixtures(request, tmp_path_factory):
+    # the churn datasets are read from data/ relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("perf"))
+    yield Fixtures(parse_scale(request.param), **META['data'])
+    os.chdir(cwd)
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_hot_function(case, fixtures, host_factor):
+    label = [scale for scale in SCALES if parse_scale(scale) == fixtures.customers][0]
+    reference = BASELINE[label].get(case)
+    if reference is None:
+        pytest.skip(f"no {label} baseline of {case}")
+
+    result = measure(CASES[case], fixtures, REPEAT)
+    time_limit, memory_limit = limits(reference, host_factor, TIME_TOLERANCE, MEMORY_TOLERANCE, MIN_SECONDS, MIN_MB)
+    if result['seconds'] > time_limit:
+        # a shared runner can be busy for a moment, a regression is slow in both measurements
+        result['seconds'] = min(result['seconds'], measure(CASES[case], fixtures, REPEAT)['seconds'])
+
+    assert result['rows'] == reference['rows']
+    assert result['seconds'] <= time_limit, (
+        f"{case} took {result['seconds']:.3f}s, the baseline is {reference['seconds']:.3f}s "
+        f"(host factor {host_factor:.2f}, limit {time_limit:.3f}s)")
+    assert result['peak_mb'] <= memory_limit, (
+        f"{case} allocated {result['peak_mb']:.1f} MB, the baseline is {reference['peak_mb']:.1f} MB "
+        f"(limit {memory_limit:.1f} MB)")
@@ -0,0 +1,15 @@
+import numpy as np
+
+
+def test_sqrt_features_keep_float64_precision(synthetic_firm):
+    # reduce_mem downcasts the counts and amounts of the segmentation input to narrow dtypes
+    data = synthetic_firm.segmentation_input.copy()
+    assert data['frequency'].dtype.itemsize < 8
+
+    segmented = synthetic_firm.segmentation_utils.RFM_segmentation(data)
+
+    for col in ['monetary', 'frequency']:
+        assert segmented[f"{col}_sqrt"].dtype == np.float64
+        expected = np.sqrt(data[col].to_numpy(dtype=np.float64))
+        threshold = expected.mean() + 3 * expected.std(ddof=1)
+        np.testing.assert_array_equal(segmented[f"{col}_sqrt"], np.minimum(expected, threshold))
@@ -0,0 +1,27 @@
+import os
+
+import pandas as pd
+
+from app.segmentation.segment import Segmentation_Runner, prepare_segmentation_input
+
+
+def test_partitioned_output_matches_single_core(synthetic_firm, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    parquet_path = "data/TEST_CDP_all_data.parquet"
+    synthetic_firm.all_data.to_parquet(parquet_path, index=False)
+
+    runner = Segmentation_Runner(1, "TEST_CDP_ELT")
+    runner.config.segmentation_partition_mode = 'hash'
+    runner.config.segmentation_workers = 2
+    runner.config.segmentation_hash_partitions = 3
+    partitioned = runner.run_partitioned(parquet_path)
+
+    data = runner.utils.read_parquet(parquet_path)
+    data.columns = data.columns.map(str.lower)
+    data = prepare_segmentation_input(data)
+    expected = runner.segment_utils.CLV_segmentation(runner.segment_utils.RFM_segmentation(data))
+
+    assert os.listdir("data") == ["TEST_CDP_all_data.parquet"]
+    pd.testing.assert_frame_equal(runner.segment_utils.prep_output(partitioned),
+                                  runner.segment_utils.prep_output(expected))
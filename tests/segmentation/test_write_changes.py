@@ -0,0 +1,129 @@
+import os
+import re
+import sqlite3
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+from app.segmentation.segment import Segmentation_Runner
+
+
+class RecordingDatabase:
+    """
+    DatabaseManager stand-in recording the rows write_changes sends to the database.
+    """
+
+    def __init__(self) -> None:
+        self.merged = []
+        self.deleted = []
+        self.inserted = []
+
+    def merge_data_to_db(self, df, table_name, staging_table, key_cols, target_filter=None):
+        self.merged.append(df)
+
+    def delete_rows_by_keys(self, keys, table_name, target_filter=None):
+        self.deleted.append(keys)
+
+    def insert_data_to_db(self, df, table_name, batch_size=1000):
+        self.inserted.append(df)
+
+    def execute_statement(self, statement, template=None):
+        pass
+
+
+class TableDatabase(RecordingDatabase):
+    """
+    RecordingDatabase keeping the segmentation rows of ANALYTIC_CUSTOMER, statements run on sqlite with the
+    Oracle functions they use.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.table = pd.DataFrame()
+
+    def merge_data_to_db(self, df, table_name, staging_table, key_cols, target_filter=None):
+        super().merge_data_to_db(df, table_name, staging_table, key_cols, target_filter)
+        self.table = pd.concat([self.table[~self.table['UNIQUE_CUSTOMER_ID'].isin(df['UNIQUE_CUSTOMER_ID'])], df])
+
+    def delete_rows_by_keys(self, keys, table_name, target_filter=None):
+        super().delete_rows_by_keys(keys, table_name, target_filter)
+        self.table = self.table[~self.table['UNIQUE_CUSTOMER_ID'].isin(keys['UNIQUE_CUSTOMER_ID'])]
+
+    def insert_data_to_db(self, df, table_name, batch_size=1000):
+        super().insert_data_to_db(df, table_name, batch_size)
+        self.table = pd.concat([self.table, df])
+
+    def execute_statement(self, statement, template=None):
+        if statement.startswith("DELETE"):
+            self.table = pd.DataFrame()
+            return
+        connection = sqlite3.connect(":memory:")
+        connection.execute("ATTACH ':memory:' AS TEST_ELT")
+        connection.create_function("TO_NUMBER", 1, float)
+        connection.create_function("TO_CHAR", 1, lambda value: f"{value:g}")
+        connection.create_function("REGEXP_LIKE", 2, lambda value, pattern: re.match(pattern, value) is not None)
+        connection.execute("CREATE TABLE TEST_ELT.ANALYTIC_CUSTOMER (UNIQUE_CUSTOMER_ID, FIRM_ID, P3, P15)")
+        rows = self.table[['UNIQUE_CUSTOMER_ID', 'FIRM_ID', 'P3', 'P15']].astype(object).itertuples(index=False)
+        connection.executemany("INSERT INTO TEST_ELT.ANALYTIC_CUSTOMER VALUES (?, ?, ?, ?)", list(rows))
+        connection.execute(statement)
+        updated = pd.read_sql("SELECT UNIQUE_CUSTOMER_ID, P3 FROM TEST_ELT.ANALYTIC_CUSTOMER", connection)
+        connection.close()
+        self.table['P3'] = self.table['UNIQUE_CUSTOMER_ID'].map(updated.set_index('UNIQUE_CUSTOMER_ID')['P3'])
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    runner = Segmentation_Runner(1, "TEST_ELT")
+    runner.db_manager = RecordingDatabase()
+    return runner
+
+
+def segment(synthetic_firm, days_later: int = 0):
+    data = synthetic_firm.segmentation_input.copy()
+    data['recency'] = data['recency'] + days_later
+    segment_utils = synthetic_firm.segmentation_utils
+    return segment_utils.prep_output(segment_utils.CLV_segmentation(segment_utils.RFM_segmentation(data)))
+
+
+def test_same_data_one_day_later_has_no_changes(runner, synthetic_firm):
+    first = segment(synthetic_firm)
+    later = segment(synthetic_firm, days_later=1)
+    assert (first['P3'] != later['P3']).all()
+
+    assert runner.write_changes(first, "ANALYTIC_CUSTOMER")['inserted'] == len(first)
+    summary = runner.write_changes(later, "ANALYTIC_CUSTOMER")
+
+    assert summary['changed'] == summary['inserted'] == summary['removed'] == 0
+    assert runner.db_manager.merged == [] and runner.db_manager.deleted == []
+
+
+def test_changed_segment_is_merged(runner, synthetic_firm):
+    first = segment(synthetic_firm)
+    runner.write_changes(first, "ANALYTIC_CUSTOMER")
+
+    later = first.copy()
+    later.loc[later.index[0], 'P15'] = 'VIP Müşteri' if later['P15'].iloc[0] != 'VIP Müşteri' else 'Riskli Müşteri'
+    later = later.iloc[:-1]
+    summary = runner.write_changes(later, "ANALYTIC_CUSTOMER")
+
+    assert (summary['inserted'], summary['changed'], summary['removed']) == (0, 1, 1)
+    assert runner.db_manager.merged[0]['UNIQUE_CUSTOMER_ID'].tolist() == [later['UNIQUE_CUSTOMER_ID'].iloc[0]]
+
+
+def test_unchanged_customers_get_the_recency_of_the_run(runner, synthetic_firm):
+    runner.db_manager = TableDatabase()
+    today = date.today()
+    runner.write_changes(segment(synthetic_firm), "ANALYTIC_CUSTOMER", run_date=today - timedelta(days=2))
+
+    later = segment(synthetic_firm, days_later=2)
+    later.loc[later.index[0], 'P15'] = 'VIP Müşteri' if later['P15'].iloc[0] != 'VIP Müşteri' else 'Riskli Müşteri'
+    summary = runner.write_changes(later, "ANALYTIC_CUSTOMER", run_date=today)
+    assert (summary['inserted'], summary['changed'], summary['removed']) == (0, 1, 0)
+
+    table = runner.db_manager.table.set_index('UNIQUE_CUSTOMER_ID')
+    expected = later.set_index('UNIQUE_CUSTOMER_ID')['P3'].astype(float)
+    assert len(table) == len(later)
+    pd.testing.assert_series_equal(table['P3'].astype(float).loc[expected.index], expected)
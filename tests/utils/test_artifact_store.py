@@ -0,0 +1,19 @@
+import pandas as pd
+import pytest
+
+from app.utils.artifact_store import ArtifactStore
+
+
+def test_scope_releases_the_artifacts_stored_within_it():
+    frame = pd.DataFrame({'UNIQUE_CUSTOMER_ID': [1, 2, 3]})
+    ArtifactStore.put("data/outer.parquet", frame, checkpoint=False)
+
+    with pytest.raises(RuntimeError):
+        with ArtifactStore.scope():
+            ArtifactStore.put("data/TEST_segments.parquet", frame, checkpoint=False)
+            assert ArtifactStore.contains("data/TEST_segments.parquet")
+            raise RuntimeError("stage failed")
+
+    assert not ArtifactStore.contains("data/TEST_segments.parquet")
+    assert ArtifactStore.contains("data/outer.parquet")
+    ArtifactStore.release("data/outer.parquet")
@@ -0,0 +1,16 @@
+import numpy as np
+
+from app.utils.general_utils import Analytical_Utils
+
+
+def test_stratified_sample_keeps_rows_without_a_stratum():
+    group_ids = np.repeat([0, 1, -1, 2], [5_000, 300, 40, 2_000])
+
+    positions, weights = Analytical_Utils.stratified_sample(group_ids, budget=1_000, min_rows=100)
+
+    assert np.all(np.diff(positions) > 0)
+    assert len(positions) <= 1_000
+    unstratified = group_ids[positions] == -1
+    assert unstratified.sum() == 40 and np.all(weights[unstratified] == 1)
+    for group in (0, 1, 2):
+        assert np.isclose(weights[group_ids[positions] == group].sum(), (group_ids == group).sum())
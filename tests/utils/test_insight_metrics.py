@@ -0,0 +1,144 @@
+import math
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.utils.insight_metrics import SEGMENT_COLUMNS, OverallFirmMetrics
+from app.utils.smart_insight_utils import SmartInsight
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+
+CHURN_P_CODES = ['P13'] + [f'P{number}' for number in range(16, 27)]
+
+
+class Median:
+    """
+    PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY ...), NULLs ignored.
+    """
+
+    def __init__(self) -> None:
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        return float(np.median(self.values)) if self.values else None
+
+
+def to_date(value, date_format):
+    try:
+        return datetime.strptime(str(value), '%Y%m%d').strftime('%Y-%m-%d %H:%M:%S') if value is not None else None
+    except ValueError:
+        return None
+
+
+def add_months(value, months):
+    return (pd.Timestamp(value) + pd.DateOffset(months=months)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def run_overall_firm_sql(table: pd.DataFrame, now: datetime, query: str = None) -> pd.DataFrame:
+    """
+    Runs db_queries/Insight/overall-firm.sql, or query, on sqlite with the Oracle functions it uses as Python functions.
+    """
+    if query is None:
+        with open(os.path.join(root_dir, "db_queries", "Insight", "overall-firm.sql"), encoding="utf-8") as file:
+            query = file.read().replace("{SCHEMA_NAME}.", "")
+    query = re.sub(r"PERCENTILE_CONT\(0\.5\) WITHIN GROUP \(ORDER BY (.+?)\) AS", r"MEDIAN(\1) AS", query)
+    query = re.sub(r"EXTRACT\((YEAR|MONTH) FROM", r"EXTRACT_\1(", query)
+    query = query.replace("SYSDATE", "SYSDATE()")
+
+    connection = sqlite3.connect(":memory:")
+    connection.create_function("SYSDATE", 0, lambda: now.strftime('%Y-%m-%d %H:%M:%S'))
+    connection.create_function("TO_DATE", 2, to_date)
+    connection.create_function("ADD_MONTHS", 2, add_months)
+    connection.create_function("TO_NUMBER", 1, lambda value: float(value) if value is not None else None)
+    connection.create_function("EXTRACT_YEAR", 1, lambda value: int(value[:4]) if value else None)
+    connection.create_function("EXTRACT_MONTH", 1, lambda value: int(value[5:7]) if value else None)
+    connection.create_aggregate("MEDIAN", 1, Median)
+    table.to_sql("ANALYTIC_CUSTOMER", connection, index=False)
+
+    row = pd.read_sql(query, connection)
+    connection.close()
+    row.columns = row.columns.str.upper()
+    return row
+
+
+def churn_rows(out_data: pd.DataFrame, customers: int) -> pd.DataFrame:
+    """
+    Rows the churn module writes to ANALYTIC_CUSTOMER (Churn.prep_output): P13 and P16-P26, P1-P15 left NULL.
+    """
+    rows = pd.DataFrame({'UNIQUE_CUSTOMER_ID': out_data['UNIQUE_CUSTOMER_ID'].iloc[:customers].to_numpy(),
+                         'FIRM_ID': out_data['FIRM_ID'].iloc[0]})
+    for code in CHURN_P_CODES:
+        rows[code] = '0.5'
+    return rows
+
+
+class InsightDatabase:
+    """
+    DatabaseManager stand-in running the queries of SmartInsight on an ANALYTIC_CUSTOMER frame.
+    """
+
+    def __init__(self, table: pd.DataFrame, now: datetime, schema_name: str) -> None:
+        self.table = table
+        self.now = now
+        self.schema_name = schema_name
+        self.templates = []
+
+    def fetch_data_as_df(self, query, template=None):
+        self.templates.append(template)
+        return run_overall_firm_sql(self.table, self.now, query.replace(f"{self.schema_name}.", ""))
+
+
+def analytic_customer(out_data: pd.DataFrame, churned: int) -> pd.DataFrame:
+    table = pd.concat([out_data.filter(regex=r'^(UNIQUE_CUSTOMER_ID|FIRM_ID|P\d+)$'), churn_rows(out_data, churned)],
+                      ignore_index=True)
+    return table.astype(object).where(table.notna(), None)
+
+
+@pytest.fixture(scope="module")
+def segments(synthetic_firm):
+    # the typed columns Segmentation_Runner keeps in the artifact store, upper cased by prep_output
+    return synthetic_firm.clv.rename(columns=str.upper)[list(SEGMENT_COLUMNS)]
+
+
+@pytest.fixture(scope="module")
+def now(segments):
+    # a year after the middle of the history, so both sides of the last year window have customers
+    last = pd.to_datetime(segments['SON_ODEME_TARIH'].astype(str), format='%Y%m%d')
+    return (last.min() + (last.max() - last.min()) / 2 + pd.DateOffset(months=12)).to_pydatetime()
+
+
+@pytest.mark.parametrize("churned", [0, 500])
+def test_memory_metrics_match_sql(synthetic_firm, segments, now, churned):
+    out_data = synthetic_firm.out_data
+    expected = run_overall_firm_sql(analytic_customer(out_data, churned), now).iloc[0]
+    computed = OverallFirmMetrics(now).compute(segments, out_data['FIRM_ID'].iloc[0]).iloc[0]
+
+    assert 0 < computed['LAST_YEAR_CUSTOMER_COUNT'] < computed['TOTAL_CUSTOMERS'] == len(out_data)
+    assert list(computed.index) == list(expected.index)
+    for column in expected.index:
+        if pd.isna(expected[column]):
+            assert pd.isna(computed[column]), column
+        else:
+            assert math.isclose(computed[column], expected[column], rel_tol=1e-9, abs_tol=1e-6), column
+
+
+def test_sql_fallback_runs_overall_firm_sql(synthetic_firm, segments, now):
+    insight = SmartInsight(1, "Test", "TEST_ELT")
+    insight.db_manager = InsightDatabase(analytic_customer(synthetic_firm.out_data, 500), now, "TEST_ELT")
+
+    metrics = insight.fetch_overall_firm_metrics()
+
+    assert os.path.exists(insight.db_manager.templates[0])
+    expected = insight.derive_metrics(OverallFirmMetrics(now).compute(segments, 1))
+    assert metrics['TOTAL_CUSTOMERS'].iloc[0] == expected['TOTAL_CUSTOMERS'].iloc[0]
+    assert metrics['MEDIAN_RECENCY'].iloc[0] == pytest.approx(expected['MEDIAN_RECENCY'].iloc[0])
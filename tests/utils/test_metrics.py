@@ -0,0 +1,34 @@
+import pytest
+
+from app.segmentation.segment import Segmentation_Runner
+from app.utils.metrics import STAGE_LAST_SUCCESS, STAGE_RUNS, stage_metrics
+
+
+def test_stage_counts_success():
+    with stage_metrics("FIRM101_ELT", 1, "segmentation"):
+        pass
+
+    assert STAGE_RUNS.value(firm="FIRM101", metric_id=1, stage="segmentation", status="success") == 1
+    assert STAGE_LAST_SUCCESS.value(firm="FIRM101", metric_id=1, stage="segmentation") is not None
+
+
+def test_stage_counts_raised_failure():
+    with pytest.raises(ValueError):
+        with stage_metrics("FIRM102_ELT", 1, "segmentation"):
+            raise ValueError("failed")
+
+    assert STAGE_RUNS.value(firm="FIRM102", metric_id=1, stage="segmentation", status="fail") == 1
+    assert STAGE_LAST_SUCCESS.value(firm="FIRM102", metric_id=1, stage="segmentation") is None
+
+
+def test_failing_runner_counts_failure(tmp_path, monkeypatch):
+    # Segmentation_Runner logs its errors instead of raising them, here the missing input
+    monkeypatch.chdir(tmp_path)
+    runner = Segmentation_Runner(103, "MISSING_ELT")
+
+    with stage_metrics("FIRM103_ELT", 1, "segmentation") as status:
+        status['failed'] = not runner.run()
+
+    assert STAGE_RUNS.value(firm="FIRM103", metric_id=1, stage="segmentation", status="fail") == 1
+    assert STAGE_RUNS.value(firm="FIRM103", metric_id=1, stage="segmentation", status="success") == 0
+    assert STAGE_LAST_SUCCESS.value(firm="FIRM103", metric_id=1, stage="segmentation") is None
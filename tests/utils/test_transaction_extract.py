@@ -0,0 +1,97 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.utils.transaction_extract import TransactionExtract
+
+
+class ExtractDatabase:
+    """
+    DatabaseManager stand-in answering the extract queries from in-memory tables, filtered by their date window.
+    """
+
+    def __init__(self, transactions: pd.DataFrame) -> None:
+        self.transactions = transactions
+        self.windows = []
+        self.fail_after = None
+
+    def fetch_data_as_df(self, query: str, batch_size: int = 10000, template: str = None) -> pd.DataFrame:
+        name = os.path.basename(template)
+        if name == "customers.sql":
+            return pd.DataFrame({'CUSTOMER_ID': [1, 2], 'UNIQUE_CUSTOMER_ID': [1, 2], 'PROGRAM_ID': [1, 1],
+                                 'FIRM_ID': [1, 1], 'IS_DELETED': [0, 0]})
+        if name == "programs.sql":
+            return pd.DataFrame({'PROGRAM_ID': [1], 'PROGRAM_NAME': ['A']})
+
+        start, end = (pd.Timestamp(value) for value in re.findall(r"TO_DATE\('(\d{8})'", query))
+        window = self.transactions[(self.transactions['TRANSACTION_DATE'] >= start) &
+                                   (self.transactions['TRANSACTION_DATE'] < end)]
+        if name == "transactions-first-date.sql":
+            return pd.DataFrame({'FIRST_TRANSACTION_DATE': [window['TRANSACTION_DATE'].min()]})
+
+        if self.fail_after is not None and len(self.windows) >= self.fail_after:
+            raise RuntimeError("connection lost")
+        self.windows.append((start, end))
+        return window.copy()
+
+
+def make_transactions(start: str, end: str) -> pd.DataFrame:
+    dates = pd.date_range(start, end, freq="12h")
+    return pd.DataFrame({
+        'CUSTOMER_ID': np.arange(len(dates)) % 2 + 1,
+        'PROGRAM_ID': 1,
+        'TRX_STATE_ID': 1,
+        'TRANSACTION_ID': np.arange(len(dates)),
+        'TRANSACTION_DATE': dates,
+        'TIMED_ID_TRANSACTION': dates.strftime("%Y%m%d").astype(float),
+        'AMOUNT_AFTER_DISCOUNT': 10.0,
+        'AMOUNT_DISCOUNT': 1.0,
+        'AMOUNT_EARNED_POINT': 0.5,
+        'AMOUNT_USED_POINT': 0.0,
+    })
+
+
+@pytest.fixture
+def extract(tmp_path):
+    return TransactionExtract("TEST_CDP", extract_dir=str(tmp_path / "TEST_CDP"))
+
+
+def test_full_refresh_fetches_one_month_at_a_time(extract):
+    db = ExtractDatabase(make_transactions("2025-01-15", "2025-04-10"))
+    manifest = extract.refresh(db, today=pd.Timestamp("2025-04-10"))
+
+    assert extract.months() == ["202501", "202502", "202503", "202504"]
+    assert all(end <= start + pd.offsets.MonthBegin(1) for start, end in db.windows)
+    assert sum(manifest["rows"].values()) == len(db.transactions)
+    stored = extract.read_transactions(['TRANSACTION_ID'])['TRANSACTION_ID']
+    assert sorted(stored) == sorted(db.transactions['TRANSACTION_ID'])
+
+
+def test_failed_full_refresh_keeps_the_extract(extract):
+    db = ExtractDatabase(make_transactions("2025-01-15", "2025-04-10"))
+    extract.refresh(db, today=pd.Timestamp("2025-04-10"))
+    manifest = extract.load_manifest()
+
+    db.windows, db.fail_after = [], 2
+    with pytest.raises(RuntimeError):
+        extract.refresh(db, today=pd.Timestamp("2025-05-01"), force=True)
+
+    assert extract.months() == ["202501", "202502", "202503", "202504"]
+    assert extract.load_manifest()["rows"] == manifest["rows"]
+    assert len(extract.read_transactions(['TRANSACTION_ID'])) == len(db.transactions)
+
+
+def test_incremental_refresh_reloads_recent_months(extract):
+    db = ExtractDatabase(make_transactions("2025-01-15", "2025-04-10"))
+    extract.refresh(db, today=pd.Timestamp("2025-04-10"))
+
+    db.transactions = make_transactions("2025-01-15", "2025-04-12")
+    db.windows = []
+    manifest = extract.refresh(db, today=pd.Timestamp("2025-04-12"))
+
+    assert [start.strftime("%Y%m") for start, _ in db.windows] == ["202504"]
+    assert manifest["rows"]["202504"] == (db.transactions['TRANSACTION_DATE'] >= "2025-04-01").sum()
+    assert len(extract.read_transactions(['TRANSACTION_ID'])) == len(db.transactions)